@@ -0,0 +1,65 @@
+"""Compare the memory used by networkx graphs and CompactGraph."""
+#
+#   bench/bench_compact.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_compact [grid side]
+
+import sys
+import time
+import tracemalloc
+import soffit.generate as gen
+import soffit.graph as sg
+from soffit.compact import CompactGraph, TagTable
+from soffit.parse import parseGraphString
+
+def measure( build ):
+    tracemalloc.start()
+    g = build()
+    ( current, peak ) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ( g, current )
+
+def matchTime( g ):
+    finder = sg.MatchFinder( g, already_labeled = True )
+    finder.maxMatches = 1000
+    finder.leftSide( parseGraphString( "A[x]; A--B [e]; B[x]" ) )
+    finder.rightSide( parseGraphString( "A[y]; A--B [e]; B[x]" ) )
+    start = time.time()
+    matches = finder.matches()
+    return ( len( matches ), time.time() - start )
+
+def main():
+    side = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100
+
+    template = gen.squareGrid( side, side, nodeTags = "x", edgeTags = "e" )
+    tags = TagTable()
+    ( nxGraph, nxBytes ) = measure( lambda : template.copy() )
+    ( compact, compactBytes ) = measure( lambda : CompactGraph.fromGraph( template, tags ) )
+    elements = len( template ) + template.number_of_edges()
+
+    print( "{} nodes, {} edges".format( len( template ), template.number_of_edges() ) )
+    print( "{:>10} {:>10} {:>14} {:>10} {:>10}".format(
+        "graph", "MB", "bytes/element", "matches", "match s" ) )
+    for ( name, g, size ) in [ ( "networkx", nxGraph, nxBytes ),
+                               ( "compact", compact, compactBytes ) ]:
+        ( count, elapsed ) = matchTime( g )
+        print( "{:>10} {:10.1f} {:14.1f} {:10} {:10.2f}".format(
+            name, size / 1e6, size / elements, count, elapsed ) )
+
+if __name__ == "__main__":
+    main()
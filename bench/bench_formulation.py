@@ -0,0 +1,88 @@
+"""Compare node variables and edge variables for matching."""
+#
+#   bench/bench_formulation.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_formulation [grid side]
+
+import sys
+import time
+import networkx as nx
+import soffit.graph as sg
+from soffit.parse import parseGraphString
+
+# Squares and other edge-dense patterns, on a grid like the ones
+# doc/examples/grid.json draws.
+patterns = [ ( "square", "A->B [h]; C->D [h]; A->C [v]; B->D [v]" ),
+             ( "corner", "A->B [h]; A->C [v]; B->D [v]" ),
+             ( "domino", "A->B->E [h]; C->D->F [h]; A->C [v]; B->D [v]; E->F [v]" ),
+             ( "row", "A->B->C->D [h]" ),
+             ( "marked", "A->B [h]; C->D [h]; A->C [v]; B->D [v]; A[m]" ),
+             ( "cross", "A->B [h]; C->B [v]; B->D [h]; B->E [v]" ),
+             ( "rare", "A->B [r]; C->D [h]; A->C [v]; B->D [v]" ),
+             ( "rare row", "A->B [h]; B->C [r]; C->D [h]" ) ]
+
+def grid( side ):
+    g = nx.DiGraph()
+    for i in range( side ):
+        for j in range( side ):
+            g.add_node( i * side + j )
+            if j + 1 < side:
+                g.add_edge( i * side + j, i * side + j + 1, tag = "h" )
+            if i + 1 < side:
+                g.add_edge( i * side + j, ( i + 1 ) * side + j, tag = "v" )
+    for n in range( 0, side * side, 7 ):
+        g.nodes[n]['tag'] = "m"
+    for n in range( 3, side * side - 1, 29 ):
+        if g.has_edge( n, n + 1 ):
+            g.edges[n, n + 1]['tag'] = "r"
+    g.graph['nextId'] = side * side
+    g.graph['node_tag_cache'] = {}
+    g.graph['edge_tag_cache'] = {}
+    return g
+
+def run( g, left, formulation ):
+    start = time.time()
+    finder = sg.MatchFinder( g, already_labeled = True )
+    finder.fastPaths = False
+    finder.formulation = formulation
+    finder.leftSide( left )
+    matches = finder.matches()
+    return ( time.time() - start, len( matches ) )
+
+def main():
+    side = int( sys.argv[1] ) if len( sys.argv ) > 1 else 30
+    g = grid( side )
+    print( "{} nodes, {} edges".format( len( g ), g.number_of_edges() ) )
+    print( "{:>8} {:>8} {:>8} {:>8} {:>8} {:>8}".format(
+        "pattern", "matches", "nodes", "edges", "auto", "chose" ) )
+    for ( name, text ) in patterns:
+        left = parseGraphString( text )
+        times = []
+        for formulation in [ "nodes", "edges", None ]:
+            ( elapsed, n ) = run( g, left, formulation )
+            times.append( elapsed )
+        finder = sg.MatchFinder( g, already_labeled = True )
+        finder.fastPaths = False
+        finder.verbose = False
+        chose = sg.chooseFormulation( left, g, *finder.edgeRequirements( left ),
+                                       finder.tagCounts( left ) )
+        print( "{:>8} {:8} {:8.3f} {:8.3f} {:8.3f} {:>8}".format(
+            name, n, times[0], times[1], times[2], chose ) )
+
+if __name__ == "__main__":
+    main()
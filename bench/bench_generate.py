@@ -0,0 +1,77 @@
+"""Benchmark the large start graph generators."""
+#
+#   bench/bench_generate.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_generate [max nodes]
+
+import sys
+import time
+import math
+import soffit.generate as gen
+
+tags = { "x" : 4, "y" : 1 }
+
+generators = [
+    ( "squareGrid",
+      lambda n: gen.squareGrid( int( math.sqrt( n ) ), int( math.sqrt( n ) ),
+                                nodeTags = tags, edgeTags = "e" ) ),
+    ( "triangularLattice",
+      lambda n: gen.triangularLattice( int( math.sqrt( n ) ), int( math.sqrt( n ) ),
+                                       nodeTags = tags ) ),
+    ( "balancedTree",
+      lambda n: gen.balancedTree( 2, int( math.log2( n ) ), nodeTags = tags,
+                                  directed = True ) ),
+    ( "randomTree",
+      lambda n: gen.randomTree( n, nodeTags = tags ) ),
+    ( "randomGraph",
+      lambda n: gen.randomGraph( n, 2 * n, nodeTags = tags, edgeTags = tags ) ),
+]
+
+def stringRoundTrip( n ):
+    """The old path: a networkx grid rendered to a grammar string."""
+    side = int( math.sqrt( n ) )
+    g = gen.undirectedSquareGrid( side, side, nodeTag = "x" )
+    return gen.grammarWithStartRule( g )
+
+def timeIt( f, n ):
+    start = time.time()
+    g = f( n )
+    return ( time.time() - start, g )
+
+def main():
+    maxNodes = int( sys.argv[1] ) if len( sys.argv ) > 1 else 1000000
+    sizes = [ 10 ** k for k in range( 3, 8 ) if 10 ** k <= maxNodes ]
+
+    print( "{:>18} {:>9} {:>9} {:>10} {:>12}".format(
+        "generator", "nodes", "edges", "seconds", "nodes/sec" ) )
+    for ( name, f ) in generators:
+        for n in sizes:
+            ( elapsed, g ) = timeIt( f, n )
+            print( "{:>18} {:9} {:9} {:10.3f} {:12.0f}".format(
+                name, len( g.nodes ), len( g.edges ), elapsed,
+                len( g.nodes ) / max( elapsed, 1e-9 ) ) )
+
+    for n in sizes:
+        if n > 100000:
+            break
+        ( elapsed, s ) = timeIt( stringRoundTrip, n )
+        print( "{:>18} {:9} {:>9} {:10.3f}   (string only, before parsing)".format(
+            "compactRep", n, "", elapsed ) )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Compare the memory used by per-iteration copies and by GraphHistory."""
+#
+#   bench/bench_history.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_history [grid side] [iterations]
+
+import sys
+import time
+import random
+import tracemalloc
+import soffit.generate as gen
+from soffit.application import ApplicationState
+from soffit.parse import parseGraphGrammar
+
+grammar = """{
+    "version" : "0.1",
+    "A[x]" : "A[y]; A--B; B[z]"
+}"""
+
+def run( side, iterations, history ):
+    random.seed( 1 )
+    g = gen.squareGrid( side, side, nodeTags = "x" )
+    copies = []
+    callback = None if history else ( lambda i, g : copies.append( g.copy() ) )
+    app = ApplicationState( initialGraph = g,
+                            grammar = parseGraphGrammar( grammar ),
+                            callback = callback,
+                            already_numbered = True )
+    app.verbose = False
+
+    tracemalloc.start()
+    start = time.time()
+    if history:
+        app.recordHistory()
+    app.run( maxIterations = iterations )
+    elapsed = time.time() - start
+    ( current, peak ) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ( elapsed, current )
+
+def main():
+    side = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100
+    iterations = int( sys.argv[2] ) if len( sys.argv ) > 2 else 200
+
+    print( "{} nodes, {} iterations".format( side * side, iterations ) )
+    print( "{:>10} {:>10} {:>12}".format( "history", "seconds", "MB retained" ) )
+    for ( name, history ) in [ ( "copy()", False ), ( "snapshot", True ) ]:
+        ( elapsed, retained ) = run( side, iterations, history )
+        print( "{:>10} {:10.2f} {:12.1f}".format( name, elapsed, retained / 1e6 ) )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""Benchmark command-line cold start."""
+#
+#   bench/bench_import.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_import [repetitions]
+#
+# Each measurement is a fresh interpreter, so this includes interpreter
+# startup.  test/test_startup.py checks that the rendering libraries
+# stay out of the import graph.
+
+import sys
+import subprocess
+import time
+
+commands = [
+    ( "python", "pass" ),
+    ( "networkx", "import networkx" ),
+    ( "soffit.parse", "import soffit.parse" ),
+    ( "soffit.graph", "import soffit.graph" ),
+    ( "soffit.application", "import soffit.application" ),
+]
+
+def coldStart( code ):
+    start = time.time()
+    subprocess.check_call( [ sys.executable, "-c", code ] )
+    return time.time() - start
+
+def main():
+    reps = int( sys.argv[1] ) if len( sys.argv ) > 1 else 5
+    print( "{:>20} {:>8} {:>8}".format( "import", "best", "mean" ) )
+    for ( name, code ) in commands:
+        samples = [ coldStart( code ) for i in range( reps ) ]
+        print( "{:>20} {:8.3f} {:8.3f}".format( name, min( samples ),
+                                               sum( samples ) / reps ) )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Compare the fast-path matcher for small left sides with the solver."""
+#
+#   bench/bench_match.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_match [grid side]
+
+import sys
+import time
+import soffit.generate as gen
+import soffit.graph as sg
+from soffit.parse import parseGraphString
+
+rules = [ ( "node", "A[x]", "A[y]" ),
+          ( "edge", "A[x]; B[x]; A--B", "A[y]; B[x]; A--B" ),
+          ( "delete", "A[x]; B[x]; A--B", "B[x]" ),
+          ( "path", "A[x]; B[x]; C[x]; A--B--C", "A[x]; C[x]; A--C" ),
+          ( "triangle", "A[x]; B[x]; C[x]; A--B--C--A", "A[x]; B[x]; C[x]" ) ]
+
+def run( g, left, right, fast ):
+    start = time.time()
+    finder = sg.MatchFinder( g, already_labeled = True )
+    finder.fastPaths = fast
+    finder.leftSide( left )
+    finder.rightSide( right )
+    matches = finder.matches()
+    return ( time.time() - start, len( matches ) )
+
+def main():
+    side = int( sys.argv[1] ) if len( sys.argv ) > 1 else 30
+    g = gen.triangularLattice( side, side, nodeTags = "x" )
+    g.graph['node_tag_cache'] = {}
+    g.graph['edge_tag_cache'] = {}
+
+    print( "{} nodes, {} edges".format( len( g ), g.number_of_edges() ) )
+    print( "{:>10} {:>8} {:>10} {:>10} {:>8}".format(
+        "rule", "matches", "solver", "fast path", "speedup" ) )
+    for ( name, l, r ) in rules:
+        left = parseGraphString( l )
+        right = parseGraphString( r, joinAllowed=True )
+        ( slow, n ) = run( g, left, right, False )
+        ( fast, n2 ) = run( g, left, right, True )
+        assert n == n2
+        print( "{:>10} {:8} {:10.3f} {:10.3f} {:7.1f}x".format(
+            name, n, slow, fast, slow / fast ) )
+
+if __name__ == "__main__":
+    main()
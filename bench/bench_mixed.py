@@ -0,0 +1,70 @@
+"""Compare an undirected graph made directed with to_directed() and with
+MixedGraph, which stores each undirected edge once."""
+#
+#   bench/bench_mixed.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_mixed [grid side]
+
+import sys
+import time
+import tracemalloc
+import soffit.generate as gen
+import soffit.graph as sg
+from soffit.mixed import MixedGraph
+from soffit.parse import parseGraphString
+
+def measure( build ):
+    tracemalloc.start()
+    g = build()
+    ( current, peak ) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return ( g, current )
+
+def matchTime( g, left, right ):
+    g.graph['node_tag_cache'] = {}
+    g.graph['edge_tag_cache'] = {}
+    finder = sg.MatchFinder( g, already_labeled = True )
+    finder.maxMatches = 1000
+    start = time.time()
+    finder.leftSide( parseGraphString( left ).to_directed() )
+    finder.rightSide( parseGraphString( right ).to_directed() )
+    matches = finder.matches()
+    return ( len( matches ), time.time() - start )
+
+def main():
+    side = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100
+
+    template = gen.squareGrid( side, side, nodeTags = "x", edgeTags = "e" )
+    for n in range( 0, len( template ), 17 ):
+        template.nodes[n]['tag'] = "y"
+    ( doubled, doubledBytes ) = measure( lambda : template.to_directed() )
+    ( mixed, mixedBytes ) = measure( lambda : MixedGraph.fromGraph( template ) )
+
+    print( "{} nodes, {} undirected edges".format( len( template ),
+                                                    template.number_of_edges() ) )
+    print( "{:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "graph", "MB", "matches", "pair s", "delete s" ) )
+    for ( name, g, size ) in [ ( "doubled", doubled, doubledBytes ),
+                               ( "mixed", mixed, mixedBytes ) ]:
+        ( count, pair ) = matchTime( g, "A[y]; A--B [e]; B[x]", "A[y]; A--B [f]; B[x]" )
+        ( _, delete ) = matchTime( g, "A[y]; A--B [e]; B[x]; B--C [e]", "A[y]; C[x]" )
+        print( "{:>10} {:10.1f} {:10} {:10.3f} {:10.3f}".format(
+            name, size / 1e6, count, pair, delete ) )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Time matching one expensive rule with several worker processes."""
+#
+#   bench/bench_parallel.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_parallel [grid side] [max jobs]
+
+import sys
+import time
+import soffit.generate as gen
+import soffit.graph as sg
+from soffit.parse import parseGraphString
+
+left = "A[x]; B[x]; C[x]; D[x]; A--B--D--C--A"
+right = "A[x]; B[x]; C[x]; D[x]; A--D"
+
+def run( g, jobs ):
+    start = time.time()
+    finder = sg.MatchFinder( g, already_labeled = True )
+    finder.breakSymmetry = True
+    finder.jobs = jobs
+    finder.leftSide( parseGraphString( left ) )
+    finder.rightSide( parseGraphString( right, joinAllowed = True ) )
+    matches = finder.matches()
+    return ( time.time() - start, len( matches ) )
+
+def main():
+    side = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100
+    maxJobs = int( sys.argv[2] ) if len( sys.argv ) > 2 else 4
+    g = gen.squareGrid( side, side, nodeTags = "x" )
+    g.graph['node_tag_cache'] = {}
+    g.graph['edge_tag_cache'] = {}
+
+    print( "{} nodes, {} edges".format( len( g ), g.number_of_edges() ) )
+    print( "{:>5} {:>8} {:>8} {:>8}".format( "jobs", "matches", "seconds", "speedup" ) )
+    jobs = 1
+    while jobs <= maxJobs:
+        ( elapsed, n ) = run( g, jobs )
+        if jobs == 1:
+            serial = elapsed
+        print( "{:5} {:8} {:8.3f} {:7.1f}x".format( jobs, n, elapsed, serial / elapsed ) )
+        jobs *= 2
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Count the solver's work matching the example grammars' rules."""
+#
+#   bench/bench_search.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_search [iterations]
+
+import sys
+import time
+import random
+import networkx as nx
+import soffit.graph as sg
+from soffit.application import ApplicationState, loadGrammar
+
+examples = [ "grid", "pentomino", "dormans-pggd", "tree", "euler-circuit",
+             "chain", "mathpuzzle", "tracery" ]
+
+def grow( name, iterations ):
+    """The graph after running an example grammar for a while."""
+    random.seed( 1 )
+    grammar = loadGrammar( "doc/examples/{}.json".format( name ), verbose = False )
+    app = ApplicationState( initialGraph = grammar.start, grammar = grammar )
+    app.verbose = False
+    app.run( maxIterations = iterations )
+    graph = app.graph
+    if nx.is_directed( graph ):
+        grammar = grammar.directedGrammar()
+    elif grammar.directed:
+        graph = graph.to_directed()
+    return ( grammar, graph )
+
+def search( grammar, graph, propagate, planOrder ):
+    """Match every rule with the solver; return the total time and counts."""
+    graph.graph['node_tag_cache'] = {}
+    graph.graph['edge_tag_cache'] = {}
+    totals = { 'matches' : 0 }
+    start = time.time()
+    for r in grammar.rules:
+        for right in r.rightSide():
+            finder = sg.MatchFinder( graph, already_labeled = True )
+            finder.fastPaths = False
+            finder.solver.propagate = propagate
+            finder.planOrder = planOrder
+            finder.leftSide( r.leftSide() )
+            finder.rightSide( right )
+            totals['matches'] += len( finder.matches() )
+            for ( k, v ) in finder.solver.stats.items():
+                totals[k] = totals.get( k, 0 ) + v
+    return ( time.time() - start, totals )
+
+def main():
+    iterations = int( sys.argv[1] ) if len( sys.argv ) > 1 else 100
+    print( "{:>14} {:>9} {:>5} {:>8} {:>9} {:>9} {:>10} {:>10} {:>8}".format(
+        "grammar", "propagate", "plan", "matches", "domains", "after",
+        "assigned", "backtracks", "seconds" ) )
+    for name in examples:
+        ( grammar, graph ) = grow( name, iterations )
+        for propagate in [ False, True ]:
+            for planOrder in [ False, True ]:
+                ( elapsed, t ) = search( grammar, graph, propagate, planOrder )
+                print( "{:>14} {:>9} {:>5} {:8} {:9} {:9} {:10} {:10} {:8.3f}".format(
+                    name, str( propagate ), str( planOrder ), t['matches'],
+                    t['domains_before'], t['domains_after'], t['assignments'],
+                    t['backtracks'], elapsed ) )
+
+if __name__ == "__main__":
+    main()
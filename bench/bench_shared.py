@@ -0,0 +1,75 @@
+"""Compare pickling the working graph with a shared-memory snapshot."""
+#
+#   bench/bench_shared.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_shared [workers]
+
+import sys
+import time
+import pickle
+import soffit.generate as gen
+import soffit.graph as sg
+from soffit.shared import SharedSnapshot
+from soffit.parse import parseGraphString
+
+def match( g ):
+    g.graph['node_tag_cache'] = {}
+    g.graph['edge_tag_cache'] = {}
+    finder = sg.MatchFinder( g, already_labeled = True )
+    finder.leftSide( parseGraphString( "A[x]; B[y]; C[x]; A--B--C" ) )
+    return len( finder.matches() )
+
+def main():
+    workers = int( sys.argv[1] ) if len( sys.argv ) > 1 else 4
+    print( "{:>8} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}".format(
+        "nodes", "pickled", "bytes", "exported", "bytes", "attached", "match x" ) )
+    for side in [ 30, 100, 300 ]:
+        g = gen.squareGrid( side, side, nodeTags = "x" )
+        for n in range( 0, len( g ), 17 ):
+            g.nodes[n]['tag'] = "y"
+
+        # One pickle per worker, as a spawned Pool's initializer would send.
+        start = time.time()
+        for i in range( workers ):
+            data = pickle.dumps( g )
+            pickle.loads( data )
+        pickled = time.time() - start
+
+        start = time.time()
+        s = SharedSnapshot( g )
+        exported = time.time() - start
+        start = time.time()
+        views = [ s.handle().attach() for i in range( workers ) ]
+        attached = time.time() - start
+
+        start = time.time()
+        match( g )
+        direct = time.time() - start
+        start = time.time()
+        match( views[0] )
+        shared = time.time() - start
+
+        print( "{:8} {:10.4f} {:10} {:10.4f} {:10} {:10.4f} {:10.2f}".format(
+            len( g ), pickled, len( data ), exported, s.shm.size, attached,
+            shared / direct ) )
+        for v in views:
+            v.close()
+        s.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Time iterations of a grammar whose rules mostly fail to match, with
+rules matched one at a time and several at once."""
+#
+#   bench/bench_speculate.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+# Run from the top of the repository:
+#   python -m bench.bench_speculate [grid side] [iterations] [max speculate]
+
+import sys
+import time
+import random
+import soffit.generate as gen
+from soffit.application import ApplicationState
+from soffit.parse import parseGraphGrammar
+
+# One rule grows the grid's marked region; the rest search the whole
+# grid for odd cycles, which a grid does not have.
+grammar = """{
+    "version" : "0.1",
+    "A[y]; B[x]; A--B" : "A[y]; B[y]; A--B",
+    "A[x]; B[x]; C[x]; A--B--C--A" : "A[x]; B[x]; C[x]",
+    "A[x]; B[x]; C[x]; D[x]; E[x]; A--B--C--D--E--A" : "A[x]; B[x]; C[x]; D[x]; E[x]",
+    "A[x]; B[x]; C[x]; D[x]; E[x]; A--B--C--D--E--A; A--F" : "A[x]; B[x]; C[x]; D[x]; E[x]; F",
+    "A[x]; B[x]; C[x]; D[x]; E[x]; F[x]; G[x]; A--B--C--D--E--F--G--A" : "A[x]"
+}"""
+
+def run( side, iterations, speculate ):
+    random.seed( 1 )
+    g = gen.squareGrid( side, side, nodeTags = "x" )
+    g.nodes[0]['tag'] = "y"
+    app = ApplicationState( initialGraph = g,
+                            grammar = parseGraphGrammar( grammar ) )
+    app.verbose = False
+    app.speculate = speculate
+    start = time.time()
+    app.run( maxIterations = iterations )
+    return time.time() - start
+
+def main():
+    side = int( sys.argv[1] ) if len( sys.argv ) > 1 else 30
+    iterations = int( sys.argv[2] ) if len( sys.argv ) > 2 else 10
+    maxSpeculate = int( sys.argv[3] ) if len( sys.argv ) > 3 else 4
+    print( "{:>9} {:>8} {:>8}".format( "speculate", "seconds", "speedup" ) )
+    speculate = 1
+    while speculate <= maxSpeculate:
+        elapsed = run( side, iterations, speculate )
+        if speculate == 1:
+            serial = elapsed
+        print( "{:9} {:8.3f} {:7.1f}x".format( speculate, elapsed, serial / elapsed ) )
+        speculate *= 2
+
+if __name__ == "__main__":
+    main()
@@ -18,9 +18,14 @@
 #
 
 import networkx as nx
-from soffit.graph import MatchFinder, RuleApplication, graphIdentifiersToNumbers
+from soffit.graph import MatchFinder, RuleApplication, graphIdentifiersToNumbers, \
+    verifyLevels, defaultVerify, UndoLog, compactNodeIds
+from soffit.mixed import MixedGraph, mixedGraph
+from soffit.persistent import GraphHistory
+from soffit.canonical import GraphHasher, graphHash
+from soffit.tags import TagTable, internTags, externTags
 import soffit.parse as parse
-import soffit.display
+import soffit.graphfile as graphfile
 import random
 from functools import reduce
 import time
@@ -44,7 +49,7 @@ def makeAllDirected( *graphs ):
 def to_dot( g ):
     from networkx.drawing.nx_agraph import to_agraph
     
-    ag = to_agraph( g )
+    ag = to_agraph( externTags( g ) )
     try:
         del ag.graph_attr['join']
         del ag.graph_attr['rename']
@@ -58,6 +63,7 @@ class Timing(object):
         self.keyCache = {}
         self.samples = {}
         self.enumSamples = {}
+        self.solverStats = {}
         
     def key( self, left, right ):
         k = self.keyCache.get( (left,right), None )
@@ -68,7 +74,9 @@ class Timing(object):
         self.keyCache[(left,right)] = nk
         return nk
         
-    def addSample( self, left, right, total, enum ):
+    def addSample( self, left, right, total, enum, stats = None ):
+        """Record one attempt to match a rule; stats are the solver's
+        counts (see soffit.constraint.MatchSolver), if it ran."""
         k = self.key( left, right )
         if k in self.samples:
             self.samples[k].append( total )
@@ -76,6 +84,10 @@ class Timing(object):
         else:
             self.samples[k] = [ total ]
             self.enumSamples[k] = [ enum ]
+        if stats is not None:
+            totals = self.solverStats.setdefault( k, {} )
+            for ( name, count ) in stats.items():
+                totals[name] = totals.get( name, 0 ) + count
 
     def report( self ):
         for ( k, v ) in self.samples.items():
@@ -86,9 +98,109 @@ class Timing(object):
             enumAvg = sum( self.enumSamples[k] ) / len( self.enumSamples[k] )
             print( "Mean: {:.3f} / {:3f}".format( enumAvg, avg ) )
             print( "Max: {:.3f}".format( max( v ) ) )
+            stats = self.solverStats.get( k, None )
+            if stats is not None:
+                print( "Domains: {} before propagation, {} after".format(
+                    stats['domains_before'], stats['domains_after'] ) )
+                print( "Search: {} assignments, {} backtracks".format(
+                    stats['assignments'], stats['backtracks'] ) )
                 
+def matchRule( graph, left, rightChoices, pick_first = False, jobs = 1,
+               first = True, pool = None ):
+    """Match a rule's left side in graph, then each of its right sides in
+    turn.  Returns ( right, finder, matches, seconds ) for each right side
+    tried: up to the first with a match if 'first' is set, otherwise all
+    of them.  With jobs > 1, the workers come from pool if it is given."""
+    tried = []
+    # With several right sides, match the left side once and filter
+    # those matches for each right side.
+    leftFinder = None
+    for right in rightChoices:
+        start = time.time()
+        finder = MatchFinder( graph, already_labeled = True )
+        finder.breakSymmetry = True
+        finder.jobs = jobs
+        finder.pool = pool
+        if pick_first:
+            finder.maxMatches = 1
+        if leftFinder is not None:
+            finder.shareLeftSide( leftFinder )
+        else:
+            finder.leftSide( left )
+            if len( rightChoices ) > 1 and not pick_first:
+                finder.solveLeftSide()
+                leftFinder = finder
+        finder.rightSide( right )
+        possibleMatches = finder.matches()
+        tried.append( ( right, finder, possibleMatches, time.time() - start ) )
+        if first and len( possibleMatches ) > 0:
+            break
+    return tried
+
+def _matchRuleInWorker( task ):
+    """Match every right side of one rule, in a worker process; see
+    _speculativeMatches."""
+    from soffit.parallel import workerState
+    ( i, pick_first ) = task
+    ( graph, rules ) = workerState()
+    r = rules[i]
+    return [ ( matches, seconds, finder.solver.stats )
+             for ( right, finder, matches, seconds )
+             in matchRule( graph, r.leftSide(), r.graphs()[1:], pick_first,
+                           first = False ) ]
+
+def _speculativeMatches( graph, rules, ruleAttemptOrder, pick_first, workers ):
+    """Match the rules in ruleAttemptOrder, up to 'workers' at a time in
+    worker processes, and yield the results for each rule in that order:
+    ( matches, seconds, solver stats ) for each of its right sides, in
+    the order of r.graphs().
+
+    Only 'workers' rules are submitted ahead of the one being consumed.
+    Closing the generator submits no more and waits for those already
+    submitted.  (Terminating the pool instead could kill a worker while
+    it held the result queue's lock, and then hang.)"""
+    # Worker processes are only needed with --speculate, so don't load
+    # them at startup.
+    from collections import deque
+    from itertools import islice
+    from soffit.parallel import initWorker, workerContext, workerSnapshot
+    position = { id( r ) : i for ( i, r ) in enumerate( rules ) }
+    tasks = iter( [ ( position[id( r )], pick_first ) for r in ruleAttemptOrder ] )
+    context = workerContext()
+    pool = context.Pool( workers, initWorker,
+                         ( workerSnapshot( graph, context ), rules ) )
+    try:
+        pending = deque( pool.apply_async( _matchRuleInWorker, ( t, ) )
+                         for t in islice( tasks, workers ) )
+        while len( pending ) > 0:
+            result = pending.popleft().get()
+            for t in islice( tasks, 1 ):
+                pending.append( pool.apply_async( _matchRuleInWorker, ( t, ) ) )
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+
 def chooseAndApply( grammar, graph, timing = None, verbose = False,
-                    pick_first = False ):
+                    pick_first = False, verify = None, undo = None,
+                    jobs = 1, speculate = 1, pool = None ):
+    """Apply one randomly chosen rule to graph, modifying it in place (unless
+    it must first be converted to a directed graph.)  If an UndoLog is
+    given, the changes are recorded in it.  With jobs > 1, each rule's
+    matches are found by that many worker processes, from the
+    soffit.parallel.MatchPool pool if one is given.
+
+    With speculate > 1, that many rules are matched at once, in worker
+    processes, ahead of the one being considered; the rule applied is the
+    same one as when they are matched one at a time."""
+    # The grammar's rules were made consistent when it was loaded, so at
+    # most one of the two needs converting, once.  An undirected graph
+    # becomes a MixedGraph, which keeps each of its edges as one edge.
+    if nx.is_directed( graph ):
+        grammar = grammar.directedGrammar()
+    elif grammar.directed:
+        graph = mixedGraph( graph )
+
     nRules = len( grammar.rules )
     # This is a little wasteful but simpler than removing rules
     # since they don't currently have an equality check.
@@ -96,62 +208,140 @@ def chooseAndApply( grammar, graph, timing = None, verbose = False,
 
     rule_count = 0
 
-    # Only convert the graph once!
-    # FIXME: could we do it even less often than that, maybe carry over from
-    # one interaction to the next?
-    graph = nx.convert_node_labels_to_integers( graph, label_attribute="orig" )
-    for n in graph:
-        graph.nodes[n]['orig'] = n
+    # The graph is rewritten in place, so node IDs stay stable from one
+    # iteration to the next; but the tag caches are stale.
     graph.graph['node_tag_cache'] = {}
     graph.graph['edge_tag_cache'] = {}
 
-    for r in ruleAttemptOrder:
-        left = r.leftSide()
-        for right in r.rightSide():
-            rule_count += 1
-            
-            # Covert to directed on-demand
-            # FIXME: do it ahead of time if any directed graphs exist in the rule set?
-            (left, right, graph) = makeAllDirected( left, right, graph )
-
-            start = time.time()
-            finder = MatchFinder( graph, already_labeled = True )
-            if pick_first:
-                finder.maxMatches = 1
-            finder.leftSide( left )
-            finder.rightSide( right )
-            possibleMatches = finder.matches()
-            end = time.time()
+    speculative = None
+    if speculate > 1 and nRules > 1:
+        speculative = _speculativeMatches( graph, grammar.rules, ruleAttemptOrder,
+                                           pick_first, speculate )
+    try:
+        for r in ruleAttemptOrder:
+            left = r.leftSide()
+            rightChoices = r.rightSide()
+            if speculative is None:
+                tried = [ ( right, finder, matches, seconds, finder.solver.stats )
+                          for ( right, finder, matches, seconds )
+                          in matchRule( graph, left, rightChoices, pick_first, jobs,
+                                        pool = pool ) ]
+            else:
+                # Take the right sides in the order chosen here, as they
+                # would have been tried.
+                results = next( speculative )
+                rights = r.graphs()[1:]
+                tried = []
+                for right in rightChoices:
+                    i = next( i for ( i, g ) in enumerate( rights ) if g is right )
+                    tried.append( ( right, None ) + results[i] )
+                    if len( results[i][0] ) > 0:
+                        break
+
+            for ( right, finder, possibleMatches, seconds, stats ) in tried:
+                rule_count += 1
+                if timing is not None:
+                    timing.addSample( left, right, seconds, 0, stats )
 
-            if timing is not None:
-                timing.addSample( left, right, end - start, 0 )
+            ( right, finder, possibleMatches, seconds, stats ) = tried[-1]
             if len( possibleMatches ) == 0:
-                # Try next right side
                 continue
-            
+
+            if finder is None:
+                finder = MatchFinder( graph, already_labeled = True )
+                finder.setRule( left, right )
             chosenMatch = random.choice( possibleMatches )
             rule = RuleApplication( finder, chosenMatch )
-            # Don't need another copy here, because we made one above.
-            return rule.result( copy=False ), rule_count, len( possibleMatches ), chosenMatch
+            return rule.result( copy=False, verify=verify, undo=undo ), rule_count, len( possibleMatches ), chosenMatch
+    finally:
+        if speculative is not None:
+            speculative.close()
 
     raise NoMatchException()
 
 class ApplicationState:
     """Apply a graph grammar to a rule.  Contains capabilities for profiling the
     graph grammar, logging output as it runs, and limiting the amount of runtime. (TBD)"""
-    def __init__( self, initialGraph, grammar = None, callback = None ):
+    def __init__( self, initialGraph, grammar = None, callback = None,
+                  already_numbered = False ):
         """Specify the initial graph and (optionally) a starting grammar.
         The "callback" function will be called once per iteration with the
-        iteration number and the current graph.
+        iteration number and the current graph.  The graph is rewritten in
+        place, so a callback that keeps it must copy it, or use
+        recordHistory() instead.
+
+        Deleted node IDs are not reused, so once the gaps outnumber the
+        live nodes the graph is renumbered (see compact_ids.)  A callback
+        that tracks nodes by ID can follow self.renumbered, which maps old
+        IDs to new ones after such an iteration and is None otherwise.
+
+        If already_numbered is set, initialGraph must already be labeled
+        with integers and have a nextId attribute, as produced by
+        graphIdentifiersToNumbers or soffit.graphfile, and is used as-is,
+        unless it is directed and must be copied into a MixedGraph.
         """
         self.grammar = grammar
-        self.graph = graphIdentifiersToNumbers( initialGraph )
+        if already_numbered:
+            self.graph = initialGraph
+        else:
+            self.graph = graphIdentifiersToNumbers( initialGraph )
+        if nx.is_directed( self.graph ) and not isinstance( self.graph, MixedGraph ):
+            # Keep pairs of opposite arcs as single undirected edges.
+            self.graph = MixedGraph.fromGraph( self.graph )
         self.iteration = 0
         self.callback = callback
         self.verbose = True
         self.timing = None
         self.fast_mode = False
+        # How much checking to do on each rule application: "off", "local"
+        # (only the matched elements), or "full" (copies the whole graph.)
+        self.verify_level = defaultVerify
+        # Worker processes to use in matching each rule; see soffit.parallel.
+        # They are kept in match_pool from one iteration to the next.
+        self.match_jobs = 1
+        self.match_pool = None
+        # Rules to match at once, in worker processes; see chooseAndApply.
+        self.speculate = 1
+        self.history = None
+        self.hasher = None
+        self.tags = None
+        # Renumber nodes 0..n-1 when more than half the IDs are unused.
+        self.compact_ids = True
+        self.renumbered = None
         
+    def recordHistory( self ):
+        """Keep a read-only snapshot of the graph after every iteration, in
+        self.history.snapshots.  Snapshots share structure, so each one costs
+        memory proportional to the rewrite rather than the whole graph."""
+        self.history = GraphHistory( self.graph )
+        self.history.snapshot( self.graph )
+
+    def internTags( self ):
+        """Store tags in the working graph and grammar as small integers,
+        interned in self.tags; see soffit.tags.  Callbacks then see the
+        integer tags, but display and soffit.graphfile convert them back."""
+        if self.tags is not None:
+            return
+        self.tags = self.grammar.tags if self.grammar is not None else TagTable()
+        self.graph = internTags( self.graph, self.tags )
+        if self.grammar is not None:
+            self.grammar = self.grammar.internTags( self.tags )
+        if self.history is not None:
+            self.recordHistory()
+        if self.hasher is not None:
+            self.hasher = GraphHasher( self.graph, self.hasher.iterations )
+
+    def trackHash( self ):
+        """Maintain the graph's canonical hash incrementally, updating it
+        after each iteration from the nodes and edges that changed."""
+        self.hasher = GraphHasher( self.graph )
+
+    def graphHash( self ):
+        """The canonical hash of the current graph; see soffit.canonical."""
+        if self.hasher is not None:
+            return self.hasher.hexdigest()
+        return graphHash( self.graph )
+
     def startProfile( self ):
         self.timing = Timing()
         self.verbose = True
@@ -161,15 +351,70 @@ class ApplicationState:
             self.timing.report()
         
     def changeGrammar( self, grammar ):
+        if self.tags is not None:
+            grammar = grammar.internTags( self.tags )
         self.grammar = grammar
         self.iteration = 0 # FIXME?
         
+    def _recordChanges( self, undo, converted ):
+        if converted:
+            # The graph was replaced by a directed copy; start over.
+            if self.history is not None:
+                self.history.rebase( self.graph )
+            if self.hasher is not None:
+                self.hasher = GraphHasher( self.graph, self.hasher.iterations )
+        else:
+            if self.history is not None:
+                self.history.update( self.graph, undo )
+            if self.hasher is not None:
+                self.hasher.update( self.graph, *undo.changes() )
+
+    def _compactIds( self ):
+        self.renumbered = None
+        live = len( self.graph )
+        if not self.compact_ids or \
+           self.graph.graph['nextId'] - live <= max( live, 64 ):
+            return
+        ( self.graph, self.renumbered ) = compactNodeIds( self.graph )
+        if self.history is not None:
+            self.history.rebase( self.graph )
+        if self.hasher is not None:
+            self.hasher.renumber( self.renumbered )
+
+    def _matchPool( self ):
+        if self.match_jobs <= 1:
+            return None
+        if self.match_pool is None or self.match_pool.jobs != self.match_jobs:
+            from soffit.parallel import MatchPool
+            self.close()
+            self.match_pool = MatchPool( self.match_jobs )
+        return self.match_pool
+
+    def close( self ):
+        """Stop the worker processes kept for matching, if any."""
+        if self.match_pool is not None:
+            self.match_pool.close()
+            self.match_pool = None
+
     def runSingleIter( self ):
+        tracking = self.history is not None or self.hasher is not None
+        undo = UndoLog() if tracking else None
+        directed = nx.is_directed( self.graph )
         self.graph, rules_checked, matches_found, match = \
                 chooseAndApply( self.grammar, self.graph,
                                 timing=self.timing,
                                 verbose=self.verbose,
-                                pick_first=self.fast_mode )
+                                pick_first=self.fast_mode,
+                                verify=self.verify_level,
+                                undo=undo,
+                                jobs=self.match_jobs,
+                                speculate=self.speculate,
+                                pool=self._matchPool() )
+        if tracking:
+            self._recordChanges( undo, nx.is_directed( self.graph ) != directed )
+        self._compactIds()
+        if self.history is not None:
+            self.history.snapshot( self.graph )
 
         if self.verbose:
             print( "Iteration {:6} | {:6} nodes | {:4} attempts | {:4} matches | {} ".format(
@@ -199,14 +444,14 @@ class ApplicationState:
                 print( "No matching rule found at iteration {}".format( self.iteration ) )
             return False
 
-def loadGrammar( rulesetFilename, verbose=True ):
+def loadGrammar( rulesetFilename, verbose=True, jobs=None ):
     if verbose:
         print( "Loading grammar from", rulesetFilename )
         
     # FIXME: catch file not found error
     with open( rulesetFilename, "r" ) as f:
         try:
-            return parse.loadGraphGrammar( f  )
+            return parse.loadGraphGrammar( f, jobs=jobs )
         except parse.ParseError as pe:
             pe.prettyPrint()
             exit( 1 )
@@ -224,6 +469,9 @@ def applyRuleset( rulesetFilename,
                             grammar=grammar,
                             callback=callback )
     app.run( maxIterations=maxIterations )
+    # Imported here so that runs which do not render never load matplotlib
+    # or pygraphviz.
+    import soffit.display
     soffit.display.drawSvg( app.graph, outputFile )
 
 def main():
@@ -237,16 +485,51 @@ def main():
     # TODO: allow multiple output!
     # TODO: respect file format (graphviz may do this automatically)88 
     parser.add_argument( "-o", "--output",
-                         default="soffit.svg",
-                         help="Output file to write, default soffit.svg" )
+                         help="Output file to write, default soffit.svg (or soffit.json with --no-render)" )
+    parser.add_argument( "--no-render",
+                         action="store_true",
+                         help="Write the final graph as node-link JSON (or an edge list, if the output does not end in .json) instead of rendering it." )
     parser.add_argument( "--profile",
                          help="Profile the graph grammar.",
                          action="store_true" )
+    parser.add_argument( "--start-file",
+                         help="Read the start graph from this file instead of the first grammar." )
+    parser.add_argument( "--start-format",
+                         choices=sorted( graphfile.formats.keys() ),
+                         help="Format of the start file, default nodelink for .json files and edgelist otherwise" )
+    parser.add_argument( "-j", "--jobs",
+                         type=int,
+                         default=1,
+                         help="Number of processes to use when parsing grammars, default 1" )
+    parser.add_argument( "--match-jobs",
+                         type=int,
+                         default=1,
+                         help="Number of processes to use when matching each rule, default 1" )
+    parser.add_argument( "--speculate",
+                         type=int,
+                         default=1,
+                         help="Number of rules to match at once in separate processes, default 1" )
+    parser.add_argument( "--verify",
+                         choices=verifyLevels,
+                         default=defaultVerify,
+                         help="Check each rule application: off, local (matched elements only), or full (copies the graph), default " + defaultVerify )
     a = parser.parse_args()
 
-    grammars = [ loadGrammar( fn ) for fn in a.grammar ]
-    app = ApplicationState( initialGraph = grammars[0].start )
+    grammars = [ loadGrammar( fn, jobs=a.jobs ) for fn in a.grammar ]
+    if a.start_file is not None:
+        try:
+            start = graphfile.loadGraphFile( a.start_file, a.start_format )
+        except parse.ParseError as pe:
+            pe.prettyPrint()
+            exit( 1 )
+        app = ApplicationState( initialGraph = start, already_numbered = True )
+    else:
+        app = ApplicationState( initialGraph = grammars[0].start )
 
+    app.verify_level = a.verify
+    app.match_jobs = a.match_jobs
+    app.speculate = a.speculate
+    app.internTags()
     for g in grammars:
         app.changeGrammar( g )
         if a.profile:
@@ -254,9 +537,20 @@ def main():
         app.run( maxIterations = a.iterations )
         if a.profile:
             app.reportProfile()
+    app.close()
 
-    print( "Writing final graph to", a.output )
-    soffit.display.drawSvg( app.graph, a.output )
+    if a.profile:
+        print( "Graph parse cache:", parse.parseCacheInfo() )
+
+    if a.no_render:
+        output = a.output or "soffit.json"
+        print( "Writing final graph to", output )
+        graphfile.saveGraphFile( app.graph, output )
+    else:
+        output = a.output or "soffit.svg"
+        print( "Writing final graph to", output )
+        import soffit.display
+        soffit.display.drawSvg( app.graph, output )
 
 if __name__ == "__main__":
     main()
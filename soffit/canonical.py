@@ -0,0 +1,185 @@
+"""Isomorphism-invariant hashing of tagged graphs."""
+#
+#   soffit/canonical.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+# The hash is Weisfeiler-Lehman refinement with tags: a node's level-0
+# label is its tag, and its level-(i+1) label digests its level-i label
+# together with the sorted (direction, edge tag, level-i label) of each
+# neighbor.  The graph hash combines every node's label at every level by
+# addition, so it doesn't depend on node IDs or order.
+#
+# Isomorphic graphs always hash the same.  Rarely, non-isomorphic graphs
+# do too (WL cannot tell apart some regular graphs), so GraphSet can
+# confirm a hash match with an exact isomorphism test.
+#
+# A node's level-i label depends only on its radius-i neighborhood, so
+# after a rewrite GraphHasher recomputes only the nodes within that
+# distance of the changed elements.
+
+import hashlib
+import networkx as nx
+
+_LABEL_BYTES = 16
+_MODULUS = 1 << ( 8 * _LABEL_BYTES )
+
+def _digest( parts ):
+    return hashlib.blake2b( repr( parts ).encode( 'utf-8' ),
+                            digest_size = _LABEL_BYTES ).digest()
+
+class GraphHasher(object):
+    """The WL hash of a graph, kept up to date as the graph is rewritten."""
+
+    def __init__( self, g, iterations = 3 ):
+        self.iterations = iterations
+        self.directed = nx.is_directed( g )
+        # labels[i][n] is node n's level-i label
+        self.labels = [ {} for i in range( iterations + 1 ) ]
+        self.total = 0
+        self._relabel( g, set( g.nodes ), [ set( g.nodes ) ] * ( iterations + 1 ) )
+
+    def _neighborhood( self, g, n, prev ):
+        if self.directed:
+            nbrs = [ ( ">", repr( d.get( 'tag', None ) ), prev[m] )
+                     for ( m, d ) in g.succ[n].items() ] + \
+                   [ ( "<", repr( d.get( 'tag', None ) ), prev[m] )
+                     for ( m, d ) in g.pred[n].items() ]
+        else:
+            nbrs = [ ( "-", repr( d.get( 'tag', None ) ), prev[m] )
+                     for ( m, d ) in g.adj[n].items() ]
+        nbrs.sort()
+        return tuple( nbrs )
+
+    def _relabel( self, g, removed, balls ):
+        """Drop the labels of removed nodes, and recompute level i for
+        the nodes in balls[i]."""
+        total = self.total
+        for level in self.labels:
+            for n in removed:
+                old = level.pop( n, None )
+                if old is not None:
+                    total -= int.from_bytes( old, 'little' )
+
+        for ( i, ball ) in enumerate( balls ):
+            level = self.labels[i]
+            if i == 0:
+                new = { n : _digest( ( 0, g.nodes[n].get( 'tag', None ) ) )
+                        for n in ball }
+            else:
+                prev = self.labels[i-1]
+                new = { n : _digest( ( i, prev[n],
+                                       self._neighborhood( g, n, prev ) ) )
+                        for n in ball }
+            for ( n, label ) in new.items():
+                old = level.get( n, None )
+                if old is not None:
+                    total -= int.from_bytes( old, 'little' )
+                total += int.from_bytes( label, 'little' )
+                level[n] = label
+
+        self.total = total % _MODULUS
+
+    def update( self, g, nodes, edges ):
+        """Bring the hash up to date after a change to g that touched only
+        the given nodes and edges, e.g. from UndoLog.changes()."""
+        seeds = set( nodes )
+        for ( a, b ) in edges:
+            seeds.add( a )
+            seeds.add( b )
+        removed = set( n for n in seeds if n not in g )
+
+        ball = set( n for n in seeds if n in g )
+        frontier = ball
+        balls = [ ball ]
+        for i in range( self.iterations ):
+            nextFrontier = set()
+            for n in frontier:
+                nextFrontier.update( m for m in g.adj[n] if m not in ball )
+                if self.directed:
+                    nextFrontier.update( m for m in g.pred[n] if m not in ball )
+            ball = ball | nextFrontier
+            balls.append( ball )
+            frontier = nextFrontier
+
+        self._relabel( g, removed, balls )
+
+    def renumber( self, mapping ):
+        """Follow a renumbering of the graph's nodes, such as the one
+        returned by compactNodeIds.  The hash is unchanged."""
+        self.labels = [ { mapping.get( n, n ) : label for ( n, label ) in level.items() }
+                        for level in self.labels ]
+
+    def hexdigest( self ):
+        """The hash of the graph, as a hex string."""
+        return _digest( ( self.directed, len( self.labels[0] ),
+                          self.total ) ).hex()
+
+def graphHash( g, iterations = 3 ):
+    """A hex string which is equal for isomorphic graphs with the same
+    node and edge tags."""
+    return GraphHasher( g, iterations ).hexdigest()
+
+_tagMatch = nx.algorithms.isomorphism.categorical_node_match( 'tag', None )
+_edgeTagMatch = nx.algorithms.isomorphism.categorical_edge_match( 'tag', None )
+
+def isomorphic( g, h ):
+    """Exact check that g and h are the same up to node IDs, with tags."""
+    return nx.is_isomorphic( g, h,
+                             node_match = _tagMatch,
+                             edge_match = _edgeTagMatch )
+
+class GraphSet(object):
+    """A set of graphs up to isomorphism.  If confirm is False, only hashes
+    are kept, and a graph that is WL-equivalent to but not isomorphic with
+    a member is wrongly reported as present; if True, the graphs themselves
+    are kept and compared exactly when their hashes agree."""
+
+    def __init__( self, confirm = True, iterations = 3 ):
+        self.confirm = confirm
+        self.iterations = iterations
+        self.buckets = {}
+
+    def __len__( self ):
+        if self.confirm:
+            return sum( len( b ) for b in self.buckets.values() )
+        else:
+            return len( self.buckets )
+
+    def _find( self, g, digest ):
+        if digest is None:
+            digest = graphHash( g, self.iterations )
+        bucket = self.buckets.get( digest, None )
+        if bucket is None:
+            return ( digest, False )
+        if not self.confirm:
+            return ( digest, True )
+        return ( digest, any( isomorphic( g, h ) for h in bucket ) )
+
+    def __contains__( self, g ):
+        return self._find( g, None )[1]
+
+    def add( self, g, digest = None ):
+        """Add g, unless an isomorphic graph is already present.  Returns
+        True if g was added.  digest may be passed in if already known,
+        e.g. from a GraphHasher."""
+        ( digest, found ) = self._find( g, digest )
+        if found:
+            return False
+        bucket = self.buckets.setdefault( digest, [] )
+        if self.confirm:
+            bucket.append( g )
+        return True
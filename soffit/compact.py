@@ -0,0 +1,486 @@
+"""An array-backed working graph with interned tags."""
+#
+#   soffit/compact.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+# A networkx graph spends a dict per node, a dict per adjacency, and an
+# attribute dict per node and edge, several hundred bytes per edge in all.
+# CompactGraph instead keeps:
+#
+#   _nodeTag[n]     tag ID of node n; 0 if untagged, -1 if there is no node n
+#   _edgeSrc[e], _edgeDst[e], _edgeTag[e]
+#                   endpoints and tag ID of edge slot e; _edgeSrc is -1 for
+#                   a free slot, and free slots are reused
+#   _incident[n]    array of the edge slots at node n.  In a directed graph
+#                   an incoming edge e is stored as ~e.
+#
+# Tags are interned in a TagTable and stored as small integers.  Only the
+# 'tag' attribute is stored.
+#
+# The adapter implements the part of the networkx Graph/DiGraph API that
+# MatchFinder, RuleApplication, and UndoLog use, so they run on either.
+# Edge lookups scan the adjacency of one endpoint, which is fast for the
+# low-degree graphs that grammars produce.  Iterating with data=True
+# returns fresh attribute dicts; nodes[n] and edges[a,b] return live
+# views which can be modified.
+
+from array import array
+from collections.abc import MutableMapping
+import networkx as nx
+from soffit.tags import TagTable
+
+def _attrDict( tags, t ):
+    if t > 0:
+        return { 'tag' : tags.names[t] }
+    else:
+        return {}
+
+class _Attributes(MutableMapping):
+    """The attribute dict of one node or edge, backed by an entry of a
+    tag array."""
+    __slots__ = ( 'tags', 'table', 'index' )
+
+    def __init__( self, tags, table, index ):
+        self.tags = tags
+        self.table = table
+        self.index = index
+
+    def __getitem__( self, key ):
+        if key == 'tag':
+            t = self.table[self.index]
+            if t > 0:
+                return self.tags.names[t]
+        raise KeyError( key )
+
+    def __setitem__( self, key, value ):
+        if key != 'tag':
+            raise ValueError( "CompactGraph only stores the 'tag' attribute" )
+        self.table[self.index] = self.tags.intern( value )
+
+    def __delitem__( self, key ):
+        if key != 'tag' or self.table[self.index] == 0:
+            raise KeyError( key )
+        self.table[self.index] = 0
+
+    def __iter__( self ):
+        if self.table[self.index] > 0:
+            yield 'tag'
+
+    def __len__( self ):
+        return 1 if self.table[self.index] > 0 else 0
+
+    def __repr__( self ):
+        return repr( dict( self ) )
+
+class _NodeView(object):
+    def __init__( self, g ):
+        self._g = g
+
+    def __iter__( self ):
+        return ( n for ( n, t ) in enumerate( self._g._nodeTag ) if t >= 0 )
+
+    def __len__( self ):
+        return self._g._numNodes
+
+    def __contains__( self, n ):
+        return self._g.has_node( n )
+
+    def __getitem__( self, n ):
+        if not self._g.has_node( n ):
+            raise KeyError( n )
+        return _Attributes( self._g.tags, self._g._nodeTag, n )
+
+    def __call__( self, data = False, default = None ):
+        if data is False:
+            return self
+        names = self._g.tags.names
+        tags = enumerate( self._g._nodeTag )
+        if data is True:
+            return ( ( n, _attrDict( self._g.tags, t ) ) for ( n, t ) in tags if t >= 0 )
+        elif data == 'tag':
+            return ( ( n, names[t] if t > 0 else default ) for ( n, t ) in tags if t >= 0 )
+        else:
+            return ( ( n, default ) for ( n, t ) in tags if t >= 0 )
+
+class _EdgeView(object):
+    def __init__( self, g, edges = None ):
+        self._g = g
+        # Restricted to these slots, or all if None
+        self._edges = edges
+
+    def _slots( self ):
+        if self._edges is None:
+            return ( e for ( e, s ) in enumerate( self._g._edgeSrc ) if s >= 0 )
+        return self._edges
+
+    def __iter__( self ):
+        src = self._g._edgeSrc
+        dst = self._g._edgeDst
+        return ( ( src[e], dst[e] ) for e in self._slots() )
+
+    def __len__( self ):
+        if self._edges is None:
+            return self._g._numEdges
+        return len( self._edges )
+
+    def __contains__( self, e ):
+        ( a, b ) = e
+        return self._g._findEdge( a, b ) >= 0
+
+    def __getitem__( self, e ):
+        ( a, b ) = e
+        slot = self._g._findEdge( a, b )
+        if slot < 0:
+            raise KeyError( e )
+        return _Attributes( self._g.tags, self._g._edgeTag, slot )
+
+    def __call__( self, nbunch = None, data = False, default = None ):
+        if nbunch is None:
+            view = self
+        else:
+            view = _EdgeView( self._g, self._g._edgesAt( nbunch, out = True ) )
+        return view._withData( data, default )
+
+    def _withData( self, data, default ):
+        if data is False:
+            return self
+        g = self._g
+        src = g._edgeSrc
+        dst = g._edgeDst
+        tag = g._edgeTag
+        names = g.tags.names
+        if data is True:
+            return ( ( src[e], dst[e], _attrDict( g.tags, tag[e] ) )
+                     for e in self._slots() )
+        elif data == 'tag':
+            return ( ( src[e], dst[e], names[tag[e]] if tag[e] > 0 else default )
+                     for e in self._slots() )
+        else:
+            return ( ( src[e], dst[e], default ) for e in self._slots() )
+
+class _AdjacencyView(object):
+    """n => { neighbor : attributes }, built on demand."""
+    def __init__( self, g, incoming ):
+        self._g = g
+        self._incoming = incoming
+
+    def __iter__( self ):
+        return iter( self._g.nodes )
+
+    def __len__( self ):
+        return len( self._g.nodes )
+
+    def __contains__( self, n ):
+        return self._g.has_node( n )
+
+    def __getitem__( self, n ):
+        g = self._g
+        if not g.has_node( n ):
+            raise KeyError( n )
+        return { m : _attrDict( g.tags, g._edgeTag[e] )
+                 for ( m, e ) in g._neighbors( n, self._incoming ) }
+
+class CompactGraph(object):
+    """A Graph or DiGraph with non-negative integer nodes, stored in arrays.
+    See the comment at the top of soffit/compact.py."""
+
+    def __init__( self, directed = False, tags = None ):
+        self.directed = directed
+        self.tags = tags if tags is not None else TagTable()
+        self.graph = {}
+        self._nodeTag = array( 'i' )
+        self._numNodes = 0
+        self._incident = []
+        self._edgeSrc = array( 'i' )
+        self._edgeDst = array( 'i' )
+        self._edgeTag = array( 'i' )
+        self._freeEdges = array( 'i' )
+        self._numEdges = 0
+        self._makeViews()
+
+    def _makeViews( self ):
+        self.nodes = _NodeView( self )
+        self.edges = _EdgeView( self )
+        self.adj = _AdjacencyView( self, False )
+        if self.directed:
+            self.succ = self.adj
+            self.pred = _AdjacencyView( self, True )
+
+    @classmethod
+    def fromGraph( cls, g, tags = None ):
+        """Convert a networkx graph with non-negative integer nodes, such
+        as one from graphIdentifiersToNumbers."""
+        c = cls( nx.is_directed( g ), tags )
+        c.graph.update( g.graph )
+        c.add_nodes_from( ( n, d.get( 'tag', None ) ) for ( n, d ) in g.nodes( data=True ) )
+        for ( a, b, tag ) in g.edges( data='tag' ):
+            c._setEdgeTag( c._addEdge( a, b ), tag )
+        if 'nextId' not in c.graph:
+            c.graph['nextId'] = len( c._nodeTag )
+        return c
+
+    def toNetworkx( self ):
+        """Convert to a networkx Graph or DiGraph with string tags."""
+        g = nx.DiGraph() if self.directed else nx.Graph()
+        g.graph.update( self.graph )
+        g.add_nodes_from( self.nodes( data=True ) )
+        g.add_edges_from( self.edges( data=True ) )
+        return g
+
+    def is_directed( self ):
+        return self.directed
+
+    def is_multigraph( self ):
+        return False
+
+    def __len__( self ):
+        return self._numNodes
+
+    def __iter__( self ):
+        return iter( self.nodes )
+
+    def __contains__( self, n ):
+        return self.has_node( n )
+
+    def __getitem__( self, n ):
+        return self.adj[n]
+
+    def number_of_nodes( self ):
+        return self._numNodes
+
+    def number_of_edges( self ):
+        return self._numEdges
+
+    def has_node( self, n ):
+        return isinstance( n, int ) and 0 <= n < len( self._nodeTag ) and \
+            self._nodeTag[n] >= 0
+
+    # Nodes
+
+    def _addNode( self, n ):
+        if n < 0:
+            raise ValueError( "CompactGraph nodes must be non-negative integers" )
+        if n >= len( self._nodeTag ):
+            k = n + 1 - len( self._nodeTag )
+            self._nodeTag.extend( [ -1 ] * k )
+            self._incident.extend( [ None ] * k )
+        if self._nodeTag[n] < 0:
+            self._nodeTag[n] = 0
+            self._incident[n] = array( 'i' )
+            self._numNodes += 1
+
+    def add_node( self, n, **attr ):
+        self._addNode( n )
+        if 'tag' in attr:
+            self._nodeTag[n] = self.tags.intern( attr['tag'] )
+
+    def add_nodes_from( self, nodes ):
+        """Add nodes given as n, (n, attributes), or (n, tag)."""
+        for x in nodes:
+            if isinstance( x, tuple ):
+                ( n, d ) = x
+                self._addNode( n )
+                tag = d.get( 'tag', None ) if isinstance( d, dict ) or \
+                    isinstance( d, MutableMapping ) else d
+                if tag is not None:
+                    self._nodeTag[n] = self.tags.intern( tag )
+            else:
+                self._addNode( x )
+
+    def remove_node( self, n ):
+        if not self.has_node( n ):
+            raise nx.NetworkXError( "The node {} is not in the graph.".format( n ) )
+        for e in list( self._incident[n] ):
+            if e < 0:
+                e = ~e
+            if self._edgeSrc[e] >= 0:
+                self._removeEdgeSlot( e )
+        self._nodeTag[n] = -1
+        self._incident[n] = None
+        self._numNodes -= 1
+
+    def remove_nodes_from( self, nodes ):
+        for n in nodes:
+            if self.has_node( n ):
+                self.remove_node( n )
+
+    # Edges
+
+    def _findEdge( self, a, b ):
+        if not self.has_node( a ):
+            return -1
+        src = self._edgeSrc
+        dst = self._edgeDst
+        for e in self._incident[a]:
+            if e >= 0:
+                if dst[e] == b and src[e] == a:
+                    return e
+                if not self.directed and src[e] == b and dst[e] == a:
+                    return e
+        return -1
+
+    def _addEdge( self, a, b ):
+        e = self._findEdge( a, b )
+        if e >= 0:
+            return e
+        self._addNode( a )
+        self._addNode( b )
+        if len( self._freeEdges ) > 0:
+            e = self._freeEdges.pop()
+            self._edgeSrc[e] = a
+            self._edgeDst[e] = b
+            self._edgeTag[e] = 0
+        else:
+            e = len( self._edgeSrc )
+            self._edgeSrc.append( a )
+            self._edgeDst.append( b )
+            self._edgeTag.append( 0 )
+        self._incident[a].append( e )
+        if self.directed:
+            self._incident[b].append( ~e )
+        elif a != b:
+            self._incident[b].append( e )
+        self._numEdges += 1
+        return e
+
+    def _setEdgeTag( self, e, tag ):
+        if tag is not None:
+            self._edgeTag[e] = self.tags.intern( tag )
+
+    def add_edge( self, a, b, **attr ):
+        e = self._addEdge( a, b )
+        if 'tag' in attr:
+            self._edgeTag[e] = self.tags.intern( attr['tag'] )
+
+    def add_edges_from( self, edges ):
+        for x in edges:
+            e = self._addEdge( x[0], x[1] )
+            if len( x ) > 2 and 'tag' in x[2]:
+                self._edgeTag[e] = self.tags.intern( x[2]['tag'] )
+
+    def _removeEdgeSlot( self, e ):
+        a = self._edgeSrc[e]
+        b = self._edgeDst[e]
+        self._incident[a].remove( e )
+        if self.directed:
+            self._incident[b].remove( ~e )
+        elif a != b:
+            self._incident[b].remove( e )
+        self._edgeSrc[e] = -1
+        self._edgeDst[e] = -1
+        self._edgeTag[e] = 0
+        self._freeEdges.append( e )
+        self._numEdges -= 1
+
+    def has_edge( self, a, b ):
+        return self._findEdge( a, b ) >= 0
+
+    def remove_edge( self, a, b ):
+        e = self._findEdge( a, b )
+        if e < 0:
+            raise nx.NetworkXError( "The edge {}-{} is not in the graph".format( a, b ) )
+        self._removeEdgeSlot( e )
+
+    def remove_edges_from( self, edges ):
+        for x in edges:
+            e = self._findEdge( x[0], x[1] )
+            if e >= 0:
+                self._removeEdgeSlot( e )
+
+    # Adjacency
+
+    def _neighbors( self, n, incoming = False ):
+        """(neighbor, edge slot) for edges out of n, or into n if incoming."""
+        src = self._edgeSrc
+        dst = self._edgeDst
+        for e in self._incident[n]:
+            if self.directed:
+                if incoming:
+                    if e < 0:
+                        yield ( src[~e], ~e )
+                elif e >= 0:
+                    yield ( dst[e], e )
+            else:
+                yield ( dst[e] if src[e] == n else src[e], e )
+
+    def _edgesAt( self, nbunch, out ):
+        if nbunch in self:
+            nbunch = [ nbunch ]
+        slots = []
+        seen = set()
+        for n in nbunch:
+            if not self.has_node( n ):
+                continue
+            for e in self._incident[n]:
+                if self.directed:
+                    if ( e >= 0 ) == out:
+                        slots.append( e if e >= 0 else ~e )
+                elif e not in seen:
+                    seen.add( e )
+                    slots.append( e )
+        return slots
+
+    def neighbors( self, n ):
+        return ( m for ( m, e ) in self._neighbors( n ) )
+
+    successors = neighbors
+
+    def predecessors( self, n ):
+        return ( m for ( m, e ) in self._neighbors( n, True ) )
+
+    def out_edges( self, nbunch = None, data = False, default = None ):
+        return self.edges( nbunch, data, default )
+
+    def in_edges( self, nbunch = None, data = False, default = None ):
+        if nbunch is None:
+            return self.edges( None, data, default )
+        return _EdgeView( self, self._edgesAt( nbunch, out = False ) )._withData( data, default )
+
+    def degree( self, n ):
+        """The degree of node n; a self-loop counts twice, as in networkx."""
+        d = len( self._incident[n] )
+        if not self.directed:
+            src = self._edgeSrc
+            d += sum( 1 for e in self._incident[n] if src[e] == self._edgeDst[e] )
+        return d
+
+    # Copies
+
+    def copy( self ):
+        c = CompactGraph( self.directed, self.tags )
+        c.graph = dict( self.graph )
+        c._nodeTag = array( 'i', self._nodeTag )
+        c._numNodes = self._numNodes
+        c._incident = [ ( array( 'i', a ) if a is not None else None )
+                        for a in self._incident ]
+        c._edgeSrc = array( 'i', self._edgeSrc )
+        c._edgeDst = array( 'i', self._edgeDst )
+        c._edgeTag = array( 'i', self._edgeTag )
+        c._freeEdges = array( 'i', self._freeEdges )
+        c._numEdges = self._numEdges
+        return c
+
+    def to_directed( self ):
+        if self.directed:
+            return self.copy()
+        c = CompactGraph( True, self.tags )
+        c.graph = dict( self.graph )
+        c.add_nodes_from( ( n, t ) for ( n, t ) in self.nodes( data='tag' ) )
+        for ( a, b, tag ) in self.edges( data='tag' ):
+            c._setEdgeTag( c._addEdge( a, b ), tag )
+            c._setEdgeTag( c._addEdge( b, a ), tag )
+        return c
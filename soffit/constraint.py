@@ -17,7 +17,8 @@
 #   limitations under the License.
 #
 
-from constraint import Constraint, Unassigned, Domain
+from constraint import Constraint, Unassigned, Domain, BacktrackingSolver
+from collections import deque
 
 # These two Constraint implementations are much, much slower than using
 # TupleConstraint. I don't understand why.
@@ -297,6 +298,31 @@ class TupleConstraint(Constraint):
             allowed = set( domains[v] ).intersection( self.nthSet[i] )
             domains[v] = Domain( list( allowed ) )
 
+    def revise( self, variables, domains ):
+        """Remove the values of a pair of variables that have no support
+        in the other's domain; see arcConsistency().  Returns the
+        variables whose domains shrank."""
+        if len( variables ) != 2:
+            return []
+        ( v, w ) = variables
+        if v == w:
+            kept = [ x for x in domains[v] if x in self.forward.get( x, () ) ]
+            if len( kept ) == len( domains[v] ):
+                return []
+            domains[v] = Domain( kept )
+            return [ v ]
+
+        changed = []
+        for ( x, y, supports ) in [ ( v, w, self.forward ),
+                                    ( w, v, self.backward ) ]:
+            other = set( domains[y] )
+            kept = [ a for a in domains[x]
+                     if not other.isdisjoint( supports.get( a, () ) ) ]
+            if len( kept ) < len( domains[x] ):
+                domains[x] = Domain( kept )
+                changed.append( x )
+        return changed
+
         
 
 class ConditionalConstraint(Constraint):
@@ -460,14 +486,66 @@ class NonoverlappingUnorderedPairs(Constraint):
             for v in variables:
                 vconstraints[v].remove( (self, variables) )
     
-# I think this will work for directed edges only.
+class SharedEndpointConstraint(Constraint):
+    """Two variables whose values are edges (i,j) must agree on a shared
+    endpoint: position 'first' of the first edge is position 'second'
+    of the other."""
+    def __init__( self, first, second ):
+        self.first = first
+        self.second = second
+
+    def __call__(self, variables, domains, assignments, forwardcheck=False):
+        ( v, w ) = variables
+        e = assignments.get( v, Unassigned )
+        f = assignments.get( w, Unassigned )
+        if e is not Unassigned and f is not Unassigned:
+            return e[self.first] == f[self.second]
+
+        if forwardcheck:
+            if e is not Unassigned:
+                ( domain, pos, x ) = ( domains[w], self.second, e[self.first] )
+            elif f is not Unassigned:
+                ( domain, pos, x ) = ( domains[v], self.first, f[self.second] )
+            else:
+                return True
+            for g in list( domain ):
+                if g[pos] != x:
+                    domain.hideValue( g )
+            if not domain:
+                return False
+        return True
+
+def _canCover( targets, candidates ):
+    """Is there a matching of the variables in candidates (a dictionary
+    of variable => allowed values) to distinct values that uses every value
+    in targets?  Kuhn's augmenting path algorithm."""
+    owner = {}
+    for t in targets:
+        seen = set()
+        def augment( t ):
+            for v in candidates:
+                if t in candidates[v] and v not in seen:
+                    seen.add( v )
+                    if v not in owner or augment( owner[v] ):
+                        owner[v] = t
+                        return True
+            return False
+        if not augment( t ):
+            return False
+    return True
+
 class DanglingEdgeConstraint(Constraint):
+    """No edge of the graph may be left dangling: every edge at the
+    image of a deleted node must be the image of a deleted edge."""
     def __init__( self, graph, deletedNodes, deletedEdges ):
         self.graph = graph
         self.deletedNodes = deletedNodes
         self.deletedEdges = deletedEdges
 
     def __call__(self, variables, domains, assignments, forwardcheck=False):
+        if not self.graph.is_directed():
+            return self._undirected( domains, assignments, forwardcheck )
+
         # All the variables are node assignments, some in deletedNodes
         # and some should be deleted edge endpoints.
         for n in self.deletedNodes:
@@ -507,4 +585,220 @@ class DanglingEdgeConstraint(Constraint):
                 return False
             
         return True
+
+    def _undirected( self, domains, assignments, forwardcheck ):
+        # Each neighbor of a deleted node n must be matched to a different
+        # neighbor of its image, covering all of them.  Rather than list
+        # the ways of doing that, check that one exists among the values
+        # still available.
+        for n in self.deletedNodes:
+            n_i = assignments.get( n, Unassigned )
+            if n_i is Unassigned:
+                continue
+
+            neighbors = set( b if a == n else a
+                             for (a,b) in self.deletedEdges
+                             if a == n or b == n )
+            graph_neighbors = set( self.graph[n_i] )
+            if len( graph_neighbors ) != len( neighbors ):
+                return False
+
+            uncovered = set( graph_neighbors )
+            candidates = {}
+            for v in neighbors:
+                v_i = assignments.get( v, Unassigned )
+                if v_i is Unassigned:
+                    candidates[v] = domains[v]
+                elif v_i in uncovered:
+                    uncovered.remove( v_i )
+                else:
+                    return False
+
+            if forwardcheck:
+                for v in candidates:
+                    for x in list( domains[v] ):
+                        if x not in uncovered:
+                            domains[v].hideValue( x )
+                    if not domains[v]:
+                        return False
+
+            if not _canCover( uncovered, candidates ):
+                return False
+
+        return True
         
+
+class LexLeaderConstraint(Constraint):
+    """Given a permutation of the variables that maps the pattern being
+    matched onto itself, allow an assignment only if it is lexicographically
+    smaller (in the order the variables are given) than the same assignment
+    permuted.  Of the assignments related by a group of such permutations,
+    only the smallest satisfies the constraints for all of them.
+
+    Values must be comparable and, as with AllDifferentConstraint, distinct."""
+    def __init__( self, permutation ):
+        self.permutation = permutation
+
+    def __call__(self, variables, domains, assignments, forwardcheck=False):
+        for v in variables:
+            w = self.permutation[v]
+            if v == w:
+                continue
+            a = assignments.get( v, Unassigned )
+            b = assignments.get( w, Unassigned )
+            if a is not Unassigned and b is not Unassigned:
+                if a == b:
+                    continue
+                return a < b
+
+            # The first undecided position: a < b is still required.
+            if forwardcheck:
+                if a is Unassigned and b is not Unassigned:
+                    for x in list( domains[v] ):
+                        if x > b:
+                            domains[v].hideValue( x )
+                    if not domains[v]:
+                        return False
+                elif b is Unassigned and a is not Unassigned:
+                    for x in list( domains[w] ):
+                        if x < a:
+                            domains[w].hideValue( x )
+                    if not domains[w]:
+                        return False
+            return True
+
+        return True
+
+def arcConsistency( domains, constraints ):
+    """Before searching, make every constraint that has a revise() method
+    arc consistent, by AC-3: revise each constraint, and again whenever
+    the domain of one of its variables shrinks.  The domains are replaced
+    in place.  Returns False if some domain is emptied, so no solution
+    exists."""
+    revisable = [ ( c, variables ) for ( c, variables ) in constraints
+                  if hasattr( c, 'revise' ) ]
+    byVariable = {}
+    for ( i, ( c, variables ) ) in enumerate( revisable ):
+        for v in variables:
+            byVariable.setdefault( v, [] ).append( i )
+
+    queue = deque( range( len( revisable ) ) )
+    queued = set( queue )
+    while queue:
+        i = queue.popleft()
+        queued.discard( i )
+        ( c, variables ) = revisable[i]
+        for v in c.revise( variables, domains ):
+            if not domains[v]:
+                return False
+            for j in byVariable[v]:
+                if j != i and j not in queued:
+                    queue.append( j )
+                    queued.add( j )
+    return True
+
+class MatchSolver(BacktrackingSolver):
+    """python-constraint's backtracking solver, with arc consistency
+    before the search (if propagate is set) and a count of the search's
+    work in self.stats:
+
+      domains_before, domains_after: total domain size before and after
+        arc consistency
+      assignments: values tried
+      backtracks: variables whose values ran out
+
+    If order is set, it maps variables to their rank in a planned order,
+    which the search follows instead of python-constraint's heuristics
+    (most constraints, then smallest domain.)  A variable whose domain is
+    down to one value still goes first, and unranked variables go last.
+    """
+    def __init__( self, propagate = True ):
+        BacktrackingSolver.__init__( self )
+        self.propagate = propagate
+        self.order = None
+        self.stats = { 'domains_before' : 0, 'domains_after' : 0,
+                       'assignments' : 0, 'backtracks' : 0 }
+
+    def getSolutionIter( self, domains, constraints, vconstraints ):
+        stats = self.stats
+        stats['domains_before'] += sum( len( d ) for d in domains.values() )
+        if self.propagate and \
+           not arcConsistency( domains, constraints ):
+            return
+        stats['domains_after'] += sum( len( d ) for d in domains.values() )
+        yield from self._search( domains, vconstraints )
+
+    def _search( self, domains, vconstraints ):
+        # BacktrackingSolver.getSolutionIter, with counters.
+        stats = self.stats
+        forwardcheck = self._forwardcheck
+        assignments = {}
+        queue = []
+
+        order = self.order
+        while True:
+            if order is not None:
+                last = len( order )
+                lst = [ ( len( domains[variable] ) > 1, order.get( variable, last ),
+                          len( domains[variable] ), variable )
+                        for variable in domains ]
+            else:
+                # Mix the Degree and Minimum Remaining Values (MRV) heuristics
+                lst = [ ( -len( vconstraints[variable] ), len( domains[variable] ), variable )
+                        for variable in domains ]
+            lst.sort()
+            for item in lst:
+                if item[-1] not in assignments:
+                    variable = item[-1]
+                    values = domains[variable][:]
+                    if forwardcheck:
+                        pushdomains = [ domains[x] for x in domains
+                                        if x not in assignments and x != variable ]
+                    else:
+                        pushdomains = None
+                    break
+            else:
+                # Every variable is assigned; go back to the last one.
+                yield assignments.copy()
+                if not queue:
+                    return
+                variable, values, pushdomains = queue.pop()
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.popState()
+
+            while True:
+                if not values:
+                    # Out of values; go back to the last variable.
+                    stats['backtracks'] += 1
+                    del assignments[variable]
+                    while queue:
+                        variable, values, pushdomains = queue.pop()
+                        if pushdomains:
+                            for domain in pushdomains:
+                                domain.popState()
+                        if values:
+                            break
+                        stats['backtracks'] += 1
+                        del assignments[variable]
+                    else:
+                        return
+
+                stats['assignments'] += 1
+                assignments[variable] = values.pop()
+
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.pushState()
+
+                for constraint, variables in vconstraints[variable]:
+                    if not constraint( variables, domains, assignments, pushdomains ):
+                        break
+                else:
+                    break
+
+                if pushdomains:
+                    for domain in pushdomains:
+                        domain.popState()
+
+            queue.append( ( variable, values, pushdomains ) )
@@ -21,6 +21,7 @@ import networkx as nx
 import matplotlib.pyplot as plt
 from soffit.parse import parseGraphString, ParseError, loadGraphGrammar
 from soffit.graph import MatchFinder, RuleApplication, graphIdentifiersToNumbers
+from soffit.tags import externTags
 import soffit.application
 from networkx.drawing.nx_agraph import to_agraph
 
@@ -49,9 +50,10 @@ def tagsToLabels( g, ignoreEquals = False ):
     tag="name"                     => { label : 'name' }
     tag="color=red; shape=circle;" => { color : 'red', shape : 'circle' }
 
-    Returns a copy of the graph.
+    Returns a copy of the graph, with interned tags converted back to
+    strings.
     """
-    rg = g.copy()
+    rg = externTags( g, copy = True )
     for n in rg.nodes:
         attr = rg.nodes[n]
         if ignoreEquals:
@@ -18,6 +18,8 @@
 #
 
 import networkx as nx
+import random
+from itertools import accumulate
 
 def nameGenerator():
     i = 0
@@ -40,12 +42,8 @@ def compactRep( g ):
             components.append( str( n ) + "[" + g.nodes[n]['tag'] + "]" )
         else:
             # Specify nodes with no edges
-            if directed:
-                if len( g.predecessors( n ) ) == 0 and len( g.successors( n ) ) == 0:
-                    components.append( str( n ) )            
-            else:
-                if len( g[n] ) == 0:
-                    components.append( str( n ) )            
+            if g.degree( n ) == 0:
+                components.append( str( n ) )
 
     for (s,t) in g.edges:
         if directed:
@@ -71,6 +69,126 @@ def undirectedSquareGrid( m, n, nodeTag = None, edgeTag = None ):
     applyTags( g, nodeTag, edgeTag )
     return g
 
+# The generators below build working graphs directly: nodes are the
+# integers 0..n-1 and 'nextId' is set, just as graphIdentifiersToNumbers
+# would leave them, so the result can be passed to ApplicationState with
+# already_numbered=True.  No string representation is ever produced.
+#
+# Tags for nodes and edges may be given as None (untagged), a single tag,
+# or a dictionary from tag to relative weight, in which case each element's
+# tag is chosen independently at random.
+
+def sampleTags( tags, k, rng = random ):
+    """Return a list of k tags drawn according to 'tags', or None if
+    the elements should be untagged."""
+    if tags is None:
+        return None
+    elif isinstance( tags, str ):
+        return [ tags ] * k
+    else:
+        population = list( tags.keys() )
+        return rng.choices( population,
+                            cum_weights = list( accumulate( tags.values() ) ),
+                            k = k )
+
+def workingGraph( numNodes, edges, nodeTags = None, edgeTags = None,
+                  directed = False, rng = random ):
+    """Build a working graph with nodes 0..numNodes-1 and the given list of
+    (source, target) edges, tagged according to nodeTags and edgeTags."""
+    g = nx.DiGraph() if directed else nx.Graph()
+
+    nt = sampleTags( nodeTags, numNodes, rng )
+    if nt is None:
+        g.add_nodes_from( range( numNodes ) )
+    else:
+        g.add_nodes_from( zip( range( numNodes ),
+                               ( { 'tag' : t } for t in nt ) ) )
+
+    et = sampleTags( edgeTags, len( edges ), rng )
+    if et is None:
+        g.add_edges_from( edges )
+    else:
+        g.add_edges_from( ( a, b, { 'tag' : t } )
+                          for ( (a, b), t ) in zip( edges, et ) )
+
+    g.graph['nextId'] = numNodes
+    return g
+
+def _gridEdges( m, n, periodic, diagonal ):
+    edges = []
+    for i in range( m ):
+        for j in range( n ):
+            x = i * n + j
+            if j + 1 < n:
+                edges.append( ( x, x + 1 ) )
+            elif periodic and n > 2:
+                edges.append( ( x, i * n ) )
+            if i + 1 < m:
+                edges.append( ( x, x + n ) )
+            elif periodic and m > 2:
+                edges.append( ( x, j ) )
+            if diagonal and i + 1 < m and j + 1 < n:
+                edges.append( ( x, x + n + 1 ) )
+    return edges
+
+def squareGrid( m, n, nodeTags = None, edgeTags = None,
+                directed = False, periodic = False, rng = random ):
+    """An m by n square lattice; node i*n+j is at row i, column j.
+    Directed edges point right and down.  If periodic, the grid wraps
+    around to form a torus."""
+    return workingGraph( m * n, _gridEdges( m, n, periodic, False ),
+                         nodeTags, edgeTags, directed, rng )
+
+def triangularLattice( m, n, nodeTags = None, edgeTags = None,
+                       directed = False, rng = random ):
+    """An m by n square lattice with a diagonal from each node to the
+    node below and to the right."""
+    return workingGraph( m * n, _gridEdges( m, n, False, True ),
+                         nodeTags, edgeTags, directed, rng )
+
+def balancedTree( branching, height, nodeTags = None, edgeTags = None,
+                  directed = False, rng = random ):
+    """A complete tree with root 0; the children of node i are
+    i*branching+1 through i*branching+branching.  Directed edges point
+    away from the root."""
+    if branching == 1:
+        numNodes = height + 1
+    else:
+        numNodes = ( branching ** ( height + 1 ) - 1 ) // ( branching - 1 )
+    edges = [ ( ( c - 1 ) // branching, c ) for c in range( 1, numNodes ) ]
+    return workingGraph( numNodes, edges, nodeTags, edgeTags, directed, rng )
+
+def randomTree( numNodes, nodeTags = None, edgeTags = None,
+                directed = False, rng = random ):
+    """A random recursive tree: each node after the first is attached
+    to a uniformly chosen earlier node."""
+    edges = [ ( rng.randrange( c ), c ) for c in range( 1, numNodes ) ]
+    return workingGraph( numNodes, edges, nodeTags, edgeTags, directed, rng )
+
+def randomGraph( numNodes, numEdges, nodeTags = None, edgeTags = None,
+                 directed = False, rng = random ):
+    """A uniformly random simple graph with the given number of nodes and
+    edges, and no self-loops."""
+    maxEdges = numNodes * ( numNodes - 1 )
+    if not directed:
+        maxEdges = maxEdges // 2
+    if numEdges > maxEdges:
+        raise ValueError( "Too many edges for {} nodes.".format( numNodes ) )
+
+    seen = set()
+    edges = []
+    while len( edges ) < numEdges:
+        a = rng.randrange( numNodes )
+        b = rng.randrange( numNodes )
+        if a == b:
+            continue
+        key = ( a, b ) if directed else ( min( a, b ), max( a, b ) )
+        if key in seen:
+            continue
+        seen.add( key )
+        edges.append( ( a, b ) )
+    return workingGraph( numNodes, edges, nodeTags, edgeTags, directed, rng )
+
 grammarTemplate = """\
 {{
   "version" : "0.1",
@@ -19,6 +19,10 @@
 
 import networkx as nx
 import random
+from soffit.tags import TagTable, internTags
+
+def _directed( g ):
+    return g if nx.is_directed( g ) else g.to_directed()
 
 class DeterministicRule(object):
     def __init__( self, left, right ):
@@ -30,6 +34,12 @@ class DeterministicRule(object):
     
     def rightSide( self ):
         return [ self.right ]
+
+    def graphs( self ):
+        return [ self.left, self.right ]
+
+    def toDirected( self ):
+        return DeterministicRule( _directed( self.left ), _directed( self.right ) )
     
 class RandomRule(object):
     def __init__( self, left, rightChoices ):
@@ -41,12 +51,40 @@ class RandomRule(object):
 
     def rightSide( self ):
         return random.sample( self.rightChoices, len( self.rightChoices ) )
+
+    def graphs( self ):
+        return [ self.left ] + list( self.rightChoices )
+
+    def toDirected( self ):
+        return RandomRule( _directed( self.left ),
+                           [ _directed( r ) for r in self.rightChoices ] )
         
 class GraphGrammar(object):
+    """A set of rules, and optionally a start graph.
+
+    If any rule contains a directed graph, every rule is converted to
+    directed as it is added, with each undirected edge becoming a pair of
+    arcs; so the rules are all directed or all undirected, and
+    self.directed says which."""
     def __init__( self ):
         self.rules = []
         self.extensions = {}
         self.start = None
+        self.directed = False
+        # Every tag used in a rule, in order of appearance.
+        self.tags = TagTable()
+        self._directedGrammar = None
+
+    def _add( self, rule ):
+        for g in rule.graphs():
+            self.tags.internGraph( g )
+        if not self.directed and any( nx.is_directed( g ) for g in rule.graphs() ):
+            self.directed = True
+            self.rules = [ r.toDirected() for r in self.rules ]
+        if self.directed:
+            rule = rule.toDirected()
+        self.rules.append( rule )
+        self._directedGrammar = None
 
     def addRule( self, left, right ):
         """Add a rule to the grammar; left and right should be networkx
@@ -54,11 +92,46 @@ class GraphGrammar(object):
 
         Corresponding node names between the two graphs will be used to 
         determine the changes requested by the rule."""
-        self.rules.append( DeterministicRule( left, right ) )
+        self._add( DeterministicRule( left, right ) )
 
     def addChoice( self, left, rightChoices ):
         """Add a rule to the grammar with multiple right-hand choices."""
-        self.rules.append( RandomRule( left, rightChoices ) )
+        self._add( RandomRule( left, rightChoices ) )
+
+    def directedGrammar( self ):
+        """This grammar if it is directed; otherwise a directed copy, for
+        use on a directed graph.  The copy is made only once."""
+        if self.directed:
+            return self
+        if self._directedGrammar is None:
+            gg = GraphGrammar()
+            gg.extensions = self.extensions
+            gg.start = self.start
+            gg.tags = self.tags
+            gg.directed = True
+            gg.rules = [ r.toDirected() for r in self.rules ]
+            self._directedGrammar = gg
+        return self._directedGrammar
+
+    def internTags( self, table = None ):
+        """A copy of this grammar with every tag replaced by its ID in table
+        (by default self.tags); see soffit.tags."""
+        if table is None:
+            table = self.tags
+        gg = GraphGrammar()
+        gg.extensions = self.extensions
+        gg.tags = table
+        gg.directed = self.directed
+        if self.start is not None:
+            gg.start = internTags( self.start, table )
+        for r in self.rules:
+            left = internTags( r.left, table )
+            if isinstance( r, RandomRule ):
+                gg.rules.append( RandomRule( left, [ internTags( right, table )
+                                                     for right in r.rightChoices ] ) )
+            else:
+                gg.rules.append( DeterministicRule( left, internTags( r.right, table ) ) )
+        return gg
 
     def __ruleSortKey( self, left ):
         return tuple( sorted( left.nodes ) )
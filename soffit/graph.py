@@ -18,10 +18,15 @@
 #
 
 import networkx as nx
-from constraint import *
-from soffit.constraint import *
+from constraint import Problem, AllDifferentConstraint, InSetConstraint
+from soffit.constraint import TupleConstraint, NodeTagConstraint, \
+    DanglingEdgeConstraint, LexLeaderConstraint, SharedEndpointConstraint, \
+    MatchSolver
+from soffit.mixed import MixedGraph
 import itertools
+import random
 import time
+import weakref
 
 def graphIdentifiersToNumbers( g ):
     """Replace the graph identified by strings, with one where all nodes
@@ -37,6 +42,33 @@ def graphIdentifiersToNumbers( g ):
         
     return ret
 
+def compactNodeIds( g ):
+    """Renumber a graph created by graphIdentifiersToNumbers so that its
+    nodes are 0..n-1 again, in their existing order, and reset nextId.
+    Returns the renumbered graph (g itself if there were no gaps) and a
+    dictionary from old to new IDs of the nodes that moved."""
+    mapping = { n : i for ( i, n ) in enumerate( sorted( g.nodes ) ) if n != i }
+    if len( mapping ) > 0:
+        # The tag caches hold old IDs.
+        g.graph.pop( 'node_tag_cache', None )
+        g.graph.pop( 'edge_tag_cache', None )
+        g.graph.pop( 'degree_index', None )
+        g = nx.relabel_nodes( g, mapping, copy = True )
+        graphChanged( g )
+    g.graph['nextId'] = len( g )
+    return ( g, mapping )
+
+def graphVersion( g ):
+    """A counter that increases whenever g is rewritten, rolled back, or
+    renumbered, so that a copy or snapshot of g can tell it is out of
+    date."""
+    return g.graph.get( 'version', 0 )
+
+def graphChanged( g ):
+    """Increase graphVersion( g ), after changing g other than by a
+    rewrite or rollback."""
+    g.graph['version'] = graphVersion( g ) + 1
+
 def allocateNewNode( g, tag = None ):
     """Allocate a new numeric node in the graph, based on its nextId attribute.
     Such graphs are created by graphIndentifiersToNumbers."""
@@ -53,6 +85,77 @@ def allocateNewNode( g, tag = None ):
 
     return n
 
+class DegreeIndex(object):
+    """The nodes of a graph grouped by ( tag, in-degree, out-degree ),
+    where the degrees count distinct neighbors (including the node itself,
+    for a self-loop) and are equal in an undirected graph.
+
+    A node deleted by a rule must have exactly as many edges as the rule
+    deletes along with it, so this gives the only candidates for it.
+    Get it with degreeIndex(); rewrites and rollbacks keep it up to date,
+    and any other change to the graph makes degreeIndex() rebuild it."""
+    def __init__( self, g ):
+        # A weak reference survives deepcopy as-is, so a copy of the graph
+        # can tell that the index it inherited is not its own.
+        self.owner = weakref.ref( g )
+        self.keys = {}
+        self.buckets = {}
+        self.update( g, g.nodes )
+        self.shape = _indexShape( g )
+
+    @staticmethod
+    def key( g, n ):
+        tag = g.nodes[n].get( 'tag', None )
+        if isinstance( g, MixedGraph ):
+            return ( tag, ) + g.neighborCounts( n )
+        if g.is_directed():
+            return ( tag, len( g.pred[n] ), len( g.succ[n] ) )
+        d = len( g.adj[n] )
+        return ( tag, d, d )
+
+    def update( self, g, nodes ):
+        """Re-index nodes, which may have been added or removed."""
+        keys = self.keys
+        buckets = self.buckets
+        for n in nodes:
+            k = keys.pop( n, None )
+            if k is not None:
+                buckets[k].discard( n )
+            if n in g:
+                k = DegreeIndex.key( g, n )
+                keys[n] = k
+                buckets.setdefault( k, set() ).add( n )
+
+    def nodes( self, key ):
+        return self.buckets.get( key, () )
+
+def _indexShape( g ):
+    # Direct edits do not change the version, but almost always change
+    # the number of nodes or edges.
+    return ( graphVersion( g ), len( g ), g.number_of_edges() )
+
+def degreeIndex( g ):
+    """The DegreeIndex of g, built the first time it is asked for and
+    again whenever g has changed other than by a rewrite or rollback."""
+    index = g.graph.get( 'degree_index', None )
+    if index is None or index.owner() is not g or index.shape != _indexShape( g ):
+        index = DegreeIndex( g )
+        g.graph['degree_index'] = index
+    return index
+
+def _currentDegreeIndex( g ):
+    """The DegreeIndex of g if it is up to date, else None.  Call before
+    changing g, and pass the result to _updateDegreeIndex afterwards."""
+    index = g.graph.get( 'degree_index', None )
+    if index is None or index.owner() is not g or index.shape != _indexShape( g ):
+        return None
+    return index
+
+def _updateDegreeIndex( index, g, nodes ):
+    if index is not None:
+        index.update( g, nodes )
+        index.shape = _indexShape( g )
+
 class RightHandGraph(object):
     def __init__( self, right  ):
         self.right = right
@@ -79,6 +182,118 @@ class RightHandGraph(object):
         return ( self.rename.get( a, None ),
                  self.rename.get( b, None ) )
 
+def tinyShape( left ):
+    """Classify a left-hand side that MatchFinder can match without the
+    constraint solver: "node", "edge", "path" (of two edges), "triangle",
+    or None for anything else.  Directed and tagged versions are included,
+    as are pairs of arcs in both directions."""
+    if len( left ) > 3 or left.number_of_edges() == 0 and len( left ) > 1:
+        return None
+    if any( a == b for (a,b) in left.edges ):
+        return None
+    adjacent = set( frozenset( e ) for e in left.edges )
+    if len( left ) == 1:
+        return "node"
+    elif len( left ) == 2:
+        return "edge"
+    elif len( adjacent ) == 2:
+        return "path"
+    elif len( adjacent ) == 3:
+        return "triangle"
+    return None
+
+class EdgeVariable(tuple):
+    """The constraint variable for a left edge (a,b), when edges are
+    variables.  Sorts after every node variable, since the solver
+    breaks ties between variables by comparing them."""
+    def __lt__( self, other ):
+        return isinstance( other, EdgeVariable ) and tuple.__lt__( self, other )
+
+    def __gt__( self, other ):
+        return not isinstance( other, EdgeVariable ) or tuple.__gt__( self, other )
+
+# The number of allowed edges chooseFormulation() looks at for each left edge.
+_formulationSample = 1024
+
+def chooseFormulation( left, graph, required, allowed, tagCounts ):
+    """Whether "nodes" or "edges" should be the variables in matching
+    left to graph, given the host edges allowed for each left edge
+    (as returned by MatchFinder.edgeRequirements) and the number of host
+    nodes with the tag of each left node.
+
+    Most of the solver's time goes to forward checking, which scans the
+    domains of the neighbors of each variable it assigns.  Estimate that
+    work for the most promising first variable of each formulation,
+    without scanning the host graph, which may be large."""
+    if len( required ) == 0:
+        return "nodes"
+
+    # Node variables: a value of n without the right edges is rejected
+    # at once, the rest scan the domains of n's neighbors.
+    nodeCost = None
+    for n in left.nodes:
+        consistent = tagCounts[n]
+        scanned = 0
+        for ( a, b, tag, mirrored ) in required:
+            for ( end, other ) in [ ( a, b ), ( b, a ) ]:
+                if end == n:
+                    consistent = min( consistent, len( allowed[tag, mirrored] ) )
+                    scanned += tagCounts[other]
+        if scanned > 0:
+            cost = tagCounts[n] + consistent * scanned
+            if nodeCost is None or cost < nodeCost:
+                nodeCost = cost
+
+    # Edge variables: each value scans the edges that share an endpoint,
+    # and the endpoints, among twice as many variables.  Count the allowed
+    # edges whose ends have the right tags in a sample.  It is random, as
+    # tags often follow a pattern, but must not disturb the caller's
+    # random numbers or depend on them.
+    def edges( a, b, tag, mirrored ):
+        ta = left.nodes[a].get( 'tag', None )
+        tb = left.nodes[b].get( 'tag', None )
+        nodes = graph.nodes
+        hostEdges = allowed[tag, mirrored]
+        sample = hostEdges
+        if len( hostEdges ) > _formulationSample:
+            sample = random.Random( len( hostEdges ) ).sample( hostEdges, _formulationSample )
+        found = sum( 1 for (i,j) in sample
+                     if nodes[i].get( 'tag', None ) == ta and
+                     nodes[j].get( 'tag', None ) == tb )
+        return found * len( hostEdges ) / len( sample )
+    sizes = [ edges( *r ) for r in required ]
+    edgeCost = None
+    for ( r, size ) in zip( required, sizes ):
+        scanned = 2 * size
+        for ( r2, size2 ) in zip( required, sizes ):
+            if r2 is not r and set( r[:2] ) & set( r2[:2] ):
+                scanned += size2
+        cost = 2 * size * scanned
+        if edgeCost is None or cost < edgeCost:
+            edgeCost = cost
+
+    return "edges" if edgeCost < nodeCost else "nodes"
+
+def matchOrder( left, candidates ):
+    """Plan the order in which to match the nodes of left, given an
+    estimate of the number of candidates for each: most constrained
+    first, staying connected.  The first node has the fewest candidates;
+    after that, each is adjacent to one already ordered if possible, with
+    the fewest candidates, then the most edges to ordered nodes, then the
+    highest degree."""
+    links = { n : 0 for n in left.nodes }
+    remaining = set( left.nodes )
+    ordered = []
+    while remaining:
+        n = min( remaining,
+                 key = lambda n : ( links[n] == 0, candidates[n], -links[n],
+                                    -left.degree( n ), str( n ) ) )
+        ordered.append( n )
+        remaining.remove( n )
+        for m in nx.all_neighbors( left, n ):
+            links[m] += 1
+    return ordered
+
 class MatchError(Exception):
     def __init__( self, message ):
         self.message = message
@@ -106,15 +321,43 @@ class MatchFinder(object):
         # self.graph.graph['node_tag_misses'] = {}
         # self.graph.graph['edge_tag_misses'] = {}
 
-        self.model = Problem()
+        # Counts its work in self.solver.stats.
+        self.solver = MatchSolver()
+        self.model = Problem( self.solver )
         self.impossible = False
         self.verbose = verbose
 
-        self.currentConstraintVariables = None
-        self.currentConstraintTuples = None
-        
         self.maxMatches = 100000
         self.maxMatchTime = 60.0
+        # Return only one match per distinct rewrite; see rightSide.
+        self.breakSymmetry = False
+
+        # Every match of the left side alone, if solveLeftSide() found
+        # them all; then the right side only filters this list.
+        self.leftSolutions = None
+        # Match left sides of a few nodes without the solver; see tinyShape.
+        self.fastPaths = True
+        # Restrict deleted nodes to exact-degree candidates; see rightSide.
+        self.useDegreeIndex = True
+        # "nodes", "edges", or None to let chooseFormulation() decide.
+        self.formulation = None
+        # Match nodes in the order planned by matchOrder().
+        self.planOrder = True
+        # Worker processes to split the search among, and the
+        # soffit.parallel.MatchPool to use (None for a new one each time.)
+        self.jobs = 1
+        self.pool = None
+        # A function that returns True once the search should give up.
+        self.stopped = None
+
+        self.tiny = False
+
+        # Set by rightSide(), if it is called.
+        self.right = None
+        self.deletedNodes = []
+        self.deletedEdges = []
+        self.deletedKeys = {}
+        self.rightConstraints = []
 
     def checkCompatible( self, lr ):
         if nx.is_directed( self.graph ) != nx.is_directed( lr ):
@@ -133,24 +376,105 @@ class MatchFinder(object):
         if 'edge_tag_cache' in self.graph.graph and tag in self.graph.graph['edge_tag_cache']:
             edges_matching_tag = self.graph.graph['edge_tag_cache'][tag]
         else:
-            edges_matching_tag = [ (i,j) for i,j,t in self.graph.edges( data="tag" ) if t == tag ]
+            if isinstance( self.graph, MixedGraph ):
+                # Scan each undirected edge once, but allow both arcs.
+                edges_matching_tag = [ (i,j) for i,j,t in self.graph.directedEdges( data="tag" )
+                                       if t == tag ]
+                for (i,j) in self._undirectedEdgesForTag( tag ):
+                    edges_matching_tag.append( (i,j) )
+                    edges_matching_tag.append( (j,i) )
+            else:
+                edges_matching_tag = [ (i,j) for i,j,t in self.graph.edges( data="tag" ) if t == tag ]
             if 'edge_tag_cache' in self.graph.graph:
                 self.graph.graph['edge_tag_cache'][tag] = edges_matching_tag
         return edges_matching_tag
+
+    def _undirectedEdgesForTag( self, tag ):
+        """The undirected edges of a MixedGraph with the given tag, each
+        once."""
+        # Tags are never tuples, so this can share the edge tag cache.
+        key = ( 'undirected', tag )
+        cache = self.graph.graph.get( 'edge_tag_cache', None )
+        if cache is not None and key in cache:
+            return cache[key]
+        edges = [ (i,j) for i,j,t in self.graph.undirectedEdges( data="tag" ) if t == tag ]
+        if cache is not None:
+            cache[key] = edges
+        return edges
+
+    def mirroredEdgesForTag( self, tag ):
+        """Edges (i,j) with the given tag whose reverse (j,i) is also present
+        with that tag, as for an undirected edge in a directed graph."""
+        key = ( 'mirrored', tag )
+        cache = self.graph.graph.get( 'edge_tag_cache', None )
+        if cache is not None and key in cache:
+            return cache[key]
+        if isinstance( self.graph, MixedGraph ):
+            # Opposite arcs with equal attributes are normally merged, but
+            # one arc's attributes may have been changed in place.
+            edges = [ (i,j) for i,j,t in self.graph.directedEdges( data="tag" )
+                      if t == tag ]
+            mirrored = self._undirectedEdgesForTag( tag )
+            mirrored = mirrored + [ (j,i) for (i,j) in mirrored ]
+        else:
+            edges = self.edgesForTag( tag )
+            mirrored = []
+        present = set( edges )
+        mirrored += [ (i,j) for (i,j) in edges if i != j and (j,i) in present ]
+        if cache is not None:
+            cache[key] = mirrored
+        return mirrored
         
+    def tagCounts( self, leftGraph ):
+        """The number of host nodes with the tag of each left node."""
+        return { n : len( self.nodesForTag( tag ) )
+                 for ( n, tag ) in leftGraph.nodes( data='tag' ) }
+
+    def candidateCounts( self, leftGraph, deletedKeys = {} ):
+        """Estimate the number of nodes each left node could be matched
+        to, from the sizes of the tag indexes, and of the degree index
+        for deleted nodes (whose keys are given in deletedKeys.)"""
+        directed = nx.is_directed( leftGraph )
+        counts = self.tagCounts( leftGraph )
+        if len( deletedKeys ) > 0:
+            index = degreeIndex( self.graph )
+            for ( n, k ) in deletedKeys.items():
+                counts[n] = min( counts[n], len( index.nodes( k ) ) )
+        for ( a, b, tag ) in leftGraph.edges( data='tag' ):
+            if directed:
+                n = len( self.edgesForTag( tag ) )
+            else:
+                n = 2 * len( self.edgesForTag( tag ) )
+            counts[a] = min( counts[a], n )
+            counts[b] = min( counts[b], n )
+        return counts
+
     def leftSide( self, leftGraph ):        
         """Specify the left side of a rule; that is, a graph to match."""
         self.checkCompatible( leftGraph )
 
         # FIXME: handle zero-length left graphs?
         self.left = leftGraph
-        maxVertex = max( self.graph.nodes )
+        if self.fastPaths and tinyShape( leftGraph ) is not None:
+            # Matched in rightSide(), once the deletions are known.
+            self.tiny = True
+            return
+
+        nextId = self.graph.graph.get( 'nextId', None )
+        if nextId is None:
+            nextId = max( self.graph.nodes ) + 1
+        if len( self.graph ) == nextId:
+            domain = range( 0, nextId )
+        else:
+            # Nodes have been deleted from the graph in place; don't
+            # match the gaps.  (See compactNodeIds.)
+            domain = list( self.graph.nodes )
 
         # Build a variable for each vertex that must be matched.
         # We will use injective matching only, as it's more expessive and probably
         # easier to understand.
         for n in leftGraph.nodes:
-            self.model.addVariable( n, range( 0, maxVertex + 1 ) )
+            self.model.addVariable( n, domain )
 
             # FIXME: no tag is *not* a wildcard, does that match expectations?
             tag = leftGraph.nodes[n].get( 'tag', None )
@@ -175,62 +499,230 @@ class MatchFinder(object):
         # It doesn't seem worth handling the node constraints, which are completely
         # handled by preprocessing anyway.  But the edge constraints are more
         # expensive?
-        edge_constraints = {}
+        ( required, allowed ) = self.edgeRequirements( leftGraph )
+        if allowed is None:
+            self.impossible = True
+            return
+
+        formulation = self.formulation
+        if formulation is None:
+            formulation = chooseFormulation( leftGraph, self.graph, required, allowed,
+                                             self.tagCounts( leftGraph ) )
+        if self.verbose:
+            print( "Matching with", formulation, "as variables" )
+        if formulation == "edges":
+            self._edgeVariables( required, allowed )
+            return
+
+        if self.planOrder:
+            plan = matchOrder( leftGraph, self.candidateCounts( leftGraph ) )
+            self.solver.order = { n : i for ( i, n ) in enumerate( plan ) }
 
-        # Add an allowed assignment for each edge that must be matched,
-        # again limiting to just exact matching tags.
+        # Add an allowed assignment for each edge that must be matched.
+        edge_constraints = {}
+        for ( a, b, tag, mirrored ) in required:
+            if ( tag, mirrored ) not in edge_constraints:
+                edge_constraints[tag, mirrored] = TupleConstraint( allowed[tag, mirrored] )
+            self.model.addConstraint( edge_constraints[tag, mirrored], [a,b] )
+
+    def edgeRequirements( self, leftGraph ):
+        """Return a list of ( a, b, tag, mirrored ) for the left edges,
+        with mirrored set for a pair of arcs matched together, and a
+        dictionary from ( tag, mirrored ) to the host edges allowed.
+        The dictionary is None if some left edge cannot be matched."""
+        directed = nx.is_directed( leftGraph )
+        required = []
+        paired = set()
         for (a,b) in leftGraph.edges:
             tag = leftGraph.edges[a,b].get( 'tag', None )
+            # An undirected edge of a directed rule is a pair of arcs.
+            # Match both at once against the host's pairs.
+            mirrored = directed and a != b and leftGraph.has_edge( b, a ) and \
+                leftGraph.edges[b,a].get( 'tag', None ) == tag
+            if mirrored:
+                if (b,a) in paired:
+                    continue
+                paired.add( (a,b) )
+            required.append( ( a, b, tag, mirrored ) )
 
-            if tag in edge_constraints:
-                self.model.addConstraint( edge_constraints[tag], [a,b] )
-            elif False:
-                self.model.addConstraint( EdgeTagConstraint( self.graph, tag ), [a,b] )
+        # Limit to just exact matching tags.
+        allowed = {}
+        for ( a, b, tag, mirrored ) in required:
+            if ( tag, mirrored ) in allowed:
+                continue
+            if mirrored:
+                edges_matching_tag = self.mirroredEdgesForTag( tag )
+                if self.verbose:
+                    print( "Edge pairs matching", tag, edges_matching_tag )
             else:
                 edges_matching_tag = self.edgesForTag( tag )
                 if self.verbose:
                     print( "Edges matching", tag, edges_matching_tag )
-                if len( edges_matching_tag ) == 0:
-                    self.impossible = True
-                    return
-                
-                if not nx.is_directed( leftGraph ):
-                    revEdges = [ (b,a) for (a,b) in edges_matching_tag ]
+                if not directed:
+                    revEdges = [ (j,i) for (i,j) in edges_matching_tag ]
                     edges_matching_tag = edges_matching_tag + revEdges
+            if len( edges_matching_tag ) == 0:
+                return ( required, None )
+            allowed[tag, mirrored] = edges_matching_tag
+        return ( required, allowed )
+
+    def _edgeVariables( self, required, allowed ):
+        """Give each left edge a variable, whose values are the host edges
+        it may be matched to, and constrain its endpoints to agree with
+        the node variables."""
+        left = self.left
+        nodes = self.graph.nodes
+        ends = {}
+        for ( a, b, tag, mirrored ) in required:
+            ta = left.nodes[a].get( 'tag', None )
+            tb = left.nodes[b].get( 'tag', None )
+            loop = ( a == b )
+            key = ( tag, mirrored, loop, ta, tb )
+            if key not in ends:
+                # The node tags can be checked once, here.
+                edges = [ e for e in allowed[tag, mirrored]
+                          if ( e[0] == e[1] ) == loop and
+                          nodes[e[0]].get( 'tag', None ) == ta and
+                          nodes[e[1]].get( 'tag', None ) == tb ]
+                ends[key] = ( edges,
+                              TupleConstraint( [ ( e, e[0] ) for e in edges ] ),
+                              TupleConstraint( [ ( e, e[1] ) for e in edges ] ) )
+            ( edges, source, target ) = ends[key]
+            if len( edges ) == 0:
+                self.impossible = True
+                return
+            v = EdgeVariable( (a, b) )
+            self.model.addVariable( v, edges )
+            # Only endpoints of those edges need be considered for a and b.
+            self.model.addConstraint( InSetConstraint( set( e[0] for e in edges ) ), [a] )
+            self.model.addConstraint( source, [v, a] )
+            if not loop:
+                self.model.addConstraint( InSetConstraint( set( e[1] for e in edges ) ), [b] )
+                self.model.addConstraint( target, [v, b] )
+
+        # Constrain edges that share an endpoint directly, too, so that
+        # the solver picks edges before nodes and each edge narrows its
+        # neighbors.
+        for ( x, ( a, b, _, _ ) ) in enumerate( required ):
+            for ( c, d, _, _ ) in required[x+1:]:
+                for ( i, n ) in enumerate( (a, b) ):
+                    for ( j, m ) in enumerate( (c, d) ):
+                        if n == m and not ( a == b and i == 1 ) and \
+                           not ( c == d and j == 1 ):
+                            self.model.addConstraint( SharedEndpointConstraint( i, j ),
+                                                      [ EdgeVariable( (a, b) ),
+                                                        EdgeVariable( (c, d) ) ] )
+
+    def _tinyMatches( self, deletedKeys = {} ):
+        """All matches of a left side recognized by tinyShape(): the node
+        tag index for a single node, otherwise a join of the edge index
+        on a shared endpoint.  deletedKeys gives the DegreeIndex key
+        required of the image of each deleted node."""
+        left = self.left
+        graph = self.graph
+        nodes = graph.nodes
+        adj = graph.adj
+        directed = nx.is_directed( left )
+
+        def nodeTag( n ):
+            return left.nodes[n].get( 'tag', None )
+
+        def fits( n, i ):
+            k = deletedKeys.get( n, None )
+            return k is None or DegreeIndex.key( graph, i ) == k
+
+        def hostEdges( a, b ):
+            # Images (i,j) of the left edge (a,b), with the right tags.
+            tag = left.edges[a,b].get( 'tag', None )
+            ta = nodeTag( a )
+            tb = nodeTag( b )
+            edges = self.edgesForTag( tag )
+            if not directed:
+                edges = edges + [ (j,i) for (i,j) in edges ]
+            return [ (i,j) for (i,j) in edges if i != j and
+                     nodes[i].get( 'tag', None ) == ta and
+                     nodes[j].get( 'tag', None ) == tb and
+                     fits( a, i ) and fits( b, j ) ]
+
+        def hasEdges( m ):
+            # Every left edge is present, with its tag.
+            for (a,b,tag) in left.edges( data='tag' ):
+                d = adj[m[a]].get( m[b], None )
+                if d is None or d.get( 'tag', None ) != tag:
+                    return False
+            return True
 
-                tc = TupleConstraint( edges_matching_tag )
-                self.model.addConstraint( tc, [a,b] )
-                edge_constraints[tag] = tc
-                
-    def addConditionalTupleConstraint( self, first, rest, variables ):
-        if self.currentConstraintVariables != variables:
-            self.finishTupleConstraint()
-            self.currentConstraintVariables = variables
-            self.currentConstraintTuples = []
+        if len( left ) == 1:
+            ( a, ) = left.nodes
+            return [ { a : i } for (i,) in self.nodesForTag( nodeTag( a ) )
+                     if fits( a, i ) ]
+
+        # Start from the images of one edge, then join on the edges to
+        # the third node, if any.  hasEdges() checks the rest.  The
+        # first two nodes of the plan are adjacent, since left is connected.
+        if self.planOrder:
+            plan = matchOrder( left, self.candidateCounts( left, deletedKeys ) )
+            ( p, q ) = plan[:2]
+            ( a, b ) = ( p, q ) if left.has_edge( p, q ) else ( q, p )
+        else:
+            ( a, b ) = next( iter( left.edges ) )
+        solns = [ { a : i, b : j } for (i,j) in hostEdges( a, b ) ]
+        if len( left ) == 3:
+            ( x, ) = [ n for n in left.nodes if n != a and n != b ]
+            ( c, d ) = next( (c,d) for (c,d) in left.edges if x in (c,d) )
+            ( old, pos ) = ( c, 0 ) if d == x else ( d, 1 )
+            byOld = {}
+            for e in hostEdges( c, d ):
+                byOld.setdefault( e[pos], [] ).append( e[1-pos] )
+            joined = []
+            for m in solns:
+                for k in byOld.get( m[old], () ):
+                    if k != m[a] and k != m[b]:
+                        m2 = dict( m )
+                        m2[x] = k
+                        joined.append( m2 )
+            solns = joined
+
+        return [ m for m in solns if hasEdges( m ) ]
+
+    def solveLeftSide( self ):
+        """Find every match of the left side, before rightSide() is
+        called, so that finders for other right sides can share them.
+        Returns False if there are more than maxMatches, or they take
+        longer than maxMatchTime to find."""
+        if self.impossible:
+            self.leftSolutions = []
+            return True
+        if self.tiny:
+            self.leftSolutions = self._tinyMatches()
+            return True
 
-        for r in rest:
-            self.currentConstraintTuples.append( (first,) + r )
+        ( solns, reason ) = self._solve( self.maxMatches + 1 )
+        if len( solns ) > self.maxMatches or reason == "Maximum time exceeded.":
+            return False
+        self.leftSolutions = solns
+        return True
 
-    def finishTupleConstraint( self ):
-        if self.currentConstraintVariables is None:
+    def shareLeftSide( self, other ):
+        """Use the left side of another finder on the same graph, instead
+        of calling leftSide().  If other.solveLeftSide() succeeded, its
+        matches are filtered rather than solved for again."""
+        if other.leftSolutions is None:
+            self.leftSide( other.left )
             return
-        
-        if self.verbose:
-            vs = self.currentConstraintVariables
-            print( "If    |Then" )
-            print( " ".join( "{:>6}".format( str( v ) ) for v in vs ) )
-            print( "|".join( "------" for v in vs ) )
-            for t in self.currentConstraintTuples:
-                print( " ".join( "{:6}".format( y ) for y in t ) )
-                
-        self.model.addConstraint(
-            ConditionalTupleConstraint( self.currentConstraintTuples ),
-            self.currentConstraintVariables
-        )
+        self.checkCompatible( other.left )
+        self.left = other.left
+        self.impossible = other.impossible
+        self.leftSolutions = other.leftSolutions
+
+    def setRule( self, leftGraph, rightGraph ):
+        """Specify a rule without building a model, in order to apply a
+        match of it found by another finder (as in a worker process.)"""
+        self.checkCompatible( leftGraph )
+        self.checkCompatible( rightGraph )
+        self.left = leftGraph
+        self.right = RightHandGraph( rightGraph )
 
-        self.currentConstraintVariables = None
-        self.currentConstraintTuples = []
-        
     def rightSide( self, rightGraph ):        
         """Specify the right side of a rule; if the rule deletes nodes,
         this restricts further which matches may be made.
@@ -240,9 +732,14 @@ class MatchFinder(object):
 
         If A is being deleted and is matched to node B, then no node which
         is not also being deleted can be matched to node B.
+
+        Deleted nodes are restricted to candidates from the degree index.
+        With useDegreeIndex off, a DanglingEdgeConstraint checks each
+        deleted node's edges during the search instead.
         """
         self.checkCompatible( rightGraph )
         self.right = RightHandGraph( rightGraph )
+        self.rightConstraints = []
         
         # Bail out early if we already decided no match is present.
         if self.impossible:
@@ -255,235 +752,99 @@ class MatchFinder(object):
             print( "Deleted nodes:", dn )
             print( "Deleted edges:", de )
 
-        # Experimental code, seems to pass tests.
-        # The old implementation would be needed if we wanted to switch
-        # to a SAT solver.
-        if True and nx.is_directed( self.graph ):
-            allVars = set( self.deletedNodes )
-            for (i,j) in self.deletedEdges:
-                allVars.add( i )
-                allVars.add( j )
-            allVars = list( allVars )
-            self.model.addConstraint(
-                DanglingEdgeConstraint( self.graph,
-                                        self.deletedNodes,
-                                        self.deletedEdges ),
-                allVars )
-            return
-
-        
-        # "dangling condition"
-        # If a node is deleted, then any node with the same endpoint must
-        # be explicitly deleted as well.
-        # For all n in G that are the image of a deleted node (in L)
-        #   if s(e) = n or t(e) = n for an edge e in G, then
-        #       e is the image in G of some deleted edge (in L)
-        #
-        # Example:
-        # rule: X--A => A
-        # graph: 1--2, 1--3, 1--4
-        # if X = 1, then 1--2, 1--3, 1--4 must all be mapped to deleted edges
-        # If X = 2, then 1--2 must be deleted as well, so A = 2
-        #
-        # n = label on deleted node in left graph
-        for n in dn:
-            indicators = []
-            # i = which graph node was picked
-            possible = False
-
-            tag = self.left.nodes[n].get( 'tag', None )        
-            nodes_matching_tag = self.nodesForTag( tag )
-            for (i,) in nodes_matching_tag:
-                # We waste a lot of time constructing these
-                # conditions if they're impossible anyway.
-                # Hence the alternate implementation above.
-                if nx.is_directed( self.graph ):
-                    if self._danglingDirected( n, i ):
-                        possible = True
-                else:
-                    if self._danglingUndirected( n, i ):
-                        possible = True
-
-            if not possible:
-                self.impossible = True
-                return
-
-            self.finishTupleConstraint()
-
-        # Fossil code: keep to allow non-injective matching as an option?
-        #
-        #if nx.is_directed( self.graph ):
-        #    raise MatchError( "Directed graphs not yet supported." )
-        #else:
-        #    self._identificationUndirected()
-            
-
-    def _identificationUndirected( self ):
-        """Restrict matches of deleted nodes and deleted edges,
-        to nodes and edges that are not matched with undeleted nodes
-        and undeleted edges."""
-        dn = self.deletedNodes
-        de = self.deletedEdges
-        un = [ n for n in self.left.nodes if n not in dn ]
-        ue = [ (a,b) for (a,b) in self.left.edges if
-               ( (a,b) not in de and (b,a) not in de ) ]
-
-        # In the technical report [Martini 1996] this condition is
-        # restricted further, that two left-nodes may not be mapped to the
-        # same node of if either is deleted.
-        # I don't understand this restriction; it seems OK that if A and B
-        # are both being deleted, to allow A->x and B->x simultaneously?
-
-        # Two nodes may only be identified if they are both deleted, or both
-        # undeleted.
-        if self.verbose:
-            print( "Nonoverlapping node sets:" )
-            print( "A=", dn )
-            print( "B=", un )
-        self.model.addConstraint( NonoverlappingSets( dn, un ),
-                                  dn + un )
-
-        if self.verbose:
-            print( "Nonoverlapping edge sets:" )
-            print( "A=", de )
-            print( "B=", ue )
-        edgeVars = list( set( itertools.chain.from_iterable( de + ue ) ) )
-        # Two edges may only be identified if they are both deleted, or both
-        # undeleted.
-        self.model.addConstraint( NonoverlappingUnorderedPairs( de, ue ),
-                                  edgeVars )
-            
-    def _danglingUndirected( self, n, i ):
-        """Restrict matches of deleted node n to graph node i,
-        only to those which leave no undeleted edges dangling."""
-
-        # Could have a self-loop, let's treat it specially
-        deletedAdjacentEdges = \
-            [ (a,b) for (a,b) in self.deletedEdges if a == n and b != n ] + \
-            [ (b,a) for (a,b) in self.deletedEdges if b == n and a != n ]
-
-        graphAdjacent = self.graph[i]
-
-        # Does i have a self-loop but N does not?
-        if i in graphAdjacent:
-            if (n,n) not in self.deletedEdges:
-                # Then impossible to match.
+        if self.breakSymmetry:
+            # Matches related by an automorphism of the rule make the same
+            # rewrite; keep only the smallest of each such set.  Each set
+            # is the same size, so choosing uniformly among the rest is
+            # still uniform over distinct rewrites.
+            order = list( self.left.nodes )
+            for perm in ruleAutomorphisms( self.left, rightGraph ):
                 if self.verbose:
-                    print( "{} => {} is impossible, no self-loop".format( n, i ) )
-                self.model.addConstraint( NotInSetConstraint([i]), [n] )
-                return False
-            
-            # Remove self loop from consideration for the rest of the code.
-            graphAdjacent = [ x for x in graphAdjacent if x != i ]
-
-        # An easy case: does i have too many edges for the rule to delete
-        # them all?
-        if len( graphAdjacent ) > len( deletedAdjacentEdges ):
-            if self.verbose:
-                print( "{} => {} is impossible, too many neighbors".format( n, i ) )
-                print( "graphAdjacent", graphAdjacent )
-                print( "deletedAdjacentEdges", deletedAdjacentEdges )
-
-            self.model.addConstraint( NotInSetConstraint([i]), [n] )
-            return False
+                    print( "Automorphism:", perm )
+                self.rightConstraints.append( ( LexLeaderConstraint( perm ), order ) )
 
-        # FIXME: write a test for ordering of these two conditions.
-        # Are there no incident edges, and we didn't expect any?
-        if len( graphAdjacent ) == 0 and len( deletedAdjacentEdges ) == 0:
-            return True
-            
-        # We already covered the other direction-- i is already rejected
-        # if the left graph has a self-loop for n, and i does not have a
-        # self-loop.
-
-        # Match nodes from from deletedAdjacentEdges with neighbors in the graph
-        # Mapping doesn't have to be injective, but it does have to
-        # be surjective.  So, if too many neighbors, can't be a match!
-        # 1--1 is a match for A--B; A--C; A--D => B; C; D with A=1
-        # 1--1; 1--2; 1--3 can't be a match for A--B => B  with A=1
-
-        neighborVars = [ t for (_,t) in deletedAdjacentEdges ]
-
-        # FIXME: is this redundant?
-        # I suspect it is because it returned "None" previously....
-        if len( graphAdjacent ) > len( neighborVars ):
-            # Can't be surjective
-            if self.verbose:
-                print( "{} => {} is impossible, not surjective".format( n, i ) )
-            self.model.addConstraint( NotInSetConstraint([i]), [n] )
-            return False
+        # Every left edge at a deleted node is deleted too, and a match is
+        # injective, so the node's image must have exactly the same tag and
+        # degrees as it does.  Then no edge can be left dangling.
+        self.deletedKeys = { n : DegreeIndex.key( self.left, n ) for n in dn }
 
-        # FIXME: this allows multiple assignments to the same adjacency,
-        # which is not possible in an injective mapping.
-        values = list( surjectiveMappings( len( neighborVars ),
-                                           list( graphAdjacent ) ) )
-        self.addConditionalTupleConstraint( i, values, [n] + neighborVars )
-        return True
+        if self.tiny and self.leftSolutions is None:
+            self.leftSolutions = self._tinyMatches( self.deletedKeys )
 
-    def _danglingDirected( self, n, i ):
-        """Restrict matches of deleted node n to graph node i,
-        only to those which leave no undeleted edges dangling,
-        on a directed graph."""
-
-        # Could have a self-loop, let's treat it specially
-        deletedOutgoingEdges = [ (a,b) for (a,b) in self.deletedEdges if a == n and b != n ]
-        deletedIncomingEdges = [ (a,b) for (a,b) in self.deletedEdges if b == n and a != n ]
-        graphPred = list( x for x in self.graph.predecessors( i ) if x != i )
-        graphSucc = list( x for x in self.graph.successors( i ) if x != i )
-
-        # An easy case: does i have too many edges for the rule to delete
-        # them all?
-        if len( graphPred ) > len( deletedIncomingEdges ) or \
-           len( graphSucc ) > len( deletedOutgoingEdges ):
-            if self.verbose:
-                print( "{} => {} is impossible, too many neighbors".format( n, i ) )
-            self.model.addConstraint( NotInSetConstraint([i]), [n] )
-            return False
-
-        # Another easy case: does i have a self-loop but N does not?
-        if (i,i) in self.graph.edges():
-            if (n,n) not in self.deletedEdges:
-                # Then impossible to match.
-                if self.verbose:
-                    print( "{} => {} is impossible, no self-loop".format( n, i ) )
-                self.model.addConstraint( NotInSetConstraint([i]), [n] )
-                return False
-
-        # Match nodes surjectively from predecessors to incomingEdges
-        # and from successors to outgoingEdges
-        
-        succVars = [ t for (_,t) in deletedOutgoingEdges ]
-        predVars = [ t for (t,_) in deletedIncomingEdges ]
+        if self.leftSolutions is not None:
+            # Checked against each match in matches() instead.
+            return
 
-        for ( neighborVars, graphAdjacent ) in \
-            [ ( succVars, graphSucc ),
-              ( predVars, graphPred ) ]:
+        for ( c, variables ) in self.rightConstraints:
+            self.model.addConstraint( c, variables )
 
-            if len( neighborVars ) == 0 and len( graphAdjacent ) == 0:
-                # Trivially satisfied
-                continue
-            
-            values = list( surjectiveMappings( len( neighborVars ),
-                                               graphAdjacent ) )
-            if len( values ) == 0:
+        if self.useDegreeIndex:
+            index = degreeIndex( self.graph )
+            for n in dn:
+                candidates = index.nodes( self.deletedKeys[n] )
                 if self.verbose:
-                    print( "{} => {} is impossible, not surjective".format( n, i ) )
-                self.model.addConstraint( NotInSetConstraint([i]), [n] )
-                return False
-                
-            self.addConditionalTupleConstraint( i, values, [n] + neighborVars )
-                        
-        return True
+                    print( "Candidates for deleted", n, candidates )
+                if len( candidates ) == 0:
+                    self.impossible = True
+                    return
+                self.model.addConstraint(
+                    TupleConstraint( [ (i,) for i in candidates ] ), [n] )
+            if self.solver.order is not None and len( dn ) > 0:
+                # Deleted nodes may now be the most selective.
+                plan = matchOrder( self.left,
+                                   self.candidateCounts( self.left, self.deletedKeys ) )
+                self.solver.order = { n : i for ( i, n ) in enumerate( plan ) }
+            return
+
+        # The degree index is off, so check during the search that the
+        # images of deleted nodes have no other edges.
+        allVars = set( self.deletedNodes )
+        for (i,j) in self.deletedEdges:
+            allVars.add( i )
+            allVars.add( j )
+        self.model.addConstraint(
+            DanglingEdgeConstraint( self.graph,
+                                    self.deletedNodes,
+                                    self.deletedEdges ),
+            list( allVars ) )
 
     def _convertNodes( self, soln ):
-        return { k : self.graph.nodes[v]['orig']
-                 for (k,v) in soln.items() }
+        # Nodes created by in-place rewrites of an already-labeled graph
+        # have no 'orig'; their label is their own.
+        nodes = self.graph.nodes
+        return { k : nodes[v].get( 'orig', v )
+                 for (k,v) in soln.items() if not isinstance( k, EdgeVariable ) }
+
+    def _dangles( self, soln ):
+        """Does deleting the match soln leave an edge dangling?"""
+        for ( n, k ) in self.deletedKeys.items():
+            if DegreeIndex.key( self.graph, soln[n] ) != k:
+                return True
+        return False
+
+    def _filteredLeftSolutions( self ):
+        if len( self.deletedNodes ) == 0 and len( self.rightConstraints ) == 0:
+            return self.leftSolutions[:self.maxMatches]
+        solns = []
+        for s in self.leftSolutions:
+            if len( solns ) == self.maxMatches:
+                break
+            if self._dangles( s ):
+                continue
+            if all( c( variables, None, s ) for ( c, variables ) in self.rightConstraints ):
+                solns.append( s )
+        return solns
 
     def matchExists( self ):
         """Return true if at least one match exists."""
         if self.impossible:
             return False
 
+        if self.tiny and self.leftSolutions is None:
+            self.leftSolutions = self._tinyMatches()
+        if self.leftSolutions is not None:
+            return len( self._filteredLeftSolutions() ) > 0
+
         x = self.model.getSolutionIter()
         try:
             next( x )
@@ -495,26 +856,52 @@ class MatchFinder(object):
         if self.impossible:
             return []
 
-        self.endReason = "Maximum matches reached."
+        if self.tiny and self.leftSolutions is None:
+            self.leftSolutions = self._tinyMatches()
+        if self.leftSolutions is not None:
+            solns = self._filteredLeftSolutions()
+            if len( solns ) < self.maxMatches:
+                self.endReason = "No more matches."
+            else:
+                self.endReason = "Maximum matches reached."
+            return [ Match(self._convertNodes(s)) for s in solns ]
+
+        start = time.time()
+        ( solns, self.endReason ) = self._solve( self.maxMatches )
+        end = time.time()
+
+        if self.verbose:
+            print( "{} matches in {:.3f} seconds.".format( len( solns ),
+                                                          end - start ) )
+        
+        return [ Match(self._convertNodes(s)) for s in solns ]
+
+    def _solve( self, limit ):
+        """Find up to limit solutions of the model, giving up after
+        maxMatchTime.  Returns the solutions and the reason the search
+        stopped.  With jobs > 1, the search is split among that many
+        worker processes; see soffit.parallel."""
+        if self.jobs > 1:
+            from soffit.parallel import parallelSolve
+            return parallelSolve( self, limit )
+
+        reason = "Maximum matches reached."
         start = time.time()
         solns = []
         x = self.model.getSolutionIter()
-        while len( solns ) < self.maxMatches:
+        while len( solns ) < limit:
             try:
                 solns.append( next( x ) )
                 if time.time() - start > self.maxMatchTime:
-                    self.endReason = "Maximum time exceeded."
+                    reason = "Maximum time exceeded."
+                    break
+                if self.stopped is not None and self.stopped():
+                    reason = "Stopped."
                     break
             except StopIteration:
-                self.endReason = "No more matches."
+                reason = "No more matches."
                 break
-        end = time.time()
-
-        if self.verbose:
-            print( "{} matches in {:.3f} seconds.".format( len( solns ),
-                                                          end - start ) )
-        
-        return [ Match(self._convertNodes(s)) for s in solns ]
+        return ( solns, reason )
     
 
 class Match(object):
@@ -565,35 +952,374 @@ class Match(object):
         m = Match()
         m.nodeMap = self.nodeMap.copy()
         return m
-        
-def surjectiveMappings( k, values, optional=[] ):
-    """Enumerate all the ways to select k distinct items from 'values' such that
-    all values appear at least once."""
-    if k < len( values ):
-        return
-    elif k == 1:
-        if len( values ) == 1:
-            yield (values[0],)
+
+def _contractedEdges( g, u, v ):
+    """The edges that contractNodes( g, u, v ) adds to u, with their data."""
+    if g.is_directed():
+        return [ ( u if s == v else s, u, d )
+                 for (s, _, d) in g.in_edges( v, data=True ) ] + \
+               [ ( u, u if t == v else t, d )
+                 for (_, t, d) in g.out_edges( v, data=True ) ]
+    else:
+        return [ ( u, u if t == v else t, d )
+                 for (_, t, d) in g.edges( v, data=True ) ]
+
+def contractNodes( g, u, v ):
+    """Merge node v into node u of g, in place.  Edges incident to v are
+    moved to u (an edge between u and v becomes a self-loop), with v's edge
+    attributes taking precedence, and then v is removed.  This is the same
+    as networkx's contracted_nodes, without copying the graph."""
+    moved = _contractedEdges( g, u, v )
+    g.remove_node( v )
+    g.add_edges_from( moved )
+
+class UndoLog(object):
+    """A record of the inverse of each change made by a rewrite, so that the
+    graph can be restored without copying it.  Entries are appended before
+    each change is made; rollback undoes them newest first.
+
+    A restored graph has the same nodes, edges, and attributes as before,
+    but re-added nodes and edges come at the end of networkx's iteration
+    order."""
+
+    def __init__( self ):
+        self.entries = []
+
+    def __len__( self ):
+        return len( self.entries )
+
+    def mark( self ):
+        """Return a savepoint that can be passed to rollback."""
+        return len( self.entries )
+
+    def rollback( self, g, mark = 0 ):
+        """Undo all changes to g made since the savepoint 'mark'."""
+        index = _currentDegreeIndex( g )
+        if index is not None:
+            ( nodes, edges ) = self.changes( mark )
+            nodes.update( itertools.chain.from_iterable( edges ) )
+        entries = self.entries
+        while len( entries ) > mark:
+            e = entries.pop()
+            op = e[0]
+            if op == "node":
+                ( _, n, attrs ) = e
+                g.add_node( n )
+                d = g.nodes[n]
+                d.clear()
+                d.update( attrs )
+            elif op == "edge":
+                ( _, a, b, attrs ) = e
+                if isinstance( g, MixedGraph ):
+                    # Just this arc, which may re-form an undirected edge.
+                    g.setEdgeData( a, b, attrs )
+                else:
+                    g.add_edge( a, b )
+                    d = g.edges[a, b]
+                    d.clear()
+                    d.update( attrs )
+            elif op == "nonode":
+                if e[1] in g:
+                    g.remove_node( e[1] )
+            elif op == "noedge":
+                # May be recorded twice, e.g. for a directed self-loop
+                # created by a merge.
+                if g.has_edge( e[1], e[2] ):
+                    g.remove_edge( e[1], e[2] )
+            elif op == "graph":
+                g.graph[e[1]] = e[2]
+
+        graphChanged( g )
+        if index is not None:
+            _updateDegreeIndex( index, g, nodes )
+
+    def changes( self, mark = 0 ):
+        """Return the sets of nodes and edges touched by the changes logged
+        since the savepoint 'mark'."""
+        nodes = set()
+        edges = set()
+        for e in self.entries[mark:]:
+            if e[0] == "node" or e[0] == "nonode":
+                nodes.add( e[1] )
+            elif e[0] == "edge" or e[0] == "noedge":
+                edges.add( ( e[1], e[2] ) )
+        return ( nodes, edges )
+
+    def graphAttribute( self, g, key ):
+        self.entries.append( ( "graph", key, g.graph[key] ) )
+
+    def nodeAttributes( self, g, n ):
+        self.entries.append( ( "node", n, dict( g.nodes[n] ) ) )
+
+    def edgeAttributes( self, g, a, b ):
+        if g.has_edge( a, b ):
+            self.entries.append( ( "edge", a, b, dict( g.edges[a, b] ) ) )
         else:
-            for o in optional:
-                yield (o,)
-
-    # Pick a must-use, it becomes optional
-    for i in range(len(values)):
-        selected = values[i]
-        for m in surjectiveMappings( k-1,
-                                     values[:i] + values[i+1:], 
-                                     optional + [selected] ):
-            yield (selected,) + m
-
-    # Pick a may-use
-    for selected in optional:
-        for m in surjectiveMappings( k-1,
-                                     values, 
-                                     optional ):
-            yield (selected,) + m
-        
-            
+            self.entries.append( ( "noedge", a, b ) )
+
+    def nodesAdded( self, nodes ):
+        self.entries.extend( ( "nonode", n ) for n in nodes )
+
+    def edgesRemoved( self, g, edges ):
+        for ( a, b ) in edges:
+            if g.has_edge( a, b ):
+                self.edgeAttributes( g, a, b )
+
+    def nodesRemoved( self, g, nodes ):
+        for n in nodes:
+            if g.is_directed():
+                self.edgesRemoved( g, g.in_edges( n ) )
+                self.edgesRemoved( g, g.out_edges( n ) )
+            else:
+                self.edgesRemoved( g, g.edges( n ) )
+            self.nodeAttributes( g, n )
+
+def allocateNewNodes( g, count ):
+    """Allocate a block of 'count' new node IDs in a graph created by
+    graphIdentifiersToNumbers, without adding them to the graph."""
+    if not 'nextId' in g.graph:
+        raise MatchError( "Graph must come from graphIndentifiersToNumbers." )
+
+    n = g.graph['nextId']
+    g.graph['nextId'] = n + count
+    return range( n, n + count )
+
+class RewriteScript(object):
+    """The changes made by a rule, worked out once from its left and right
+    graphs as a flat list of operations on matched node names:
+
+      deleteEdges:  left edges (a,b) to remove
+      deleteNodes:  left nodes to remove
+      merges:       (u, v, alias) in order; if alias, name u is bound to
+                    the node matched by v, otherwise v's node is merged
+                    into u's node
+      addNodes:     (right node, attributes) for new nodes
+      retagNodes:   (right node, tag or None) for surviving nodes
+      addEdges:     (a, b, attributes) for new edges
+      retagEdges:   (a, b, tag or None) for surviving edges
+
+    Use RewriteScript.forRule to get the (cached) script for a rule."""
+
+    def __init__( self, left, right ):
+        rhs = RightHandGraph( right )
+        ( self.deleteNodes, self.deleteEdges ) = rhs.ruleDeletions( left )
+
+        bound = set( left.nodes )
+        self.merges = []
+        for v in rhs.join:
+            u = rhs.rename[ v ]
+            if u in bound and v in bound:
+                self.merges.append( ( u, v, False ) )
+            elif u not in left:
+                # A merge was specified for a node introduced in the
+                # right-hand side of the rule.  Add an alias as if it were
+                # specified in the left-hand side.
+                self.merges.append( ( u, v, True ) )
+                bound.add( u )
+            else:
+                self.merges.append( ( v, u, True ) )
+                bound.add( v )
+
+        self.addNodes = []
+        self.retagNodes = []
+        for ( n, tag ) in right.nodes( data='tag' ):
+            if n in bound:
+                self.retagNodes.append( ( n, tag ) )
+            elif tag is None:
+                self.addNodes.append( ( n, {} ) )
+            else:
+                self.addNodes.append( ( n, { 'tag' : tag } ) )
+
+        self.addEdges = []
+        self.retagEdges = []
+        for ( a, b, d ) in right.edges( data=True ):
+            if ( a, b ) in left.edges:
+                self.retagEdges.append( ( a, b, d.get( 'tag', None ) ) )
+            else:
+                self.addEdges.append( ( a, b, dict( d ) ) )
+
+    @staticmethod
+    def forRule( left, right ):
+        """Return the script for left => right, compiling it only the
+        first time the pair is seen."""
+        byLeft = _compiledScripts.get( right, None )
+        if byLeft is None:
+            byLeft = weakref.WeakKeyDictionary()
+            _compiledScripts[right] = byLeft
+        script = byLeft.get( left, None )
+        if script is None:
+            script = RewriteScript( left, right )
+            byLeft[left] = script
+        return script
+
+    def execute( self, g, nodeMap, undo = None ):
+        """Rewrite g in place.  nodeMap maps left nodes to nodes of g; it is
+        extended with the nodes bound to right-hand names.  If an UndoLog
+        is given, the inverse of each change is recorded in it."""
+        m = nodeMap
+        index = _currentDegreeIndex( g )
+        # Nodes whose degree or tag may change.
+        touched = [ m[n] for n in self.deleteNodes ]
+
+        edges = [ ( m[a], m[b] ) for ( a, b ) in self.deleteEdges ]
+        touched.extend( itertools.chain.from_iterable( edges ) )
+        if undo is not None:
+            undo.edgesRemoved( g, edges )
+        g.remove_edges_from( edges )
+
+        nodes = [ m[n] for n in self.deleteNodes ]
+        if undo is not None:
+            undo.nodesRemoved( g, nodes )
+        g.remove_nodes_from( nodes )
+
+        # Matching could have identified two nodes that are both to be merged
+        # or are already merged!
+        alreadyMerged = set()
+        for ( u, v, alias ) in self.merges:
+            if alias:
+                m[u] = m[v]
+                continue
+            m_u = m[u]
+            m_v = m[v]
+            if m_v != m_u and m_v not in alreadyMerged:
+                touched.append( m_u )
+                touched.append( m_v )
+                touched.extend( nx.all_neighbors( g, m_v ) )
+                if undo is not None:
+                    for ( a, b, _ ) in _contractedEdges( g, m_u, m_v ):
+                        undo.edgeAttributes( g, a, b )
+                    undo.nodesRemoved( g, [ m_v ] )
+                contractNodes( g, m_u, m_v )
+                alreadyMerged.add( m_v )
+
+        if undo is not None:
+            undo.graphAttribute( g, 'nextId' )
+        newIds = allocateNewNodes( g, len( self.addNodes ) )
+        if undo is not None:
+            undo.nodesAdded( newIds )
+        g.add_nodes_from( ( i, attrs )
+                          for ( i, ( _, attrs ) ) in zip( newIds, self.addNodes ) )
+        for ( i, ( n, _ ) ) in zip( newIds, self.addNodes ):
+            m[n] = i
+
+        nodes = g.nodes
+        for ( n, tag ) in self.retagNodes:
+            if undo is not None:
+                undo.nodeAttributes( g, m[n] )
+            g_n = nodes[ m[n] ]
+            if tag is not None:
+                g_n['tag'] = tag
+            elif 'tag' in g_n:
+                del g_n['tag']
+
+        edges = [ ( m[a], m[b], attrs ) for ( a, b, attrs ) in self.addEdges ]
+        if undo is not None:
+            for ( a, b, _ ) in edges:
+                undo.edgeAttributes( g, a, b )
+        g.add_edges_from( edges )
+        touched.extend( newIds )
+        touched.extend( m[n] for ( n, _ ) in self.retagNodes )
+        touched.extend( itertools.chain.from_iterable( ( a, b ) for ( a, b, _ ) in edges ) )
+
+        edges = g.edges
+        # In a MixedGraph, edges[a,b] may be shared with the arc (b,a).
+        mixed = isinstance( g, MixedGraph )
+        for ( a, b, tag ) in self.retagEdges:
+            if undo is not None:
+                undo.edgeAttributes( g, m[a], m[b] )
+            g_e = edges[ m[a], m[b] ]
+            if mixed:
+                g_e = dict( g_e )
+            if tag is not None:
+                g_e['tag'] = tag
+            elif 'tag' in g_e:
+                del g_e['tag']
+            if mixed:
+                g.setEdgeData( m[a], m[b], g_e )
+
+        graphChanged( g )
+        _updateDegreeIndex( index, g, touched )
+        return m
+
+# right graph => { left graph => RewriteScript }
+_compiledScripts = weakref.WeakKeyDictionary()
+
+_tagMatch = nx.algorithms.isomorphism.categorical_node_match( 'tag', None )
+_edgeTagMatch = nx.algorithms.isomorphism.categorical_edge_match( 'tag', None )
+_roleMatch = nx.algorithms.isomorphism.categorical_node_match( [ 'tag', 'role' ],
+                                                               [ None, None ] )
+
+def _extendsToRight( right, rename, perm ):
+    """Does the permutation perm of left nodes carry over to an
+    automorphism of right?"""
+    tau = {}
+    for ( x, y ) in perm.items():
+        if ( x in rename ) != ( y in rename ):
+            return False
+        if x in rename:
+            if tau.setdefault( rename[x], rename[y] ) != rename[y]:
+                return False
+    if len( set( tau.values() ) ) != len( tau ):
+        return False
+
+    # Look for an automorphism of right that agrees with tau on the nodes
+    # carried over from the left, and maps new nodes to new nodes.
+    r1 = right.__class__()
+    r2 = right.__class__()
+    for ( n, tag ) in right.nodes( data='tag' ):
+        r1.add_node( n, tag = tag, role = n if n in tau else None )
+        r2.add_node( n, tag = tag )
+    for ( p, q ) in tau.items():
+        r2.nodes[q]['role'] = p
+    r1.add_edges_from( right.edges( data=True ) )
+    r2.add_edges_from( right.edges( data=True ) )
+    return nx.is_isomorphic( r1, r2, node_match = _roleMatch,
+                             edge_match = _edgeTagMatch )
+
+def ruleAutomorphisms( left, right, limit = 128 ):
+    """Permutations of the left nodes, other than the identity, which map
+    the rule left => right onto itself.  If m is a match, so is m composed
+    with any of these, and it makes the same rewrite.
+
+    The result is the whole group of such permutations (less the
+    identity), or empty if the left side has more than 'limit'
+    automorphisms.  It is computed only the first time the pair is seen."""
+    byLeft = _ruleAutomorphisms.get( right, None )
+    if byLeft is None:
+        byLeft = weakref.WeakKeyDictionary()
+        _ruleAutomorphisms[right] = byLeft
+    perms = byLeft.get( left, None )
+    if perms is not None:
+        return perms
+
+    if nx.is_directed( left ):
+        matcher = nx.algorithms.isomorphism.DiGraphMatcher
+    else:
+        matcher = nx.algorithms.isomorphism.GraphMatcher
+    gm = matcher( left, left, node_match = _tagMatch, edge_match = _edgeTagMatch )
+    candidates = list( itertools.islice( gm.isomorphisms_iter(), limit + 1 ) )
+    rename = right.graph['rename']
+    perms = []
+    # Only a whole group keeps exactly one match of each set; give up on
+    # very symmetric patterns (like a large star.)
+    if len( candidates ) <= limit:
+        for perm in candidates:
+            if all( x == y for ( x, y ) in perm.items() ):
+                continue
+            if _extendsToRight( right, rename, perm ):
+                perms.append( perm )
+    byLeft[left] = perms
+    return perms
+
+_ruleAutomorphisms = weakref.WeakKeyDictionary()
+
+# Levels of checking performed by RuleApplication.verify
+VERIFY_OFF = "off"
+VERIFY_LOCAL = "local"
+VERIFY_FULL = "full"
+verifyLevels = [ VERIFY_OFF, VERIFY_LOCAL, VERIFY_FULL ]
+defaultVerify = VERIFY_LOCAL if __debug__ else VERIFY_OFF
+
 class RuleApplication(object):
     """Apply a rule to a graph where it has been matched."""
     
@@ -607,29 +1333,69 @@ class RuleApplication(object):
         self.right = finder.right.right
         self.rename = finder.right.rename
         self.join = finder.right.join
+        self.script = RewriteScript.forRule( self.left, self.right )
         
         self.match = match.copy()
         self.beforeGraph = finder.originalGraph
 
-    def verify( self ):
+    def verify( self, level = None ):
+        """Check that the match is still present in the graph and that
+        deleting it leaves no dangling edges.  "local" examines only the
+        matched elements and the edges of deleted nodes; "full" performs
+        the deletion on a copy of the whole graph."""
+        if level is None:
+            level = defaultVerify
+        if level == VERIFY_LOCAL:
+            self._verifyLocal()
+        elif level == VERIFY_FULL:
+            self._verifyFull()
+        elif level != VERIFY_OFF:
+            raise ValueError( "Unknown verification level " + repr( level ) )
+
+    def _verifyLocal( self ):
+        g = self.beforeGraph
+        directed = nx.is_directed( g )
+        deleted = set()
+        for e in self.script.deleteEdges:
+            (m_s,m_t) = self.match.edge( e )
+            if (m_s,m_t) not in g.edges:
+                raise MatchError( "Missing edge " + str( e ) + " => " + str((m_s,m_t)) )
+            deleted.add( (m_s,m_t) )
+            if not directed:
+                deleted.add( (m_t,m_s) )
+
+        for n in self.script.deleteNodes:
+            m_n = self.match.node( n )
+            if m_n not in g.nodes:
+                raise MatchError( "Missing node " + str( n )  + " => " + str(m_n) )
+            remaining = [ (m_n,t) for t in g.adj[m_n] if (m_n,t) not in deleted ]
+            if directed:
+                remaining += [ (s,m_n) for s in g.pred[m_n] if (s,m_n) not in deleted ]
+            if len( remaining ) > 0:
+                raise MatchError( "Remaining edges on " + str( n )  + " => " + str(m_n) )
+
+    def _verifyFull( self ):
         gTest = self.beforeGraph.copy()
-        for e in self.finder.deletedEdges:
+        for e in self.script.deleteEdges:
             (m_s,m_t) = self.match.edge( e )
-            assert (m_s,m_t) in gTest.edges, "Missing edge " + str( e ) + " => " + str((m_s,m_t))
+            if (m_s,m_t) not in gTest.edges:
+                raise MatchError( "Missing edge " + str( e ) + " => " + str((m_s,m_t)) )
 
-        for n in self.finder.deletedNodes:
+        for n in self.script.deleteNodes:
             m_n = self.match.node( n )
-            assert m_n in gTest.nodes, "Missing node " + str( n )  + " => " + str(m_n)
+            if m_n not in gTest.nodes:
+                raise MatchError( "Missing node " + str( n )  + " => " + str(m_n) )
 
         self._deleteEdges( gTest )
 
-        for n in self.finder.deletedNodes:
+        for n in self.script.deleteNodes:
             m_n = self.match.node( n )
-            assert len( gTest[m_n] ) == 0, "Remaining edges on " + str( n )  + " => " + str(m_n)
+            if not nx.is_isolate( gTest, m_n ):
+                raise MatchError( "Remaining edges on " + str( n )  + " => " + str(m_n) )
 
     def _deleteEdges( self, g ):
         alreadyDeleted = set()
-        for e in self.finder.deletedEdges:            
+        for e in self.script.deleteEdges:            
             m_e = self.match.edge( e )
             if m_e not in alreadyDeleted:
                 (m_s, m_t) = m_e
@@ -638,114 +1404,18 @@ class RuleApplication(object):
                 if not nx.is_directed( g ):
                     alreadyDeleted.add( (m_t, m_s) )
         
-    def _deleteNodes( self, g ):
-        alreadyDeleted = set()
-        for n in self.finder.deletedNodes:
-            m_n = self.match.node( n )
-            if m_n not in alreadyDeleted:
-                g.remove_node( m_n )
-                alreadyDeleted.add( m_n )
-
-    def _mergeNodes( self, g ):
-        # The label on the combined edge will be placed in _retagEdge
-        # And the label on the combined node will be placed in _retagNode
-        #
-        # So our job is limited to ensuring any edges that terminate on a merged
-        # node are routed to the correct place.
-        # join has just the nodes that need to be changed
-        # rename has the canonical renaming
-        alreadyMerged = set()
-
-        for v in self.join:
-            u = self.rename[ v ]
-            try:
-                m_u = self.match.node( u )
-                m_v = self.match.node( v )
-            except KeyError:
-                # A merge was specified for a node introduced in the right-hand
-                # side of the rule.
-                # Add an alias as if it were specified in the left-hand side.
-                if u not in self.left:
-                    self.match.addMap( u, self.match.node( v ) )
-                    continue
-                elif v not in self.left:
-                    self.match.addMap( v, self.match.node( u ) )
-                    continue
-                else:
-                    assert False
-                
-            # Matching could have identified two nodes that are both to be merged
-            # or are already merged!            
-            if m_v != m_u and m_v not in alreadyMerged:
-                g = nx.algorithms.minors.contracted_nodes( g, m_u, m_v, self_loops = True )
-                alreadyMerged.add( m_v )
-        return g
-
-    def _addNode( self, g, n ):
-        r_n = self.right.nodes[n]
-        new_n = allocateNewNode( g, r_n.get( 'tag', None ) )
-        self.match.addMap( n, new_n )
-        
-    def _retagNode( self, g, n ):
-        r_n = self.right.nodes[n]
-        
-        m_n = self.match.node( n )
-        g_n = g.nodes[m_n]
-
-        if 'tag' in r_n:
-            g_n['tag'] = r_n['tag']
-        elif 'tag' in g_n:
-            del g_n['tag']
-    
-    def _addAndRelabelNodes( self, g ):
-        # FIXME: this is dumb, add 'nodes' to RightHandGraph
-        for rightNode in self.right.nodes:
-            if rightNode in self.match:
-                # It must have been in left, too, but the tag may have changed
-                self._retagNode( g, rightNode )
-            else:
-                self._addNode( g, rightNode )
-
-    def _addEdge( self, g, e ):
-        (m_s, m_t) = self.match.edge( e ) 
-        r_e = self.right.edges[e]
-        g.add_edge( m_s, m_t, **r_e )
-
-    def _retagEdge( self, g, e ):        
-        r_e = self.right.edges[e]
-        
-        m_e = self.match.edge( e )
-        g_e = g.edges[m_e]
-
-        if 'tag' in r_e:
-            g_e['tag'] = r_e['tag']
-        elif 'tag' in g_e:
-            del g_e['tag']
-            
-    def _addAndRelabelEdges( self, g ):
-        for (a,b) in self.right.edges:
-            # Should have already added the endpoints if they are new
-            assert a in self.match
-            assert b in self.match
-            if (a,b) in self.left.edges:
-                self._retagEdge( g, (a,b) )
-            else:
-                self._addEdge( g, (a,b) )
-        
-    def result( self, copy = True ):
-        if __debug__:
-            self.verify()
+    def result( self, copy = True, verify = None, undo = None ):
+        """Apply the rule and return the new graph, which is the original
+        graph modified in place if copy is False.  verify is one of
+        "off", "local", or "full", by default "local" unless Python is
+        running with -O.  If an UndoLog is given, the changes are recorded
+        in it so that they can be rolled back."""
+        self.verify( verify )
 
         if copy:
             g = self.beforeGraph.copy()
         else:
             g = self.beforeGraph
-            
-        self._deleteEdges( g )
-        self._deleteNodes( g )
-        g = self._mergeNodes( g )
-        self._addAndRelabelNodes( g )
-        self._addAndRelabelEdges( g )
 
+        self.script.execute( g, self.match.nodeMap, undo )
         return g
-        
@@ -0,0 +1,383 @@
+"""Bulk reading and writing of large graphs."""
+#
+#   soffit/graphfile.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+# Start graphs with millions of elements are too big to write as a
+# "start" string and parse with pyparsing.  The readers in this module
+# build the integer-labeled working graph (as graphIdentifiersToNumbers
+# would produce) directly from the file, without any intermediate
+# string-labeled graph.  The writers produce the same formats, so that
+# a run can save its result without rendering it.
+#
+# Two formats are supported:
+#
+# "edgelist" is the Soffit graph notation, restricted to one node or one
+# edge per line, so that it can be read a line at a time:
+#
+#    # comment
+#    A[tag]
+#    A--B[tag]
+#    A->B
+#    B<-C[tag]
+#
+# "nodelink" is the JSON format written by networkx's node_link_data,
+# with a "tag" key on nodes and links that carry a tag:
+#
+#    { "directed" : false,
+#      "nodes" : [ { "id" : "A", "tag" : "x" }, { "id" : "B" } ],
+#      "links" : [ { "source" : "A", "target" : "B", "tag" : "y" } ] }
+#
+# It is also read a chunk at a time: each node and link is decoded on
+# its own, rather than the whole document becoming Python lists first.
+
+import json
+import re
+import networkx as nx
+from soffit.parse import ParseError, MismatchedVertexError, MismatchedEdgeError
+from soffit.tags import externTags
+
+class GraphFileError(ParseError):
+    """A line of a graph file that could not be understood."""
+    def __init__( self, lineNumber, line, message ):
+        self.lineNumber = lineNumber
+        self.line = line
+        self.message = message
+
+    def prettyPrint( self ):
+        print( "Error reading graph file: " + self.message )
+        if self.lineNumber is not None:
+            print( "  on line number", self.lineNumber )
+        if self.line is not None:
+            print( "  " + self.line )
+
+_nodeId = r'([^\s\[\];<>-]+)'
+_elementRe = re.compile( r'^\s*' + _nodeId +
+                         r'\s*(?:(--|->|<-)\s*' + _nodeId + r'\s*)?' +
+                         r'(?:\[((?:[^\]\\]|\\.)*)\])?\s*;?\s*$' )
+_escapeRe = re.compile( r'\\(.)' )
+_whitespaceRe = re.compile( r'[ \t\r\n]*' )
+_separatorRe = re.compile( r'[ \t\r\n]*([,\]])[ \t\r\n]*' )
+
+class _GraphBuilder(object):
+    """Accumulate nodes and edges keyed by file identifiers, assigning
+    consecutive integers in order of first appearance."""
+    def __init__( self ):
+        self.ids = {}
+        self.names = []
+        self.nodeTags = {}
+        self.directedEdges = {}
+        self.undirectedEdges = {}
+
+    def node( self, name, tag = None ):
+        n = self.ids.get( name, None )
+        if n is None:
+            n = len( self.names )
+            self.ids[name] = n
+            self.names.append( name )
+
+        if tag is not None:
+            old = self.nodeTags.setdefault( n, tag )
+            if old != tag:
+                raise MismatchedVertexError( name, tag, old )
+        return n
+
+    def _addEdge( self, edges, key, tag ):
+        if key in edges:
+            old = edges[key]
+            if old is None:
+                edges[key] = tag
+            elif tag is not None and old != tag:
+                raise MismatchedEdgeError( self.names[key[0]],
+                                           self.names[key[1]],
+                                           tag, old )
+        else:
+            edges[key] = tag
+
+    def directed( self, a, b, tag = None ):
+        self._addEdge( self.directedEdges,
+                       ( self.node( a ), self.node( b ) ), tag )
+
+    def undirected( self, a, b, tag = None ):
+        a = self.node( a )
+        b = self.node( b )
+        self._addEdge( self.undirectedEdges, ( min( a, b ), max( a, b ) ), tag )
+
+    def graph( self, directed = None ):
+        if directed is None:
+            directed = len( self.directedEdges ) > 0
+
+        if directed:
+            g = nx.DiGraph()
+            edges = self.directedEdges
+            # Undirected edges become a pair of arcs, as in the parser.
+            for ( (a,b), tag ) in self.undirectedEdges.items():
+                self._addEdge( edges, (a,b), tag )
+                self._addEdge( edges, (b,a), tag )
+        else:
+            if len( self.directedEdges ) > 0:
+                raise GraphFileError( None, None,
+                                      "directed edges in an undirected graph" )
+            g = nx.Graph()
+            edges = self.undirectedEdges
+
+        tags = self.nodeTags
+        g.add_nodes_from( ( n, { 'tag' : tags[n] } ) if n in tags else ( n, {} )
+                          for n in range( len( self.names ) ) )
+        g.add_edges_from( ( a, b, { 'tag' : t } ) if t is not None else ( a, b, {} )
+                          for ( (a,b), t ) in edges.items() )
+        g.graph['nextId'] = len( self.names )
+        return g
+
+def readEdgeList( f ):
+    """Read a graph in edge-list format from the file object f, one line at
+    a time, and return an integer-labeled graph with 'nextId' set."""
+    b = _GraphBuilder()
+    for ( lineNumber, line ) in enumerate( f, 1 ):
+        stripped = line.strip()
+        if len( stripped ) == 0 or stripped.startswith( "#" ):
+            continue
+
+        m = _elementRe.match( stripped )
+        if m is None:
+            raise GraphFileError( lineNumber, stripped,
+                                  "expected a single node or edge" )
+        ( a, direction, c, tag ) = m.groups()
+        if tag is not None:
+            tag = _escapeRe.sub( r'\1', tag )
+
+        try:
+            if direction is None:
+                b.node( a, tag )
+            elif direction == "--":
+                b.undirected( a, c, tag )
+            elif direction == "->":
+                b.directed( a, c, tag )
+            else:
+                b.directed( c, a, tag )
+        except ParseError as pe:
+            pe.lineNumber = lineNumber
+            raise pe
+
+    return b.graph()
+
+class _JsonStream(object):
+    """A JSON document read a chunk at a time, so that the elements of a
+    long array can be decoded one by one rather than all at once."""
+    def __init__( self, f, chunkSize ):
+        self.f = f
+        self.chunkSize = chunkSize
+        self.buf = ""
+        self.pos = 0
+        self.lineNumber = 1
+        self.decoder = json.JSONDecoder()
+
+    def _fill( self ):
+        chunk = self.f.read( self.chunkSize )
+        if len( chunk ) == 0:
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek( self ):
+        """Skip whitespace and return the next character, or None at the
+        end of the file."""
+        while True:
+            end = _whitespaceRe.match( self.buf, self.pos ).end()
+            self.lineNumber += self.buf.count( "\n", self.pos, end )
+            self.pos = end
+            if end < len( self.buf ):
+                return self.buf[end]
+            if not self._fill():
+                return None
+
+    def expect( self, c ):
+        if self.peek() != c:
+            raise GraphFileError( self.lineNumber, None, "expected '" + c + "'" )
+        self.pos += 1
+
+    def value( self ):
+        self.peek()
+        return self._decode()
+
+    def _decode( self ):
+        while True:
+            try:
+                ( v, end ) = self.decoder.raw_decode( self.buf, self.pos )
+                # A number at the end of the buffer may continue in the
+                # next chunk.
+                if end < len( self.buf ) or not self._fill():
+                    self.lineNumber += self.buf.count( "\n", self.pos, end )
+                    self.pos = end
+                    return v
+            except json.JSONDecodeError as err:
+                if not self._fill():
+                    raise GraphFileError( self.lineNumber, None,
+                                          "invalid JSON: " + err.msg )
+
+    def elements( self ):
+        """Decode the elements of an array one at a time, yielding each
+        with the line number where it starts."""
+        self.expect( '[' )
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        decode = self.decoder.raw_decode
+        while True:
+            lineNumber = self.lineNumber
+            # Usually the element and the separator after it are both in
+            # the buffer already.
+            buf = self.buf
+            start = self.pos
+            try:
+                ( v, end ) = decode( buf, start )
+                m = _separatorRe.match( buf, end )
+            except json.JSONDecodeError:
+                m = None
+            if m is not None and m.end() < len( buf ):
+                yield ( lineNumber, v )
+                c = m.group( 1 )
+                self.lineNumber += buf.count( "\n", start, m.end() )
+                self.pos = m.end()
+            else:
+                yield ( lineNumber, self._decode() )
+                c = self.peek()
+                self.pos += 1
+                self.peek()
+            if c == ']':
+                return
+            if c != ',':
+                raise GraphFileError( self.lineNumber, None, "expected ',' or ']'" )
+
+def readNodeLink( f, chunkSize = 1 << 16 ):
+    """Read a graph in node-link JSON format from the file object f, and
+    return an integer-labeled graph with 'nextId' set.  The file is read
+    a chunk at a time, and each node and link is added to the graph as
+    it is decoded."""
+    s = _JsonStream( f, chunkSize )
+    b = _GraphBuilder()
+    directed = None
+    # Links that come before "directed", if it is not first.
+    pending = []
+
+    def link( source, target, tag ):
+        if directed:
+            b.directed( source, target, tag )
+        else:
+            b.undirected( source, target, tag )
+
+    s.expect( '{' )
+    while s.peek() != '}':
+        key = s.value()
+        s.expect( ':' )
+        if key in ( 'nodes', 'links', 'edges' ):
+            for ( lineNumber, e ) in s.elements():
+                try:
+                    if key == 'nodes':
+                        b.node( e['id'], e.get( 'tag', None ) )
+                    elif directed is None:
+                        pending.append( ( e['source'], e['target'], e.get( 'tag', None ) ) )
+                    else:
+                        link( e['source'], e['target'], e.get( 'tag', None ) )
+                except KeyError as ke:
+                    raise GraphFileError( lineNumber, None, "missing key " + str( ke ) )
+                except ParseError as pe:
+                    pe.lineNumber = lineNumber
+                    raise pe
+        else:
+            v = s.value()
+            if key == 'directed':
+                directed = bool( v )
+        if s.peek() != ',':
+            break
+        s.pos += 1
+    s.expect( '}' )
+
+    directed = bool( directed )
+    for e in pending:
+        link( *e )
+    return b.graph( directed )
+
+formats = {
+    "edgelist" : readEdgeList,
+    "nodelink" : readNodeLink,
+}
+
+def guessFormat( filename ):
+    if filename.endswith( ".json" ):
+        return "nodelink"
+    else:
+        return "edgelist"
+
+def _escapeTag( tag ):
+    return str( tag ).replace( "\\", "\\\\" ).replace( "]", "\\]" )
+
+def writeEdgeList( g, f ):
+    """Write graph g to the file object f in edge-list format.  Every node
+    is listed, so node order is preserved when the file is read back."""
+    for ( n, tag ) in g.nodes( data='tag' ):
+        if tag is None:
+            f.write( "{}\n".format( n ) )
+        else:
+            f.write( "{}[{}]\n".format( n, _escapeTag( tag ) ) )
+
+    arrow = "->" if nx.is_directed( g ) else "--"
+    for ( a, b, tag ) in g.edges( data='tag' ):
+        if tag is None:
+            f.write( "{}{}{}\n".format( a, arrow, b ) )
+        else:
+            f.write( "{}{}{}[{}]\n".format( a, arrow, b, _escapeTag( tag ) ) )
+
+def writeNodeLink( g, f ):
+    """Write graph g to the file object f in node-link JSON format, one
+    node or link per line."""
+    def element( d, tag ):
+        if tag is not None:
+            d['tag'] = tag
+        return json.dumps( d )
+
+    f.write( '{{ "directed" : {},\n  "nodes" : [\n'.format(
+        json.dumps( nx.is_directed( g ) ) ) )
+    f.write( ",\n".join( "    " + element( { 'id' : n }, tag )
+                         for ( n, tag ) in g.nodes( data='tag' ) ) )
+    f.write( '\n  ],\n  "links" : [\n' )
+    f.write( ",\n".join( "    " + element( { 'source' : a, 'target' : b }, tag )
+                         for ( a, b, tag ) in g.edges( data='tag' ) ) )
+    f.write( '\n  ]\n}\n' )
+
+writers = {
+    "edgelist" : writeEdgeList,
+    "nodelink" : writeNodeLink,
+}
+
+def saveGraphFile( g, filename, format = None ):
+    """Write graph g to a file in either "edgelist" or "nodelink" format.
+    If no format is given, files ending in .json are node-link.  Interned
+    tags (see soffit.tags) are written as strings."""
+    if format is None:
+        format = guessFormat( filename )
+    with open( filename, "w" ) as f:
+        writers[format]( externTags( g ), f )
+
+def loadGraphFile( filename, format = None ):
+    """Read a start graph from a file in either "edgelist" or "nodelink"
+    format.  If no format is given, files ending in .json are node-link."""
+    if format is None:
+        format = guessFormat( filename )
+    with open( filename, "r" ) as f:
+        return formats[format]( f )
@@ -0,0 +1,386 @@
+"""A directed working graph that stores each undirected edge once."""
+#
+#   soffit/mixed.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+# A directed grammar treats an undirected edge as a pair of opposite arcs
+# with the same tag, so an undirected working graph must become directed
+# before such a grammar is applied to it.  to_directed() would store both
+# arcs, each with its own attribute dict, and the matcher would then scan
+# every edge twice.  MixedGraph instead keeps:
+#
+#   _arcSucc[a][b], _arcPred[b][a]
+#                   the attributes of an arc a->b
+#   _undirected[a][b], _undirected[b][a]
+#                   the one attribute dict of an undirected edge between
+#                   a and b, as in nx.Graph
+#
+# A pair of nodes is never joined by both an arc and an undirected edge,
+# and a self-loop is always an arc.  Adding an arc whose reverse is
+# present with equal attributes turns the two into an undirected edge;
+# removing or changing one arc of an undirected edge splits it back into
+# two arcs.
+#
+# networkx's views and algorithms read _succ and _pred, which here merge
+# the two, so everything else sees an ordinary DiGraph in which an
+# undirected edge is two arcs.  Only the storage that the networkx
+# documentation describes for subclasses (_node, _adj, _succ, _pred) is
+# replaced, so this works with networkx 2.x as well as 3.x.  Modifying edges[a,b] of an undirected edge
+# changes both arcs; setEdgeData() changes just one.  MatchFinder uses
+# directedEdges() and undirectedEdges() to see each edge once.
+
+import copy
+import itertools
+from collections.abc import Mapping
+import networkx as nx
+
+class _MergedAtlas(Mapping):
+    """The neighbors of one node, through arcs and undirected edges."""
+    __slots__ = ( 'arcs', 'undirected' )
+
+    def __init__( self, arcs, undirected ):
+        self.arcs = arcs
+        self.undirected = undirected
+
+    def __getitem__( self, n ):
+        d = self.arcs.get( n, None )
+        if d is None:
+            return self.undirected[n]
+        return d
+
+    def __iter__( self ):
+        return itertools.chain( self.arcs, self.undirected )
+
+    def __len__( self ):
+        return len( self.arcs ) + len( self.undirected )
+
+    def __contains__( self, n ):
+        return n in self.arcs or n in self.undirected
+
+    def __repr__( self ):
+        return repr( dict( self ) )
+
+class _MergedAdjacency(Mapping):
+    """n => _MergedAtlas, for use as a DiGraph's _succ or _pred."""
+    __slots__ = ( 'arcs', 'undirected' )
+
+    def __init__( self, arcs, undirected ):
+        self.arcs = arcs
+        self.undirected = undirected
+
+    def __getitem__( self, n ):
+        return _MergedAtlas( self.arcs[n], self.undirected[n] )
+
+    def __iter__( self ):
+        return iter( self.arcs )
+
+    def __len__( self ):
+        return len( self.arcs )
+
+    def __contains__( self, n ):
+        return n in self.arcs
+
+class MixedGraph(nx.DiGraph):
+    """A DiGraph which stores a pair of opposite arcs with equal attributes
+    as a single undirected edge.  See the comment at the top of
+    soffit/mixed.py."""
+
+    def __init__( self, incoming_graph_data = None, **attr ):
+        self.graph = {}
+        self._node = {}
+        self._arcSucc = {}
+        self._arcPred = {}
+        self._undirected = {}
+        self._adj = _MergedAdjacency( self._arcSucc, self._undirected )
+        self._succ = self._adj
+        self._pred = _MergedAdjacency( self._arcPred, self._undirected )
+        self.__networkx_cache__ = {}
+        if incoming_graph_data is not None:
+            nx.convert.to_networkx_graph( incoming_graph_data, create_using = self )
+        self.graph.update( attr )
+
+    @classmethod
+    def fromGraph( cls, g ):
+        """A MixedGraph with deep copies of g's nodes, edges, and
+        attributes, as g.to_directed() would have.  Each edge of an
+        undirected g is stored as an undirected edge."""
+        h = cls()
+        h.graph.update( copy.deepcopy( g.graph ) )
+        h.add_nodes_from( ( n, copy.deepcopy( d ) ) for ( n, d ) in g.nodes( data=True ) )
+        if nx.is_directed( g ):
+            h.add_edges_from( ( a, b, copy.deepcopy( d ) )
+                              for ( a, b, d ) in g.edges( data=True ) )
+            return h
+        for ( a, b, d ) in g.edges( data=True ):
+            d = copy.deepcopy( d )
+            if a == b:
+                h._arcSucc[a][a] = d
+                h._arcPred[a][a] = d
+            else:
+                h._undirected[a][b] = d
+                h._undirected[b][a] = d
+        return h
+
+    # Each edge once
+
+    def directedEdges( self, data = False, default = None ):
+        """The arcs (a,b) that are not part of an undirected edge, with
+        their attributes as in edges()."""
+        for ( a, nbrs ) in self._arcSucc.items():
+            for ( b, d ) in nbrs.items():
+                if data is False:
+                    yield ( a, b )
+                elif data is True:
+                    yield ( a, b, d )
+                else:
+                    yield ( a, b, d.get( data, default ) )
+
+    def undirectedEdges( self, data = False, default = None ):
+        """Each undirected edge once, as (a,b) in either order, with its
+        attributes as in edges()."""
+        seen = set()
+        for ( a, nbrs ) in self._undirected.items():
+            for ( b, d ) in nbrs.items():
+                if b in seen:
+                    continue
+                if data is False:
+                    yield ( a, b )
+                elif data is True:
+                    yield ( a, b, d )
+                else:
+                    yield ( a, b, d.get( data, default ) )
+            seen.add( a )
+
+    def neighborCounts( self, n ):
+        """( number of predecessors, number of successors ) of node n."""
+        u = len( self._undirected[n] )
+        return ( len( self._arcPred[n] ) + u, len( self._arcSucc[n] ) + u )
+
+    def number_of_edges( self, u = None, v = None ):
+        if u is None:
+            # Much faster than counting through the merged views.
+            return ( sum( map( len, self._arcSucc.values() ) ) +
+                     sum( map( len, self._undirected.values() ) ) )
+        return super().number_of_edges( u, v )
+
+    def number_of_undirected_edges( self ):
+        return sum( len( nbrs ) for nbrs in self._undirected.values() ) // 2
+
+    def _changed( self ):
+        # networkx 3 keeps converted copies of a graph in
+        # __networkx_cache__, which every change must discard.
+        cache = getattr( self, '__networkx_cache__', None )
+        if cache:
+            cache.clear()
+
+    # Nodes
+
+    def _addNode( self, n ):
+        if n not in self._node:
+            if n is None:
+                raise ValueError( "None cannot be a node" )
+            self._arcSucc[n] = {}
+            self._arcPred[n] = {}
+            self._undirected[n] = {}
+            self._node[n] = {}
+
+    def add_node( self, node_for_adding, **attr ):
+        self._addNode( node_for_adding )
+        self._node[node_for_adding].update( attr )
+        self._changed()
+
+    def add_nodes_from( self, nodes_for_adding, **attr ):
+        for n in nodes_for_adding:
+            try:
+                # Unhashable if it is ( node, attributes ), as in networkx.
+                n in self._node
+                d = attr
+            except TypeError:
+                ( n, nd ) = n
+                d = dict( attr )
+                d.update( nd )
+            self._addNode( n )
+            self._node[n].update( d )
+        self._changed()
+
+    def remove_node( self, n ):
+        if n not in self._node:
+            raise nx.NetworkXError( "The node {} is not in the digraph.".format( n ) )
+        for m in self._arcSucc[n]:
+            del self._arcPred[m][n]
+        for m in self._arcPred[n]:
+            del self._arcSucc[m][n]
+        for m in self._undirected[n]:
+            del self._undirected[m][n]
+        del self._arcSucc[n]
+        del self._arcPred[n]
+        del self._undirected[n]
+        del self._node[n]
+        self._changed()
+
+    def remove_nodes_from( self, nodes ):
+        for n in nodes:
+            if n in self._node:
+                self.remove_node( n )
+
+    # Edges
+
+    def _setArc( self, u, v, data ):
+        """Make u->v an arc with attributes data, which belongs to the
+        graph from now on; merge it with an equal reverse arc."""
+        succ = self._arcSucc
+        pred = self._arcPred
+        undirected = self._undirected
+        shared = undirected[u].get( v, None )
+        if shared is not None:
+            if shared == data:
+                return
+            # Split; the reverse arc keeps the old attributes.
+            del undirected[u][v]
+            del undirected[v][u]
+            succ[v][u] = shared
+            pred[u][v] = shared
+        elif u != v:
+            reverse = succ[v].get( u, None )
+            if reverse is not None and reverse == data:
+                del succ[v][u]
+                del pred[u][v]
+                succ[u].pop( v, None )
+                pred[v].pop( u, None )
+                undirected[u][v] = data
+                undirected[v][u] = data
+                return
+        succ[u][v] = data
+        pred[v][u] = data
+
+    def _addEdge( self, u, v, attr ):
+        self._addNode( u )
+        self._addNode( v )
+        shared = self._undirected[u].get( v, None )
+        if shared is not None:
+            data = dict( shared )
+        else:
+            # Update an existing arc in place, as networkx does.
+            data = self._arcSucc[u].get( v, None )
+            if data is None:
+                data = self.edge_attr_dict_factory()
+        data.update( attr )
+        self._setArc( u, v, data )
+
+    def add_edge( self, u_of_edge, v_of_edge, **attr ):
+        self._addEdge( u_of_edge, v_of_edge, attr )
+        self._changed()
+
+    def add_edges_from( self, ebunch_to_add, **attr ):
+        for e in ebunch_to_add:
+            if len( e ) == 3:
+                ( u, v, dd ) = e
+            elif len( e ) == 2:
+                ( u, v ) = e
+                dd = {}
+            else:
+                raise nx.NetworkXError( "Edge tuple {} must be a 2-tuple or 3-tuple.".format( e ) )
+            d = dict( attr )
+            d.update( dd )
+            self._addEdge( u, v, d )
+        self._changed()
+
+    def setEdgeData( self, u, v, data ):
+        """Replace the attributes of the arc u->v, adding it if necessary,
+        without changing the reverse arc."""
+        self._addNode( u )
+        self._addNode( v )
+        arc = self._arcSucc[u].get( v, None )
+        if arc is not None:
+            arc.clear()
+            arc.update( data )
+        else:
+            arc = dict( data )
+        self._setArc( u, v, arc )
+        self._changed()
+
+    def _removeArc( self, u, v ):
+        shared = self._undirected.get( u, {} ).get( v, None )
+        if shared is not None:
+            del self._undirected[u][v]
+            del self._undirected[v][u]
+            self._arcSucc[v][u] = shared
+            self._arcPred[u][v] = shared
+            return True
+        if u in self._arcSucc and v in self._arcSucc[u]:
+            del self._arcSucc[u][v]
+            del self._arcPred[v][u]
+            return True
+        return False
+
+    def remove_edge( self, u, v ):
+        if not self._removeArc( u, v ):
+            raise nx.NetworkXError( "The edge {}-{} not in graph.".format( u, v ) )
+        self._changed()
+
+    def remove_edges_from( self, ebunch ):
+        for e in ebunch:
+            self._removeArc( e[0], e[1] )
+        self._changed()
+
+    def clear( self ):
+        for d in [ self._arcSucc, self._arcPred, self._undirected, self._node, self.graph ]:
+            d.clear()
+        self._changed()
+
+    def clear_edges( self ):
+        for adjacency in [ self._arcSucc, self._arcPred, self._undirected ]:
+            for nbrs in adjacency.values():
+                nbrs.clear()
+        self._changed()
+
+    # Copies
+
+    def copy( self, as_view = False ):
+        if as_view:
+            return super().copy( as_view = True )
+        g = self.__class__()
+        g.graph.update( self.graph )
+        g.add_nodes_from( ( n, d.copy() ) for ( n, d ) in self._node.items() )
+        for ( a, b, d ) in self.directedEdges( data=True ):
+            d = d.copy()
+            g._arcSucc[a][b] = d
+            g._arcPred[b][a] = d
+        for ( a, b, d ) in self.undirectedEdges( data=True ):
+            d = d.copy()
+            g._undirected[a][b] = d
+            g._undirected[b][a] = d
+        return g
+
+    def to_directed( self, as_view = False ):
+        """A DiGraph in which each undirected edge is two arcs, with their
+        own attributes."""
+        if as_view:
+            return super().to_directed( as_view = True )
+        g = nx.DiGraph()
+        g.graph.update( copy.deepcopy( self.graph ) )
+        g.add_nodes_from( ( n, copy.deepcopy( d ) ) for ( n, d ) in self._node.items() )
+        g.add_edges_from( ( a, b, copy.deepcopy( d ) )
+                          for ( a, b, d ) in self.edges( data=True ) )
+        return g
+
+def mixedGraph( g ):
+    """A directed version of the undirected working graph g: a MixedGraph,
+    unless g is not a networkx graph (such as a CompactGraph.)"""
+    if isinstance( g, nx.Graph ):
+        return MixedGraph.fromGraph( g )
+    return g.to_directed()
@@ -0,0 +1,258 @@
+"""Matching in worker processes."""
+#
+#   soffit/parallel.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import atexit
+import multiprocessing
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from constraint import InSetConstraint
+from soffit.graph import MatchFinder, matchOrder, degreeIndex
+from soffit.shared import SnapshotPublisher, SnapshotHandle, SharedGraph, _shape
+
+# MatchFinder settings that a worker copies.
+_finderSettings = [ 'maxMatches', 'breakSymmetry',
+                    'useDegreeIndex', 'formulation', 'planOrder' ]
+
+# The graph being matched, and anything else the parent handed over,
+# in a worker process.
+_workerGraph = None
+_workerExtra = None
+# The snapshot _workerGraph was mapped from by _useSnapshot.
+_workerHandle = None
+
+# The start method for worker processes, or None to fork where possible.
+startMethod = None
+
+# Shared-memory snapshots of the working graph, for workers that are not
+# forked; kept until the graph changes.
+_publisher = SnapshotPublisher()
+atexit.register( _publisher.close )
+
+def initWorker( graph, extra = None ):
+    """Pool initializer: keep the parent's graph, or map its snapshot
+    (see workerSnapshot.)"""
+    global _workerGraph, _workerExtra
+    if isinstance( graph, SnapshotHandle ):
+        graph = graph.attach()
+    _workerGraph = graph
+    _workerExtra = extra
+
+def workerState():
+    """The graph and extra state given to initWorker().  Raises
+    StaleSnapshot if the graph is a snapshot that is out of date."""
+    if isinstance( _workerGraph, SharedGraph ):
+        _workerGraph.check()
+    return ( _workerGraph, _workerExtra )
+
+def workerContext():
+    """Fork where possible, so that workers share the parent's graph
+    rather than receiving a copy."""
+    if startMethod is not None:
+        return multiprocessing.get_context( startMethod )
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context( "fork" )
+    return multiprocessing.get_context()
+
+def workerSnapshot( graph, context ):
+    """The graph to hand to the workers.  A forked worker sees the
+    parent's graph as it was at the fork; otherwise the workers map a
+    shared-memory snapshot of it, which is reused until the graph is
+    rewritten (see soffit/shared.py.)"""
+    if context.get_start_method() == "fork":
+        return graph
+    return _publisher.publish( graph ).handle()
+
+def _useSnapshot( handle ):
+    """Make the snapshot handle refers to the worker's graph, unmapping
+    the one it replaces."""
+    global _workerGraph, _workerHandle
+    if handle == _workerHandle:
+        return
+    if isinstance( _workerGraph, SharedGraph ):
+        _workerGraph.close()
+    _workerGraph = handle.attach()
+    _workerHandle = handle
+
+def _solveChunk( task ):
+    """Rebuild a MatchFinder in a worker, restrict one variable to some
+    of its values, and solve."""
+    ( snapshot, generation, left, right, settings, propagate,
+      variable, values, limit, deadline ) = task
+    current = _workerExtra
+    if current.value != generation:
+        # The search already has enough solutions.
+        return ( [], "Stopped.", {} )
+    if snapshot is not None:
+        _useSnapshot( snapshot )
+    ( graph, _ ) = workerState()
+    finder = MatchFinder( graph, already_labeled = True )
+    finder.stopped = lambda : current.value != generation
+    for ( k, v ) in settings.items():
+        setattr( finder, k, v )
+    # The time limit applies to the whole search, not to each chunk.
+    finder.maxMatchTime = deadline - time.time()
+    if finder.maxMatchTime <= 0:
+        return ( [], "Maximum time exceeded.", finder.solver.stats )
+    finder.fastPaths = False
+    finder.solver.propagate = propagate
+    finder.leftSide( left )
+    if not finder.impossible:
+        finder.model.addConstraint( InSetConstraint( set( values ) ), [ variable ] )
+        if right is not None:
+            finder.rightSide( right )
+    if finder.impossible:
+        return ( [], "No more matches.", finder.solver.stats )
+    ( solns, reason ) = finder._solve( limit )
+    return ( solns, reason, finder.solver.stats )
+
+def splitVariable( finder ):
+    """The left node whose candidates are divided among the workers,
+    which is the first one the search would assign, and its candidates."""
+    order = finder.solver.order
+    if order is not None:
+        variable = min( order, key = order.get )
+    else:
+        counts = finder.candidateCounts( finder.left, finder.deletedKeys )
+        variable = matchOrder( finder.left, counts )[0]
+
+    key = finder.deletedKeys.get( variable, None )
+    if key is not None and finder.useDegreeIndex:
+        values = list( degreeIndex( finder.graph ).nodes( key ) )
+    else:
+        tag = finder.left.nodes[variable].get( 'tag', None )
+        values = [ i for (i,) in finder.nodesForTag( tag ) ]
+    return ( variable, values )
+
+class MatchPool(object):
+    """Worker processes for parallelSolve(), kept from one search to the
+    next.  Forked workers see the graph as it was when they were forked,
+    so they are replaced once it changes.  Other workers are handed the
+    current shared-memory snapshot with each task, and keep it mapped
+    until they are handed another."""
+
+    def __init__( self, jobs ):
+        self.jobs = jobs
+        self.context = workerContext()
+        self.fork = self.context.get_start_method() == "fork"
+        self.executor = None
+        # The graph the workers were forked with, and its shape then.
+        self.graph = None
+        self.shape = None
+        # Each search has a new generation; the workers stop any chunk of
+        # an earlier one.
+        self.generation = self.context.Value( 'q', 0 )
+
+    def start( self, graph ):
+        """Get the workers ready to match in graph, which may have changed
+        since the last search.  Returns what each task must tell them
+        about the graph."""
+        if self.fork:
+            if self.executor is not None and \
+               ( self.graph() is not graph or self.shape != _shape( graph ) ):
+                self._shutdown()
+            snapshot = None
+        else:
+            snapshot = workerSnapshot( graph, self.context )
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(
+                max_workers = self.jobs,
+                mp_context = self.context,
+                initializer = initWorker,
+                initargs = ( graph if self.fork else None, self.generation ) )
+            if self.fork:
+                self.graph = weakref.ref( graph )
+                self.shape = _shape( graph )
+        return snapshot
+
+    def stop( self ):
+        """Stop the chunks of the current search, without waiting."""
+        with self.generation.get_lock():
+            self.generation.value += 1
+
+    def _shutdown( self ):
+        self.stop()
+        self.executor.shutdown( wait = False, cancel_futures = True )
+        self.executor = None
+        self.graph = None
+
+    def close( self ):
+        """Stop the workers.  The pool can still be used afterwards, and
+        starts new ones."""
+        if self.executor is not None:
+            self._shutdown()
+
+def parallelSolve( finder, limit ):
+    """Find up to limit solutions of the finder's model, as
+    MatchFinder._solve() does, using finder.jobs worker processes.
+
+    The candidates of one left node are dealt out into several chunks
+    per worker, and each worker solves the model with that node
+    restricted to one chunk.  The results are merged in chunk order, so
+    they do not depend on which worker finishes first.  The workers come
+    from finder.pool, or from a MatchPool that is closed afterwards."""
+    ( variable, values ) = splitVariable( finder )
+    if finder.verbose:
+        print( "Splitting", len( values ), "candidates for", variable,
+               "among", finder.jobs, "workers" )
+    if len( values ) == 0:
+        return ( [], "No more matches." )
+
+    n = min( len( values ), finder.jobs * 4 )
+    chunks = [ values[k::n] for k in range( n ) ]
+    settings = { k : getattr( finder, k ) for k in _finderSettings }
+    right = finder.right.right if finder.right is not None else None
+    deadline = time.time() + finder.maxMatchTime
+
+    pool = finder.pool
+    if pool is None or pool.jobs != finder.jobs:
+        pool = MatchPool( finder.jobs )
+    solns = []
+    reason = "No more matches."
+    futures = []
+    try:
+        snapshot = pool.start( finder.graph )
+        generation = pool.generation.value
+        futures = [ pool.executor.submit( _solveChunk,
+                                          ( snapshot, generation,
+                                            finder.left, right, settings,
+                                            finder.solver.propagate,
+                                            variable, chunk, limit, deadline ) )
+                    for chunk in chunks ]
+        for f in futures:
+            ( chunkSolns, chunkReason, stats ) = f.result()
+            for ( k, v ) in stats.items():
+                finder.solver.stats[k] += v
+            solns.extend( chunkSolns )
+            if len( solns ) >= limit:
+                reason = "Maximum matches reached."
+                break
+            if chunkReason == "Maximum time exceeded.":
+                reason = chunkReason
+    finally:
+        # Don't wait for the chunks still running; they give up at their
+        # next solution.
+        pool.stop()
+        if pool is not finder.pool:
+            pool.close()
+        else:
+            for f in futures:
+                f.cancel()
+
+    return ( solns[:limit], reason )
@@ -17,13 +17,15 @@
 #   limitations under the License.
 #
 
+import copy
 import json
-from pyparsing import Word, Literal, OneOrMore, Optional, Group, ParseException, StringEnd, QuotedString
+from pyparsing import Regex, Literal, OneOrMore, Optional, Group, ParseException, StringEnd, QuotedString
 from pyparsing import ParseResults
 from pyparsing import delimitedList
 import networkx as nx
 from soffit.grammar import GraphGrammar
 from itertools import zip_longest
+from collections import OrderedDict, namedtuple
 
 # Copied from Swift,
 # see https://docs.swift.org/swift-book/ReferenceManual/LexicalStructure.html
@@ -31,11 +33,18 @@ from itertools import zip_longest
 def inclusiveRange( a, b ):
     return range( a, b + 1 )
 
+def _characterClass( ranges ):
+    """Regular expression character class matching any character in the
+    given list of ranges."""
+    def escape( c ):
+        return "\\U{:08x}".format( c )
+    return "[" + "".join( escape( r[0] ) + "-" + escape( r[-1] )
+                          for r in ranges ) + "]"
+
 def _buildUnicodeWord():
-    # FIXME: the startup time is horrendous and parsing a multi-megabyte
-    # regular expression can't be helping.
-    # Write our own pyparsing class that's a replacement for Word?
-    # Or back off on the unicode ranges for now.
+    # Word() with these character sets builds a regular expression listing
+    # every one of the ~190,000 characters, which took most of a second at
+    # import.  Instead we build the equivalent expression from ranges.
     _headRanges = [ 
         inclusiveRange( 0x0041,0x005A ),
         inclusiveRange( 0x0061,0x007A ),    
@@ -86,9 +95,9 @@ def _buildUnicodeWord():
     ]
     
     _headChars = \
-        [ chr(c) for c in  [ 0x005F,
-                             0x00A8, 0x00AA, 0x00AD, 0x00AF, 0x2054] ] + \
-        [ chr(c) for r in _headRanges for c in r ]
+        [ range( c, c + 1 ) for c in  [ 0x005F,
+                                        0x00A8, 0x00AA, 0x00AD, 0x00AF, 0x2054] ] + \
+        _headRanges
 
     _identRanges = [
         inclusiveRange( 0x0030, 0x0039 ),
@@ -98,12 +107,10 @@ def _buildUnicodeWord():
         inclusiveRange( 0xFE20, 0xFE2F )
     ]
     
-    _identChars = \
-        [ chr(c) for r in _identRanges for c in r ]
-
-    _identChars = _headChars + _identChars
+    _identChars = _headChars + _identRanges
 
-    return Word( ''.join( _headChars ), ''.join( _identChars ) )( "vertex" )
+    return Regex( _characterClass( _headChars ) +
+                  _characterClass( _identChars ) + "*" )( "vertex" )
 
 biEdge = Literal( "--" )
 unEdge = Literal( "->" )
@@ -208,7 +215,12 @@ class MergeDisallowedError(ParseError):
 
 class MismatchedTagError(ParseError):
     """A vertex or node appeared with inconsistent tags attached."""
-    pass
+    # Set when the graph was read from a file (see soffit.graphfile.)
+    lineNumber = None
+
+    def _printLineNumber( self ):
+        if self.lineNumber is not None:
+            print( "  on line number", self.lineNumber )
 
 class MismatchedVertexError(MismatchedTagError):
     def __init__( self, node, newTag, oldTag ):        
@@ -218,6 +230,7 @@ class MismatchedVertexError(MismatchedTagError):
 
     def prettyPrint( self ):
         print( "Vertex ID '{}' was given tag '{}' when it already had tag '{}'".format( self.node, self.newTag, self.oldTag ) )
+        self._printLineNumber()
 
 class MismatchedEdgeError(MismatchedTagError):
     def __init__( self, src, dst, newTag, oldTag ):        
@@ -228,6 +241,7 @@ class MismatchedEdgeError(MismatchedTagError):
 
     def prettyPrint( self ):
         print( "Edge '{}->{}' was given tag '{}' when it already had tag '{}'".format( self.src, self.dst, self.newTag, self.oldTag ) )
+        self._printLineNumber()
 
 class GraphParsingError(ParseError):
     """An error while parsing a graph."""
@@ -382,7 +396,119 @@ def grouper(iterable, n, fillvalue=None):
     args = [iter(iterable)] * n
     return zip_longest(*args, fillvalue=fillvalue)
 
+class GraphCache(object):
+    """A bounded least-recently-used cache of parsed graphs, keyed by
+    (graph string, joinAllowed)."""
+    def __init__( self, maxSize = 4096 ):
+        self.maxSize = maxSize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get( self, key ):
+        g = self.entries.get( key, None )
+        if g is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end( key )
+        return g
+
+    def put( self, key, g ):
+        if self.maxSize <= 0:
+            return
+        self.entries[key] = g
+        self.entries.move_to_end( key )
+        while len( self.entries ) > self.maxSize:
+            self.entries.popitem( last = False )
+
+    def clear( self ):
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def info( self ):
+        return CacheInfo( self.hits, self.misses, self.maxSize,
+                          len( self.entries ) )
+
+CacheInfo = namedtuple( "CacheInfo", [ "hits", "misses", "maxsize", "currsize" ] )
+
+class _FrozenDict(dict):
+    """An attribute dictionary of a cached graph.  Copies, including the
+    deep copies made by to_directed(), are ordinary dictionaries."""
+    def _readOnly( self, *args, **kwargs ):
+        raise TypeError( "Attributes of a cached graph can't be modified; copy() it first." )
+
+    __setitem__ = _readOnly
+    __delitem__ = _readOnly
+    __ior__ = _readOnly
+    clear = _readOnly
+    pop = _readOnly
+    popitem = _readOnly
+    setdefault = _readOnly
+    update = _readOnly
+
+    def copy( self ):
+        return dict( self )
+
+    def __copy__( self ):
+        return dict( self )
+
+    def __deepcopy__( self, memo ):
+        return copy.deepcopy( dict( self ), memo )
+
+    def __reduce__( self ):
+        return ( dict, ( dict( self ), ) )
+
+def _frozen( d ):
+    return _FrozenDict( ( k, _frozen( v ) if isinstance( v, dict ) else v )
+                        for ( k, v ) in d.items() )
+
+def _freezeGraph( g ):
+    """Make a graph safe to share through the cache: its structure,
+    node and edge attributes, and graph attributes (such as 'join' and
+    'rename') can't be modified."""
+    nx.freeze( g )
+    g.graph = _frozen( g.graph )
+    for n in g._node:
+        g._node[n] = _frozen( g._node[n] )
+    # An edge's attributes are one dict, reached from both endpoints.
+    frozen = {}
+    adjacency = [ g._adj ] + ( [ g._pred ] if g.is_directed() else [] )
+    for adj in adjacency:
+        for nbrs in adj.values():
+            for ( m, d ) in nbrs.items():
+                if id( d ) not in frozen:
+                    frozen[id( d )] = _frozen( d )
+                nbrs[m] = frozen[id( d )]
+    return g
+
+parseCache = GraphCache()
+
+def parseCacheInfo():
+    """Return the hit and miss counts of the parseGraphString cache."""
+    return parseCache.info()
+
+def clearParseCache():
+    parseCache.clear()
+
 def parseGraphString( inputString, quiet=False, joinAllowed=False ):
+    """Parse a graph in Soffit notation and return a networkx graph.
+
+    Results are cached, so the returned graph is shared with every other
+    caller that parsed the same string.  It is frozen, along with its
+    node, edge, and graph attributes; copy() it before modifying it."""
+    key = ( inputString, joinAllowed )
+    g = parseCache.get( key )
+    if g is not None:
+        return g
+
+    g = _parseGraphString( inputString, joinAllowed )
+    if parseCache.maxSize > 0:
+        parseCache.put( key, _freezeGraph( g ) )
+    return g
+
+def _parseGraphString( inputString, joinAllowed ):
     try:
         p = graph.parseString( inputString )
     except ParseException as err:
@@ -412,7 +538,99 @@ def parseGraphString( inputString, quiet=False, joinAllowed=False ):
 
     return ret.graph
             
-def _parseGraphGrammar_v01( obj, quiet = False ):
+def _grammarGraphStrings( obj ):
+    """Yield (graph string, joinAllowed) for every graph in a v0.1 grammar
+    object, in the order _parseGraphGrammar_v01 will ask for them."""
+    for (l,r) in obj.items():
+        if l == "extensions" or l == "version":
+            continue
+        elif l == "start":
+            yield ( r, False )
+        else:
+            yield ( l, False )
+            if isinstance( r, list ):
+                for i in r:
+                    yield ( i, True )
+            else:
+                yield ( r, True )
+
+def serializeGraph( g ):
+    """Flatten a parsed graph into plain lists and dictionaries, which
+    pickle much faster and smaller than a networkx object."""
+    return ( nx.is_directed( g ),
+             list( g.nodes( data='tag' ) ),
+             list( g.edges( data='tag' ) ),
+             g.graph.get( 'join', {} ),
+             g.graph.get( 'rename', {} ) )
+
+def deserializeGraph( s ):
+    """Rebuild the graph flattened by serializeGraph."""
+    ( directed, nodes, edges, join, rename ) = s
+    if directed:
+        g = nx.DiGraph( join = join, rename = rename )
+    else:
+        g = nx.Graph( join = join, rename = rename )
+
+    for (n, tag) in nodes:
+        if tag is None:
+            g.add_node( n )
+        else:
+            g.add_node( n, tag = tag )
+    for (a, b, tag) in edges:
+        if tag is None:
+            g.add_edge( a, b )
+        else:
+            g.add_edge( a, b, tag = tag )
+    return g
+
+def _parseInWorker( item ):
+    """Parse one graph string in a worker process.  Errors are returned
+    rather than raised, so that they are reported in grammar order."""
+    ( inputString, joinAllowed ) = item
+    try:
+        return ( True, serializeGraph( parseGraphString( inputString,
+                                                         joinAllowed=joinAllowed ) ) )
+    except ParseError as pe:
+        return ( False, pe )
+
+def _parallelGraphParser( obj, jobs ):
+    """Parse all the graphs in a grammar object using a pool of 'jobs'
+    worker processes, and return a function with the same signature
+    as parseGraphString that looks up the results."""
+    from concurrent.futures import ProcessPoolExecutor
+    # Graphs already in the parse cache need not be sent to the workers.
+    items = [ k for k in set( _grammarGraphStrings( obj ) )
+              if k not in parseCache.entries ]
+    chunk = max( 1, len( items ) // ( jobs * 4 ) )
+    with ProcessPoolExecutor( max_workers = jobs ) as executor:
+        results = dict( zip( items,
+                             executor.map( _parseInWorker, items,
+                                           chunksize = chunk ) ) )
+
+    for ( k, ( ok, value ) ) in results.items():
+        if ok:
+            g = deserializeGraph( value )
+            if parseCache.maxSize > 0:
+                parseCache.put( k, _freezeGraph( g ) )
+            results[k] = ( True, g )
+
+    def parseGraph( inputString, joinAllowed=False ):
+        key = ( inputString, joinAllowed )
+        if key not in results:
+            return parseGraphString( inputString, joinAllowed=joinAllowed )
+        ( ok, value ) = results[key]
+        if not ok:
+            raise value
+        return value
+
+    return parseGraph
+
+def _parseGraphGrammar_v01( obj, quiet = False, jobs = None ):
+    if jobs is not None and jobs > 1:
+        parseGraph = _parallelGraphParser( obj, jobs )
+    else:
+        parseGraph = parseGraphString
+        
     gg = GraphGrammar()
     for (l,r) in obj.items():
         if l == "extensions":
@@ -422,7 +640,7 @@ def _parseGraphGrammar_v01( obj, quiet = False ):
             pass
         elif l == "start":
             try:
-                gg.start = parseGraphString( r, joinAllowed=False )
+                gg.start = parseGraph( r, joinAllowed=False )
             except GraphParsingError as gpe:
                 raise GrammarParsingError( l, r, "bad start graph", gpe )
             except MergeDisallowedError as mde:
@@ -431,7 +649,7 @@ def _parseGraphGrammar_v01( obj, quiet = False ):
                 raise GrammarParsingError( l, r, "inconsistent tags in start graph", mte )                        
         else:
             try:
-                lg = parseGraphString( l, joinAllowed=False )
+                lg = parseGraph( l, joinAllowed=False )
             except GraphParsingError as gpe:
                 raise GrammarParsingError( l, r, "bad left-hand graph", gpe )
             except MergeDisallowedError as mde:
@@ -443,7 +661,7 @@ def _parseGraphGrammar_v01( obj, quiet = False ):
                 rgList = []
                 for i in r:
                     try:
-                        rg = parseGraphString( i, joinAllowed=True )
+                        rg = parseGraph( i, joinAllowed=True )
                         rgList.append( rg )
                     except GraphParsingError as gpe:
                         raise GrammarParsingError( l, i, "bad right-hand graph in choice", gpe )                        
@@ -452,7 +670,7 @@ def _parseGraphGrammar_v01( obj, quiet = False ):
                 gg.addChoice( lg, rgList )
             else:
                 try:
-                    rg = parseGraphString( r, joinAllowed=True )
+                    rg = parseGraph( r, joinAllowed=True )
                     gg.addRule( lg, rg )
                 except GraphParsingError as gpe:
                     raise GrammarParsingError( l, r, "bad right-hand graph", gpe )                        
@@ -462,26 +680,28 @@ def _parseGraphGrammar_v01( obj, quiet = False ):
     return gg                
 
 
-def _dispatchGrammarParse( ggJson, quiet = False ):
+def _dispatchGrammarParse( ggJson, quiet = False, jobs = None ):
     if 'version' not in ggJson or ggJson['version'] == "0.1":
-        return _parseGraphGrammar_v01( ggJson )
+        return _parseGraphGrammar_v01( ggJson, jobs = jobs )
     else:
         if not quiet:
             print( "Unknown version", ggJson['version'] )
         return None
 
-def parseGraphGrammar( inputString, quiet=False ):
+def parseGraphGrammar( inputString, quiet=False, jobs=None ):
+    """Parse a JSON graph grammar.  If 'jobs' is greater than one, the
+    graphs in the grammar are parsed in that many worker processes."""
     # FIXME: handle parse error
     ggJson = json.loads( inputString )
     try:
-        return _dispatchGrammarParse( ggJson )
+        return _dispatchGrammarParse( ggJson, jobs = jobs )
     except GrammarParsingError as pe:
         pe.updateLineNumber( inputString )
         raise pe
         
-def loadGraphGrammar( f, quiet=False ):
-    # FIXME: handle parse error
-    ggJson = json.load( f )
-    return _dispatchGrammarParse( ggJson )
+def loadGraphGrammar( f, quiet=False, jobs=None ):
+    """Load a JSON graph grammar from a file; see parseGraphGrammar."""
+    # Read the whole text so that errors can be given a line number.
+    return parseGraphGrammar( f.read(), quiet=quiet, jobs=jobs )
 
 
@@ -0,0 +1,324 @@
+"""Persistent graph snapshots with structural sharing."""
+#
+#   soffit/persistent.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+# Keeping every intermediate graph of a derivation with g.copy() costs
+# O(iterations x graph size).  Instead, GraphHistory mirrors the working
+# graph in persistent hash-array mapped tries (HAMTs): updating a key
+# copies only the O(log n) trie nodes on its path and shares the rest, so
+# a rewrite costs O(rule size) to record and a snapshot costs O(1).
+#
+# Snapshots are frozen networkx graphs whose internal dicts (_node, _adj,
+# _pred) are replaced by PersistentMaps, so the whole networkx read API
+# (views, algorithms, drawing, copy()) works on them unchanged.
+
+from collections.abc import Mapping
+from types import MappingProxyType
+import networkx as nx
+
+_BITS = 5
+_MASK = ( 1 << _BITS ) - 1
+_HASH_BITS = 64
+_HASH_MASK = ( 1 << _HASH_BITS ) - 1
+
+def _hash( key ):
+    return hash( key ) & _HASH_MASK
+
+class _Node(object):
+    """A trie node: a bitmap of which of the 32 slots are used, and a
+    tuple with an entry for each used slot.  An entry is either a
+    (key, value) tuple or another _Node or _Collision."""
+    __slots__ = ( 'bitmap', 'entries' )
+
+    def __init__( self, bitmap, entries ):
+        self.bitmap = bitmap
+        self.entries = entries
+
+class _Collision(object):
+    """Keys whose hashes agree in all 64 bits."""
+    __slots__ = ( 'entries', )
+
+    def __init__( self, entries ):
+        self.entries = entries
+
+_emptyNode = _Node( 0, () )
+
+def _pair( shift, e1, h1, e2, h2 ):
+    if shift >= _HASH_BITS:
+        return _Collision( ( e1, e2 ) )
+    b1 = ( h1 >> shift ) & _MASK
+    b2 = ( h2 >> shift ) & _MASK
+    if b1 == b2:
+        return _Node( 1 << b1, ( _pair( shift + _BITS, e1, h1, e2, h2 ), ) )
+    elif b1 < b2:
+        return _Node( ( 1 << b1 ) | ( 1 << b2 ), ( e1, e2 ) )
+    else:
+        return _Node( ( 1 << b1 ) | ( 1 << b2 ), ( e2, e1 ) )
+
+def _lookup( node, h, key, default ):
+    shift = 0
+    while True:
+        if isinstance( node, _Collision ):
+            for ( k, v ) in node.entries:
+                if k == key:
+                    return v
+            return default
+        bit = 1 << ( ( h >> shift ) & _MASK )
+        if not node.bitmap & bit:
+            return default
+        e = node.entries[ bin( node.bitmap & ( bit - 1 ) ).count( "1" ) ]
+        if isinstance( e, tuple ):
+            return e[1] if e[0] == key else default
+        node = e
+        shift += _BITS
+
+def _assoc( node, shift, h, key, value ):
+    """Return ( new node, whether the key was added. )"""
+    if isinstance( node, _Collision ):
+        entries = tuple( e for e in node.entries if e[0] != key )
+        added = len( entries ) == len( node.entries )
+        return ( _Collision( entries + ( ( key, value ), ) ), added )
+
+    bit = 1 << ( ( h >> shift ) & _MASK )
+    idx = bin( node.bitmap & ( bit - 1 ) ).count( "1" )
+    entries = node.entries
+    if not node.bitmap & bit:
+        return ( _Node( node.bitmap | bit,
+                        entries[:idx] + ( ( key, value ), ) + entries[idx:] ),
+                 True )
+
+    e = entries[idx]
+    if isinstance( e, tuple ):
+        if e[0] == key:
+            sub = ( key, value )
+            added = False
+        else:
+            sub = _pair( shift + _BITS, e, _hash( e[0] ), ( key, value ), h )
+            added = True
+    else:
+        ( sub, added ) = _assoc( e, shift + _BITS, h, key, value )
+    return ( _Node( node.bitmap, entries[:idx] + ( sub, ) + entries[idx+1:] ),
+             added )
+
+def _dissoc( node, shift, h, key ):
+    """Return ( replacement, whether the key was removed. )  The
+    replacement is None if the node is now empty, or a bare (key, value)
+    entry if only one is left below the root."""
+    if isinstance( node, _Collision ):
+        entries = tuple( e for e in node.entries if e[0] != key )
+        if len( entries ) == len( node.entries ):
+            return ( node, False )
+        elif len( entries ) == 1:
+            return ( entries[0], True )
+        else:
+            return ( _Collision( entries ), True )
+
+    bit = 1 << ( ( h >> shift ) & _MASK )
+    if not node.bitmap & bit:
+        return ( node, False )
+    idx = bin( node.bitmap & ( bit - 1 ) ).count( "1" )
+    entries = node.entries
+    e = entries[idx]
+    if isinstance( e, tuple ):
+        if e[0] != key:
+            return ( node, False )
+        sub = None
+    else:
+        ( sub, removed ) = _dissoc( e, shift + _BITS, h, key )
+        if not removed:
+            return ( node, False )
+
+    if sub is None:
+        bitmap = node.bitmap & ~bit
+        entries = entries[:idx] + entries[idx+1:]
+        if bitmap == 0:
+            return ( None, True )
+    else:
+        bitmap = node.bitmap
+        entries = entries[:idx] + ( sub, ) + entries[idx+1:]
+
+    if shift > 0 and len( entries ) == 1 and isinstance( entries[0], tuple ):
+        return ( entries[0], True )
+    return ( _Node( bitmap, entries ), True )
+
+def _iterate( node ):
+    for e in node.entries:
+        if isinstance( e, tuple ):
+            yield e
+        else:
+            yield from _iterate( e )
+
+class PersistentMap(Mapping):
+    """An immutable mapping.  set() and delete() return a new map that
+    shares all but O(log n) of its structure with the old one."""
+    __slots__ = ( '_root', '_count' )
+
+    def __init__( self, items = None ):
+        self._root = _emptyNode
+        self._count = 0
+        if items is not None:
+            root = self._root
+            count = 0
+            for ( k, v ) in items:
+                ( root, added ) = _assoc( root, 0, _hash( k ), k, v )
+                count += added
+            self._root = root
+            self._count = count
+
+    @classmethod
+    def _make( cls, root, count ):
+        m = cls.__new__( cls )
+        m._root = root
+        m._count = count
+        return m
+
+    def __getitem__( self, key ):
+        v = _lookup( self._root, _hash( key ), key, _missing )
+        if v is _missing:
+            raise KeyError( key )
+        return v
+
+    def get( self, key, default = None ):
+        return _lookup( self._root, _hash( key ), key, default )
+
+    def __contains__( self, key ):
+        return _lookup( self._root, _hash( key ), key, _missing ) is not _missing
+
+    def __len__( self ):
+        return self._count
+
+    def __iter__( self ):
+        return ( k for ( k, v ) in _iterate( self._root ) )
+
+    def items( self ):
+        return _iterate( self._root )
+
+    def set( self, key, value ):
+        ( root, added ) = _assoc( self._root, 0, _hash( key ), key, value )
+        return PersistentMap._make( root, self._count + added )
+
+    def delete( self, key ):
+        ( root, removed ) = _dissoc( self._root, 0, _hash( key ), key )
+        if not removed:
+            return self
+        if root is None:
+            root = _emptyNode
+        return PersistentMap._make( root, self._count - 1 )
+
+    def __repr__( self ):
+        return "PersistentMap({" + ", ".join( "{!r}: {!r}".format( k, v )
+                                             for ( k, v ) in self.items() ) + "})"
+
+_missing = object()
+emptyMap = PersistentMap()
+
+# Graph attributes that are caches of the working graph, not part of it.
+_transientGraphKeys = frozenset( [ 'node_tag_cache', 'edge_tag_cache',
+                                  'degree_index' ] )
+
+def _frozenData( d ):
+    return MappingProxyType( dict( d ) )
+
+class GraphHistory(object):
+    """Persistent copies of a working graph, one per call to snapshot().
+
+    Create it from the working graph, and after each rewrite call update()
+    with the graph and the UndoLog that recorded the rewrite."""
+
+    def __init__( self, g ):
+        self.rebase( g )
+        self.snapshots = []
+
+    def rebase( self, g ):
+        """Start over from g, which has been replaced rather than rewritten
+        (for example, renumbered or made directed.)  Earlier snapshots are
+        kept, but share nothing with later ones."""
+        self.directed = nx.is_directed( g )
+        self.nodes = PersistentMap( ( n, _frozenData( d ) )
+                                    for ( n, d ) in g.nodes( data=True ) )
+        adj = {}
+        pred = {}
+        for ( a, b, d ) in g.edges( data=True ):
+            d = _frozenData( d )
+            adj.setdefault( a, [] ).append( ( b, d ) )
+            if self.directed:
+                pred.setdefault( b, [] ).append( ( a, d ) )
+            elif a != b:
+                adj.setdefault( b, [] ).append( ( a, d ) )
+        self.adj = PersistentMap( ( n, PersistentMap( adj.get( n, None ) ) )
+                                  for n in g.nodes )
+        if self.directed:
+            self.pred = PersistentMap( ( n, PersistentMap( pred.get( n, None ) ) )
+                                       for n in g.nodes )
+
+    def _setEdge( self, a, b, d ):
+        self.adj = self.adj.set( a, self.adj[a].set( b, d ) )
+        if self.directed:
+            self.pred = self.pred.set( b, self.pred[b].set( a, d ) )
+        elif a != b:
+            self.adj = self.adj.set( b, self.adj[b].set( a, d ) )
+
+    def _removeEdge( self, a, b ):
+        if a in self.adj:
+            self.adj = self.adj.set( a, self.adj[a].delete( b ) )
+        if self.directed:
+            if b in self.pred:
+                self.pred = self.pred.set( b, self.pred[b].delete( a ) )
+        elif b in self.adj:
+            self.adj = self.adj.set( b, self.adj[b].delete( a ) )
+
+    def update( self, g, log ):
+        """Bring the history's copy of g up to date with the nodes and edges
+        changed by the rewrites recorded in log."""
+        ( nodes, edges ) = log.changes()
+        for n in nodes:
+            if n in g:
+                self.nodes = self.nodes.set( n, _frozenData( g.nodes[n] ) )
+                if n not in self.adj:
+                    self.adj = self.adj.set( n, emptyMap )
+                    if self.directed:
+                        self.pred = self.pred.set( n, emptyMap )
+
+        for ( a, b ) in edges:
+            if g.has_edge( a, b ):
+                self._setEdge( a, b, _frozenData( g.edges[a, b] ) )
+            else:
+                self._removeEdge( a, b )
+
+        for n in nodes:
+            if n not in g:
+                self.nodes = self.nodes.delete( n )
+                self.adj = self.adj.delete( n )
+                if self.directed:
+                    self.pred = self.pred.delete( n )
+
+    def snapshot( self, g ):
+        """Record and return a read-only view of the current state;
+        g supplies the graph attributes."""
+        view = nx.DiGraph() if self.directed else nx.Graph()
+        view.graph.update( ( k, v ) for ( k, v ) in g.graph.items()
+                           if k not in _transientGraphKeys )
+        view._node = self.nodes
+        view._adj = self.adj
+        if self.directed:
+            # networkx 2.x does not keep _succ in step with _adj.
+            view._succ = self.adj
+            view._pred = self.pred
+        view = nx.freeze( view )
+        self.snapshots.append( view )
+        return view
@@ -0,0 +1,158 @@
+"""Backtracking search over derivations of a graph grammar."""
+#
+#   soffit/search.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+# ApplicationState picks one random match per iteration and never looks
+# back.  To steer a derivation toward a target (say, a colored pentomino
+# tiling with every square covered) we instead try each match in turn,
+# depth-first.  Every rewrite is made in place and recorded in an UndoLog,
+# so backing out of a branch costs as much as the rules applied on it,
+# not a copy of the graph.
+
+import networkx as nx
+from soffit.graph import MatchFinder, RuleApplication, UndoLog
+from soffit.canonical import GraphHasher
+from soffit.mixed import mixedGraph
+
+class DerivationSearch(object):
+    """Depth-first search for a sequence of rule applications after which
+    goal( graph ) is true.
+
+    prune( graph, depth ), if given, is called before expanding a graph and
+    may return True to skip everything below it.  maxDepth bounds the length
+    of a derivation, maxBranches the total number of rule applications
+    tried, and maxMatches the number of matches considered for each rule
+    at each step.  If rng (a random.Random) is given, rules and matches
+    are tried in a random order; otherwise in grammar order.
+
+    If dedupe is set, a graph whose canonical hash (see soffit.canonical)
+    has already been seen is not expanded again.  Since the first visit
+    may have been deeper, this can miss derivations near maxDepth; and
+    graphs that are WL-equivalent but not isomorphic count as seen."""
+
+    def __init__( self, grammar, goal, prune = None, maxDepth = 20,
+                  maxBranches = None, maxMatches = 1000, rng = None,
+                  verify = None, dedupe = False ):
+        self.grammar = grammar
+        self.rules = list( grammar.rulesIter() )
+        self.goal = goal
+        self.prune = prune
+        self.maxDepth = maxDepth
+        self.maxBranches = maxBranches
+        self.maxMatches = maxMatches
+        self.rng = rng
+        self.verify = verify
+        self.dedupe = dedupe
+
+        self.graph = None
+        self.path = []
+        self.branches = 0
+        self.undo = UndoLog()
+        self.hasher = None
+        self.visited = set()
+
+    def _makeAllDirected( self, graph ):
+        if nx.is_directed( graph ):
+            self.rules = list( self.grammar.directedGrammar().rulesIter() )
+            return graph
+        elif self.grammar.directed:
+            return mixedGraph( graph )
+        return graph
+
+    def search( self, graph ):
+        """Search from graph, which must be labeled by graphIdentifiersToNumbers
+        (or soffit.graphfile.)  The graph is modified in place, unless it
+        must first be converted to a directed graph.
+
+        Returns the derivation found, as a list of (left, right, match), or
+        None.  On success self.graph is the goal graph; otherwise it has
+        been restored to its starting state."""
+        self.graph = self._makeAllDirected( graph )
+        # Tag caches left by chooseAndApply would go stale as we rewrite.
+        self.graph.graph.pop( 'node_tag_cache', None )
+        self.graph.graph.pop( 'edge_tag_cache', None )
+        self.path = []
+        self.branches = 0
+        if self.dedupe:
+            self.hasher = GraphHasher( self.graph )
+            self.visited = set( [ self.hasher.hexdigest() ] )
+
+        if self._search( 0 ):
+            return list( self.path )
+        else:
+            return None
+
+    def _search( self, depth ):
+        g = self.graph
+        if self.goal( g ):
+            return True
+        if depth >= self.maxDepth:
+            return False
+        if self.prune is not None and self.prune( g, depth ):
+            return False
+
+        rules = self.rules
+        if self.rng is not None:
+            rules = self.rng.sample( rules, len( rules ) )
+
+        for ( left, right ) in rules:
+            finder = MatchFinder( g, already_labeled = True )
+            finder.maxMatches = self.maxMatches
+            finder.breakSymmetry = True
+            finder.leftSide( left )
+            finder.rightSide( right )
+            matches = finder.matches()
+            if self.rng is not None:
+                self.rng.shuffle( matches )
+
+            for m in matches:
+                if self.maxBranches is not None and \
+                   self.branches >= self.maxBranches:
+                    return False
+                self.branches += 1
+
+                mark = self.undo.mark()
+                RuleApplication( finder, m ).result( copy = False,
+                                                     verify = self.verify,
+                                                     undo = self.undo )
+                if self._unvisited( mark ):
+                    self.path.append( ( left, right, m ) )
+                    if self._search( depth + 1 ):
+                        return True
+                    self.path.pop()
+                self._rollback( mark )
+
+        return False
+
+    def _unvisited( self, mark ):
+        if self.hasher is None:
+            return True
+        self.hasher.update( self.graph, *self.undo.changes( mark ) )
+        digest = self.hasher.hexdigest()
+        if digest in self.visited:
+            return False
+        self.visited.add( digest )
+        return True
+
+    def _rollback( self, mark ):
+        if self.hasher is not None:
+            changes = self.undo.changes( mark )
+            self.undo.rollback( self.graph, mark )
+            self.hasher.update( self.graph, *changes )
+        else:
+            self.undo.rollback( self.graph, mark )
@@ -0,0 +1,302 @@
+"""Read-only snapshots of a working graph in shared memory."""
+#
+#   soffit/shared.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+# A worker process that is not forked from the one holding the working
+# graph would otherwise receive a pickled copy of it, which costs time in
+# the parent and memory in every worker.  Instead, the parent exports the
+# graph once into a multiprocessing.shared_memory segment, and workers map
+# the segment and use it in place as a read-only CompactGraph.
+#
+# The segment holds a header of 64-bit integers, followed by 32-bit
+# arrays laid out as in CompactGraph (see soffit/compact.py):
+#
+#   nodeTag[nextId]         tag ID of each node ID, -1 where there is none
+#   offsets[nextId + 1]     incident[offsets[n]:offsets[n+1]] are the
+#   incident[...]           edge slots at node n, ~e for incoming edges
+#   edgeSrc[E], edgeDst[E], edgeTag[E]
+#
+# and then the pickled tag names and graph attributes.
+#
+# Each snapshot records graphVersion() of the graph it was taken from.
+# A SnapshotPublisher reuses its snapshot until the graph is rewritten,
+# then sets the old one's stale flag before unlinking it; a worker that
+# still has the old one mapped can check stale() before trusting it.
+# Only rewrites, rollbacks, and renumbering change the version, so the
+# publisher also compares node and edge counts, which catches most
+# direct edits; code that changes tags directly should call
+# graphChanged().
+
+import pickle
+import weakref
+from array import array
+from collections import namedtuple
+from multiprocessing import shared_memory
+import networkx as nx
+from soffit.compact import CompactGraph
+from soffit.graph import graphVersion, graphChanged
+from soffit.tags import TagTable
+
+_MAGIC = 0x534f46464954   # "SOFFIT"
+_FORMAT = 1
+
+( _H_MAGIC, _H_FORMAT, _H_VERSION, _H_STALE, _H_DIRECTED, _H_NODES,
+  _H_IDS, _H_INCIDENT, _H_EDGES, _H_PICKLE ) = range( 10 )
+_HEADER_BYTES = 16 * 8
+
+# Graph attributes that refer to the graph object itself.
+_localAttributes = ( 'node_tag_cache', 'edge_tag_cache', 'degree_index' )
+
+def _shape( g ):
+    """What a snapshot must agree with to be reused for g."""
+    return ( graphVersion( g ), len( g ), g.number_of_edges(),
+             g.graph.get( 'nextId', None ) )
+
+class StaleSnapshot(Exception):
+    """A snapshot is older than the graph it was taken from."""
+    pass
+
+def _attach( name ):
+    # Only the creator should unlink the segment when it exits; Python
+    # 3.13 lets other processes say so.  Earlier versions register every
+    # attachment, but worker processes share their parent's resource
+    # tracker, so that is harmless for them.
+    try:
+        return shared_memory.SharedMemory( name = name, track = False )
+    except TypeError:
+        return shared_memory.SharedMemory( name = name )
+
+class SharedSnapshot(object):
+    """A snapshot of a graph with non-negative integer nodes, in a shared
+    memory segment owned by this process."""
+
+    def __init__( self, g ):
+        self.version = graphVersion( g )
+        self.shape = _shape( g )
+        directed = nx.is_directed( g )
+        tags = TagTable()
+        numIds = max( g.graph.get( 'nextId', 0 ),
+                      max( g.nodes, default = -1 ) + 1 )
+
+        nodeTag = array( 'i', [ -1 ] ) * numIds
+        for ( n, tag ) in g.nodes( data='tag' ):
+            nodeTag[n] = tags.intern( tag )
+
+        incident = [ [] for n in range( numIds ) ]
+        edgeSrc = array( 'i' )
+        edgeDst = array( 'i' )
+        edgeTag = array( 'i' )
+        for ( e, ( a, b, tag ) ) in enumerate( g.edges( data='tag' ) ):
+            edgeSrc.append( a )
+            edgeDst.append( b )
+            edgeTag.append( tags.intern( tag ) )
+            incident[a].append( e )
+            if directed:
+                incident[b].append( ~e )
+            elif a != b:
+                incident[b].append( e )
+
+        offsets = array( 'i', [ 0 ] )
+        flat = array( 'i' )
+        for slots in incident:
+            flat.extend( slots )
+            offsets.append( len( flat ) )
+
+        attributes = { k : v for ( k, v ) in g.graph.items()
+                       if k not in _localAttributes }
+        extra = pickle.dumps( ( tags.names, attributes ) )
+
+        sections = [ nodeTag, offsets, flat, edgeSrc, edgeDst, edgeTag ]
+        size = _HEADER_BYTES + sum( len( s ) * s.itemsize for s in sections ) + len( extra )
+        self.shm = shared_memory.SharedMemory( create = True, size = size )
+
+        header = self.shm.buf[:_HEADER_BYTES].cast( 'q' )
+        header[_H_MAGIC] = _MAGIC
+        header[_H_FORMAT] = _FORMAT
+        header[_H_VERSION] = self.version
+        header[_H_STALE] = 0
+        header[_H_DIRECTED] = int( directed )
+        header[_H_NODES] = len( g )
+        header[_H_IDS] = numIds
+        header[_H_INCIDENT] = len( flat )
+        header[_H_EDGES] = len( edgeSrc )
+        header[_H_PICKLE] = len( extra )
+        header.release()
+
+        start = _HEADER_BYTES
+        for s in sections + [ extra ]:
+            data = s.tobytes() if isinstance( s, array ) else s
+            self.shm.buf[start:start + len( data )] = data
+            start += len( data )
+
+    @property
+    def name( self ):
+        return self.shm.name
+
+    def handle( self ):
+        """A small picklable reference to the snapshot, for workers."""
+        return SnapshotHandle( self.shm.name, self.version )
+
+    def markStale( self ):
+        header = self.shm.buf[:_HEADER_BYTES].cast( 'q' )
+        header[_H_STALE] = 1
+        header.release()
+
+    def close( self ):
+        """Mark the snapshot stale and remove it.  Processes that have it
+        mapped can go on using it until they close it."""
+        self.markStale()
+        self.shm.close()
+        self.shm.unlink()
+
+class SnapshotHandle(namedtuple( 'SnapshotHandle', [ 'name', 'version' ] )):
+    """The name and graph version of a SharedSnapshot."""
+    def attach( self ):
+        return SharedGraph( self.name, self.version )
+
+class _IncidentRows(object):
+    """incident[offsets[n]:offsets[n+1]] for each node n, without copying."""
+    def __init__( self, offsets, incident ):
+        self.offsets = offsets
+        self.incident = incident
+
+    def __len__( self ):
+        return len( self.offsets ) - 1
+
+    def __getitem__( self, n ):
+        return self.incident[self.offsets[n]:self.offsets[n + 1]]
+
+    def __iter__( self ):
+        return ( self[n] for n in range( len( self ) ) )
+
+class SharedGraph(CompactGraph):
+    """A read-only CompactGraph over a SharedSnapshot, which may have been
+    created by another process.  Only the graph attribute dict is local,
+    so MatchFinder can keep its caches there.  copy() makes an ordinary,
+    modifiable CompactGraph."""
+
+    def __init__( self, name, version = None ):
+        self._shm = _attach( name )
+        buf = self._shm.buf
+        self._header = buf[:_HEADER_BYTES].cast( 'q' )
+        self._views = [ self._header ]
+        h = self._header
+        if h[_H_MAGIC] != _MAGIC or h[_H_FORMAT] != _FORMAT:
+            self.close()
+            raise ValueError( "Not a graph snapshot: " + name )
+        self.version = h[_H_VERSION]
+        if version is not None and self.version != version:
+            self.close()
+            raise StaleSnapshot( "Snapshot {} has version {}, not {}".format(
+                name, self.version, version ) )
+
+        self.directed = bool( h[_H_DIRECTED] )
+        numIds = h[_H_IDS]
+        numEdges = h[_H_EDGES]
+        lengths = [ numIds, numIds + 1, h[_H_INCIDENT], numEdges, numEdges, numEdges ]
+        end = _HEADER_BYTES + 4 * sum( lengths )
+        ints = buf[_HEADER_BYTES:end].toreadonly().cast( 'i' )
+        self._views.append( ints )
+        start = 0
+        for length in lengths:
+            self._views.append( ints[start:start + length] )
+            start += length
+        ( self._nodeTag, offsets, incident,
+          self._edgeSrc, self._edgeDst, self._edgeTag ) = self._views[2:]
+        self._incident = _IncidentRows( offsets, incident )
+
+        ( names, attributes ) = pickle.loads( buf[end:end + h[_H_PICKLE]] )
+        self.tags = TagTable()
+        self.tags.names = names
+        self.tags.ids = { tag : i for ( i, tag ) in enumerate( names ) }
+        self.graph = attributes
+        self._numNodes = h[_H_NODES]
+        self._numEdges = numEdges
+        self._freeEdges = array( 'i' )
+        self._makeViews()
+
+    def stale( self ):
+        """Whether the graph has changed since this snapshot was taken."""
+        return self._header[_H_STALE] != 0
+
+    def check( self ):
+        """Raise StaleSnapshot if the snapshot is out of date."""
+        if self.stale():
+            raise StaleSnapshot( "Snapshot {} (version {}) is out of date".format(
+                self._shm.name, self.version ) )
+
+    def close( self ):
+        """Unmap the snapshot; the graph can't be used afterwards."""
+        for v in reversed( self._views ):
+            v.release()
+        self._views = []
+        self._shm.close()
+
+    def _readOnly( self, *args, **kwargs ):
+        raise nx.NetworkXError( "A shared graph snapshot can't be modified." )
+
+    add_node = _readOnly
+    add_nodes_from = _readOnly
+    remove_node = _readOnly
+    remove_nodes_from = _readOnly
+    add_edge = _readOnly
+    add_edges_from = _readOnly
+    remove_edge = _readOnly
+    remove_edges_from = _readOnly
+
+    def copy( self ):
+        c = CompactGraph( self.directed, TagTable() )
+        c.graph = dict( self.graph )
+        c.add_nodes_from( self.nodes( data='tag' ) )
+        for ( a, b, tag ) in self.edges( data='tag' ):
+            c._setEdgeTag( c._addEdge( a, b ), tag )
+        return c
+
+    def __reduce__( self ):
+        # Pickle as a reference to the same snapshot.
+        return ( SharedGraph, ( self._shm.name, self.version ) )
+
+class SnapshotPublisher(object):
+    """Keeps one SharedSnapshot of the most recently published graph,
+    replacing it when that graph changes or a different graph is
+    published."""
+
+    def __init__( self ):
+        self.snapshot = None
+        self.graph = None
+
+    def publish( self, g ):
+        """A SharedSnapshot of g as it is now."""
+        s = self.snapshot
+        if s is not None and self.graph() is g:
+            if s.shape == _shape( g ):
+                return s
+            if s.version == graphVersion( g ):
+                # Edited directly; give the new snapshot its own version.
+                graphChanged( g )
+        self.close()
+        self.snapshot = SharedSnapshot( g )
+        self.graph = weakref.ref( g )
+        return self.snapshot
+
+    def close( self ):
+        """Remove the current snapshot, if any."""
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+            self.graph = None
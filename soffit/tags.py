@@ -0,0 +1,93 @@
+"""Interning of tags as small integers."""
+#
+#   soffit/tags.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+# Tags are strings in a grammar, but the matcher only ever compares them
+# for equality and uses them as dictionary keys.  An interned graph
+# stores each tag as its ID in a TagTable instead, and keeps the table in
+# its graph['tags'] attribute.  Since a rewrite only copies tags from the
+# right-hand side of a rule, a graph and grammar interned with the same
+# table stay consistent without any further lookups; externTags() turns
+# the IDs back into strings for rendering or saving.
+
+class TagTable(object):
+    """Interned tags.  ID 0 is reserved for "no tag"."""
+    def __init__( self ):
+        self.ids = { None : 0 }
+        self.names = [ None ]
+
+    def __len__( self ):
+        return len( self.names )
+
+    def __deepcopy__( self, memo ):
+        # Shared by every graph interned with it, including copies made
+        # by to_directed(), which deep-copies graph attributes.
+        return self
+
+    def intern( self, tag ):
+        i = self.ids.get( tag, None )
+        if i is None:
+            i = len( self.names )
+            self.ids[tag] = i
+            self.names.append( tag )
+        return i
+
+    def name( self, i ):
+        return self.names[i]
+
+    def internGraph( self, g ):
+        """Add every tag in g to the table."""
+        for ( n, tag ) in g.nodes( data='tag' ):
+            if tag is not None:
+                self.intern( tag )
+        for ( a, b, tag ) in g.edges( data='tag' ):
+            if tag is not None:
+                self.intern( tag )
+
+# Graph attributes which hold tags, and so can't be carried across.
+_tagKeyedAttributes = ( 'tags', 'node_tag_cache', 'edge_tag_cache', 'degree_index' )
+
+def _convert( d, f ):
+    if 'tag' in d:
+        d = dict( d )
+        d['tag'] = f( d['tag'] )
+    return d
+
+def _convertGraph( g, f, table ):
+    h = g.__class__()
+    h.graph.update( ( k, v ) for ( k, v ) in g.graph.items()
+                    if k not in _tagKeyedAttributes )
+    if table is not None:
+        h.graph['tags'] = table
+    h.add_nodes_from( ( n, _convert( d, f ) ) for ( n, d ) in g.nodes( data=True ) )
+    h.add_edges_from( ( a, b, _convert( d, f ) ) for ( a, b, d ) in g.edges( data=True ) )
+    return h
+
+def internTags( g, table ):
+    """A copy of g with each tag replaced by its ID in table."""
+    if 'tags' in g.graph:
+        g = externTags( g )
+    return _convertGraph( g, table.intern, table )
+
+def externTags( g, copy = False ):
+    """A copy of g with its tags converted back to strings, if it is an
+    interned graph.  Otherwise g itself, or a copy if copy is set."""
+    table = g.graph.get( 'tags', None )
+    if table is None:
+        return g.copy() if copy else g
+    return _convertGraph( g, table.name, None )
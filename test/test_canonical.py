@@ -0,0 +1,127 @@
+"""Test canonical graph hashing."""
+#
+#   test/test_canonical.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import random
+import networkx as nx
+from soffit.canonical import graphHash, GraphSet
+from soffit.application import ApplicationState
+from soffit.parse import parseGraphString, parseGraphGrammar
+from soffit.graph import graphIdentifiersToNumbers
+from soffit.search import DerivationSearch
+
+def shuffled( g, rng ):
+    """A copy of g with new node IDs, and nodes and edges added in a
+    different order."""
+    nodes = list( g.nodes )
+    rng.shuffle( nodes )
+    relabel = { n : i + 100 for ( i, n ) in enumerate( nodes ) }
+    edges = list( g.edges( data=True ) )
+    rng.shuffle( edges )
+    h = g.__class__()
+    h.add_nodes_from( ( relabel[n], g.nodes[n] ) for n in nodes )
+    h.add_edges_from( ( relabel[a], relabel[b], d ) for ( a, b, d ) in edges )
+    return h
+
+class TestGraphHash(unittest.TestCase):
+    def test_relabeling( self ):
+        rng = random.Random( 5 )
+        for directed in [ False, True ]:
+            g = nx.gnm_random_graph( 30, 60, seed = 5, directed = directed )
+            for n in g.nodes:
+                if rng.random() < 0.5:
+                    g.nodes[n]['tag'] = rng.choice( "abc" )
+            for e in g.edges:
+                if rng.random() < 0.5:
+                    g.edges[e]['tag'] = rng.choice( "xy" )
+            self.assertEqual( graphHash( g ), graphHash( shuffled( g, rng ) ) )
+
+    def test_tags_matter( self ):
+        base = graphHash( parseGraphString( "A[x]; A--B--C" ) )
+        self.assertEqual( base, graphHash( parseGraphString( "R[x]; P--Q--R" ) ) )
+        self.assertNotEqual( base, graphHash( parseGraphString( "B[x]; A--B--C" ) ) )
+        self.assertNotEqual( base, graphHash( parseGraphString( "A[x]; A--B; B--C [e]" ) ) )
+        self.assertNotEqual( graphHash( parseGraphString( "A[x]; A->B" ) ),
+                             graphHash( parseGraphString( "A[x]; A<-B" ) ) )
+
+    def test_incremental( self ):
+        grammar = parseGraphGrammar( """{
+            "version" : "0.1",
+            "start" : "A[x]; B[y]; A--B",
+            "X[x]; Y[y]; X--Y" : [ "X[y]; Y[x]; X--Y--Z; Z[z]",
+                                   "X^Y[x]; X--Z; Z[y]; X--X[loop]" ],
+            "X[z]" : "X[x]; X--Y; Y[y]",
+            "X[z]; X--Y" : "Y"
+        }""" )
+        random.seed( 3 )
+        checked = []
+        def callback( i, g ):
+            self.assertEqual( app.graphHash(), graphHash( g ) )
+            checked.append( i )
+
+        app = ApplicationState( initialGraph = grammar.start,
+                                grammar = grammar,
+                                callback = callback )
+        app.verbose = False
+        app.trackHash()
+        app.run( maxIterations = 30 )
+        self.assertGreater( len( checked ), 10 )
+
+class TestGraphSet(unittest.TestCase):
+    def test_confirm( self ):
+        # Both 2-regular on 6 nodes, so WL can't tell them apart.
+        cycle = nx.cycle_graph( 6 )
+        triangles = nx.disjoint_union( nx.cycle_graph( 3 ), nx.cycle_graph( 3 ) )
+        self.assertEqual( graphHash( cycle ), graphHash( triangles ) )
+
+        exact = GraphSet()
+        self.assertTrue( exact.add( cycle ) )
+        self.assertFalse( exact.add( nx.relabel_nodes( cycle, lambda n : n + 10 ) ) )
+        self.assertNotIn( triangles, exact )
+        self.assertTrue( exact.add( triangles ) )
+        self.assertEqual( len( exact ), 2 )
+
+        approximate = GraphSet( confirm = False )
+        self.assertTrue( approximate.add( cycle ) )
+        self.assertIn( triangles, approximate )
+        self.assertEqual( len( approximate ), 1 )
+
+    def test_search_dedupe( self ):
+        grammar = parseGraphGrammar( """{
+            "version" : "0.1",
+            "start" : "A[x]; B[x]; C[x]; A--B--C--A",
+            "X[x]" : "X[y]"
+        }""" )
+        never = lambda g : False
+        plain = DerivationSearch( grammar, never )
+        self.assertIsNone( plain.search( graphIdentifiersToNumbers( grammar.start ) ) )
+        dedupe = DerivationSearch( grammar, never, dedupe = True )
+        g = graphIdentifiersToNumbers( grammar.start )
+        before = graphHash( g )
+        self.assertIsNone( dedupe.search( g ) )
+
+        # Every order of retagging the three nodes: 3 + 3*2 + 3*2*1
+        self.assertEqual( plain.branches, 15 )
+        # Zero through three 'y' nodes
+        self.assertEqual( len( dedupe.visited ), 4 )
+        self.assertLess( dedupe.branches, plain.branches )
+        self.assertEqual( dedupe.hasher.hexdigest(), before )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Test the array-backed graph representation."""
+#
+#   test/test_compact.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import networkx as nx
+import soffit.graph as sg
+from soffit.compact import CompactGraph
+from soffit.parse import parseGraphString
+
+def tagged( g ):
+    """Nodes and edges with tags, normalized for comparison."""
+    nodes = sorted( g.nodes( data='tag' ), key = repr )
+    if nx.is_directed( g ):
+        edges = list( g.edges( data='tag' ) )
+    else:
+        edges = [ ( min( a, b ), max( a, b ), t ) for ( a, b, t ) in g.edges( data='tag' ) ]
+    return ( nodes, sorted( edges, key = repr ) )
+
+class TestCompactGraph(unittest.TestCase):
+    def test_roundtrip( self ):
+        for text in [ "A[x]; B; A--B [e]; B--C--A; C--C [loop]",
+                      "A[x]; A->B [e]; B->A; B->C; C[y]" ]:
+            g = sg.graphIdentifiersToNumbers( parseGraphString( text ) )
+            c = CompactGraph.fromGraph( g )
+            self.assertEqual( len( c ), len( g ) )
+            self.assertEqual( c.number_of_edges(), g.number_of_edges() )
+            self.assertEqual( tagged( c ), tagged( g ) )
+            self.assertEqual( tagged( c.toNetworkx() ), tagged( g ) )
+            for n in g.nodes:
+                self.assertEqual( c.degree( n ), g.degree( n ) )
+                self.assertEqual( nx.is_isolate( c, n ), nx.is_isolate( g, n ) )
+
+    def test_slot_reuse( self ):
+        c = CompactGraph()
+        c.add_edge( 0, 1, tag = "a" )
+        c.add_edge( 1, 2, tag = "b" )
+        c.remove_edge( 1, 0 )
+        self.assertNotIn( ( 0, 1 ), c.edges )
+        c.add_edge( 2, 3 )
+        self.assertEqual( len( c._edgeSrc ), 2 )
+        self.assertEqual( c.edges[3,2], {} )
+        self.assertEqual( c.edges[2,1]['tag'], "b" )
+        c.remove_node( 2 )
+        self.assertEqual( c.number_of_edges(), 0 )
+        self.assertEqual( sorted( c.nodes ), [ 0, 1, 3 ] )
+        with self.assertRaises( ValueError ):
+            c.nodes[0]['color'] = "red"
+
+    def rewrite( self, l, r, g, copy ):
+        l = parseGraphString( l )
+        r = parseGraphString( r, joinAllowed=True )
+        g = sg.graphIdentifiersToNumbers( parseGraphString( g ) )
+        if nx.is_directed( l ) or nx.is_directed( g ):
+            ( l, r, g ) = ( l.to_directed(), r.to_directed(), g.to_directed() )
+        c = CompactGraph.fromGraph( g )
+
+        results = []
+        for host in [ g, c ]:
+            finder = sg.MatchFinder( host, already_labeled = True )
+            finder.leftSide( l )
+            finder.rightSide( r )
+            matches = finder.matches()
+            results.append( ( host, finder, matches ) )
+        ( ( g, gf, gm ), ( c, cf, cm ) ) = results
+        self.assertEqual( sorted( gm, key = repr ), sorted( cm, key = repr ) )
+        self.assertGreater( len( gm ), 0 )
+
+        m = gm[0]
+        log = sg.UndoLog()
+        before = tagged( c )
+        expected = sg.RuleApplication( gf, m ).result()
+        actual = sg.RuleApplication( cf, m ).result( copy = copy, undo = log )
+        self.assertIsInstance( actual, CompactGraph )
+        self.assertEqual( tagged( actual ), tagged( expected ) )
+        if not copy:
+            log.rollback( c )
+            self.assertEqual( tagged( c ), before )
+
+    def test_rewrite( self ):
+        for copy in [ True, False ]:
+            self.rewrite( l = "A[left]; B[right]; A--B",
+                          r = "A; B[left]; C[right]; A--B--C",
+                          g = "X[left]; Y[right]; Z[head]; Z--X--Y",
+                          copy = copy )
+            self.rewrite( l = "A[target]; A--B; A--C; A--D",
+                          r = "B^C^D [star]; B--D",
+                          g = "X[target]; L--X--R; X--S; L--R [old]",
+                          copy = copy )
+            self.rewrite( l = "A->B [target]",
+                          r = "A[src]; B[dst]; B->A [new]",
+                          g = "X->Y [target]; Y->X [not]; Y->Z",
+                          copy = copy )
+            self.rewrite( l = "A[x]; A--B",
+                          r = "A[y]",
+                          g = "P[x]; P--Q; P--R; R--R",
+                          copy = copy )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -626,7 +626,132 @@ class TestDanglingConstraint(unittest.TestCase):
                               { 'x': 3 } ) )
         
 
+
+    def test_undirected( self ):
+        # 1 is a star with 2, 3, 4, and 4--5.
+        g = nx.Graph()
+        g.add_nodes_from( range( 0, 10 ) )
+        g.add_edges_from( [ (1,2), (1,3), (1,4), (4,5) ] )
+
+        # Delete x, with x--w, x--y, x--z
+        dec = DanglingEdgeConstraint( g, ['x'], [('x','w'), ('y','x'), ('x','z')] )
+        variables = [ 'w', 'x', 'y', 'z' ]
+        self.assertTrue( dec( variables, self.domains(), {} ) )
+        self.assertTrue( dec( variables, self.domains(), { 'x' : 1 } ) )
+        self.assertFalse( dec( variables, self.domains(), { 'x' : 4 } ) )
+        self.assertTrue( dec( variables, self.domains(),
+                              { 'x' : 1, 'w' : 4, 'y' : 2, 'z' : 3 } ) )
+        self.assertFalse( dec( variables, self.domains(),
+                               { 'x' : 1, 'w' : 4, 'y' : 5 } ) )
+
+        # Neither y nor z can be 2, so w must be.
+        domains = self.domains()
+        domains['y'] = Domain( [ 3, 4 ] )
+        domains['z'] = Domain( [ 3, 4 ] )
+        self.assertTrue( dec( variables, domains, { 'x' : 1 } ) )
+        self.assertFalse( dec( variables, domains, { 'x' : 1, 'w' : 3 } ) )
+        self.assertTrue( dec( variables, domains, { 'x' : 1, 'w' : 2 } ) )
+        # And then one of them must be 4.
+        domains['y'] = Domain( [ 3 ] )
+        domains['z'] = Domain( [ 3 ] )
+        self.assertFalse( dec( variables, domains, { 'x' : 1, 'w' : 2 } ) )
+
+        # Forward checking leaves only the uncovered neighbors.
+        domains = self.domains()
+        self.assertTrue( dec( variables, domains, { 'x' : 1, 'w' : 2 }, True ) )
+        self.assertEqual( sorted( domains['y'] ), [ 3, 4 ] )
+
+class TestLexLeaderConstraint(unittest.TestCase):
+    def test_swap( self ):
+        llc = LexLeaderConstraint( { 'x' : 'y', 'y' : 'x', 'z' : 'z' } )
+        variables = [ 'x', 'y', 'z' ]
+        domains = { v : Domain( range( 0, 5 ) ) for v in variables }
+        self.assertTrue( llc( variables, domains, { 'x' : 1, 'y' : 2 } ) )
+        self.assertFalse( llc( variables, domains, { 'x' : 2, 'y' : 1 } ) )
+        self.assertTrue( llc( variables, domains, { 'z' : 4 } ) )
+
+        # y must now be at least x
+        self.assertTrue( llc( variables, domains, { 'x' : 3 }, True ) )
+        self.assertEqual( sorted( domains['y'] ), [ 3, 4 ] )
+        domains['x'] = Domain( range( 0, 3 ) )
+        self.assertTrue( llc( variables, domains, { 'y' : 1 }, True ) )
+        self.assertEqual( sorted( domains['x'] ), [ 0, 1 ] )
+        domains['y'] = Domain( range( 0, 3 ) )
+        self.assertFalse( llc( variables, domains, { 'x' : 4 }, True ) )
+
+    def test_solutions( self ):
+        # A 3-cycle of three variables keeps one of each rotation.
+        p = Problem()
+        p.addVariables( [ 'a', 'b', 'c' ], range( 0, 4 ) )
+        p.addConstraint( AllDifferentConstraint() )
+        p.addConstraint( LexLeaderConstraint( { 'a' : 'b', 'b' : 'c', 'c' : 'a' } ) )
+        p.addConstraint( LexLeaderConstraint( { 'a' : 'c', 'b' : 'a', 'c' : 'b' } ) )
+        solutions = p.getSolutions()
+        self.assertEqual( len( solutions ), 24 // 3 )
+        for s in solutions:
+            self.assertEqual( min( s.values() ), s['a'] )
+
+class TestSharedEndpointConstraint(unittest.TestCase):
+    def test_shared( self ):
+        # Head of e is the tail of f.
+        sec = SharedEndpointConstraint( 1, 0 )
+        variables = [ 'e', 'f' ]
+        domains = { 'e' : Domain( [ (1,2), (2,3), (3,1) ] ),
+                    'f' : Domain( [ (1,2), (2,3), (3,1) ] ) }
+        self.assertTrue( sec( variables, domains, { 'e' : (1,2), 'f' : (2,3) } ) )
+        self.assertFalse( sec( variables, domains, { 'e' : (1,2), 'f' : (3,1) } ) )
+
+        self.assertTrue( sec( variables, domains, { 'e' : (2,3) }, True ) )
+        self.assertEqual( list( domains['f'] ), [ (3,1) ] )
+        self.assertTrue( sec( variables, domains, { 'f' : (1,2) }, True ) )
+        self.assertEqual( list( domains['e'] ), [ (3,1) ] )
+        domains['e'] = Domain( [ (1,2) ] )
+        self.assertFalse( sec( variables, domains, { 'f' : (1,2) }, True ) )
+
+class TestArcConsistency(unittest.TestCase):
+    def path( self, propagate ):
+        # a -> b -> c along the edges of a path 0-1-2-3-4, with a
+        # limited to 0.
+        p = Problem( MatchSolver( propagate ) )
+        p.addVariables( [ 'a', 'b', 'c' ], range( 0, 5 ) )
+        edges = TupleConstraint( [ (i,i+1) for i in range( 0, 4 ) ] )
+        p.addConstraint( TupleConstraint( [ (0,) ] ), [ 'a' ] )
+        p.addConstraint( edges, [ 'a', 'b' ] )
+        p.addConstraint( edges, [ 'b', 'c' ] )
+        return p
         
-        
+    def test_propagation( self ):
+        domains = { v : Domain( range( 0, 5 ) ) for v in [ 'a', 'b', 'c' ] }
+        domains['a'] = Domain( [ 0 ] )
+        edges = TupleConstraint( [ (i,i+1) for i in range( 0, 4 ) ] )
+        constraints = [ ( edges, [ 'a', 'b' ] ), ( edges, [ 'b', 'c' ] ) ]
+        self.assertTrue( arcConsistency( domains, constraints ) )
+        self.assertEqual( list( domains['b'] ), [ 1 ] )
+        self.assertEqual( list( domains['c'] ), [ 2 ] )
+
+        domains['a'] = Domain( [ 4 ] )
+        self.assertFalse( arcConsistency( domains, constraints ) )
+
+    def test_self_loop( self ):
+        domains = { 'a' : Domain( range( 0, 5 ) ) }
+        loops = TupleConstraint( [ (1,1), (2,3), (4,4) ] )
+        self.assertTrue( arcConsistency( domains, [ ( loops, [ 'a', 'a' ] ) ] ) )
+        self.assertEqual( list( domains['a'] ), [ 1, 4 ] )
+
+    def test_solver( self ):
+        solvers = []
+        for propagate in [ False, True ]:
+            p = self.path( propagate )
+            self.assertEqual( p.getSolutions(), [ { 'a' : 0, 'b' : 1, 'c' : 2 } ] )
+            solvers.append( p._solver )
+        ( plain, propagated ) = ( solvers[0].stats, solvers[1].stats )
+        # Preprocessing alone leaves b in 1..3 and c in 1..4.
+        self.assertEqual( plain['domains_before'], 1 + 3 + 4 )
+        self.assertEqual( plain['domains_after'], plain['domains_before'] )
+        self.assertEqual( propagated['domains_after'], 3 )
+        self.assertEqual( propagated['assignments'], 3 )
+        self.assertEqual( propagated['backtracks'], 3 )
+        self.assertLess( propagated['assignments'], plain['assignments'] )
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,99 @@
+"""Test graph generators."""
+#
+#   test/test_generate.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import random
+import networkx as nx
+import soffit.generate as gen
+import soffit.graph as sg
+from soffit.parse import parseGraphString
+
+class TestGenerators(unittest.TestCase):
+    def assertWorkingGraph( self, g, numNodes ):
+        self.assertEqual( sorted( g.nodes ), list( range( numNodes ) ) )
+        self.assertEqual( g.graph['nextId'], numNodes )
+        n = sg.allocateNewNode( g.copy() )
+        self.assertEqual( n, numNodes )
+        
+    def test_square_grid( self ):
+        g = gen.squareGrid( 3, 4, nodeTags = "x", edgeTags = "e" )
+        self.assertWorkingGraph( g, 12 )
+        self.assertEqual( len( g.edges ), 3 * 3 + 2 * 4 )
+        self.assertTrue( all( t == "x" for (_, t) in g.nodes( data='tag' ) ) )
+        self.assertTrue( all( t == "e" for (_, _, t) in g.edges( data='tag' ) ) )
+        h = nx.convert_node_labels_to_integers( nx.grid_2d_graph( 3, 4 ) )
+        self.assertTrue( nx.is_isomorphic( g, h ) )
+
+    def test_periodic_grid( self ):
+        g = gen.squareGrid( 4, 5, periodic = True )
+        self.assertEqual( len( g.edges ), 2 * 4 * 5 )
+        self.assertTrue( all( d == 4 for (_, d) in g.degree ) )
+        
+    def test_directed_grid( self ):
+        g = gen.squareGrid( 2, 2, directed = True )
+        self.assertTrue( nx.is_directed( g ) )
+        self.assertEqual( sorted( g.edges ), [ (0,1), (0,2), (1,3), (2,3) ] )
+
+    def test_triangular( self ):
+        g = gen.triangularLattice( 3, 3 )
+        self.assertEqual( len( g.edges ), 12 + 4 )
+        
+    def test_balanced_tree( self ):
+        g = gen.balancedTree( 3, 2, directed = True )
+        self.assertWorkingGraph( g, 13 )
+        self.assertTrue( nx.is_arborescence( g ) )
+        self.assertEqual( sorted( g.successors( 0 ) ), [1, 2, 3] )
+        self.assertEqual( sorted( g.successors( 1 ) ), [4, 5, 6] )
+        self.assertEqual( len( gen.balancedTree( 1, 4 ).nodes ), 5 )
+
+    def test_random_tree( self ):
+        g = gen.randomTree( 100, rng = random.Random( 1 ) )
+        self.assertWorkingGraph( g, 100 )
+        self.assertTrue( nx.is_tree( g ) )
+
+    def test_random_graph( self ):
+        g = gen.randomGraph( 50, 200, nodeTags = { "a" : 3, "b" : 1 },
+                             rng = random.Random( 2 ) )
+        self.assertWorkingGraph( g, 50 )
+        self.assertEqual( len( g.edges ), 200 )
+        self.assertEqual( nx.number_of_selfloops( g ), 0 )
+        tags = set( t for (_, t) in g.nodes( data='tag' ) )
+        self.assertEqual( tags, { "a", "b" } )
+
+        with self.assertRaises( ValueError ):
+            gen.randomGraph( 4, 7 )
+        
+    def test_tag_distribution( self ):
+        tags = gen.sampleTags( { "a" : 9, "b" : 1 }, 10000, random.Random( 3 ) )
+        self.assertGreater( tags.count( "a" ), 8500 )
+        self.assertGreater( tags.count( "b" ), 500 )
+        self.assertIsNone( gen.sampleTags( None, 5 ) )
+
+    def test_compact_rep_directed( self ):
+        g = nx.DiGraph()
+        g.add_edge( 'A', 'B', tag='x' )
+        g.add_node( 'C' )
+        rep = gen.compactRep( g )
+        h = parseGraphString( rep )
+        self.assertTrue( nx.is_directed( h ) )
+        self.assertEqual( set( h.nodes ), { 'A', 'B', 'C' } )
+        self.assertEqual( h.edges['A','B']['tag'], 'x' )
+        
+if __name__ == '__main__':
+    unittest.main()
@@ -56,6 +56,80 @@ class TestGraphModification(unittest.TestCase):
             rename[orig] = k
         g.graph['rename'] = rename
         
+    def test_compact_ids(self):
+        g = sg.graphIdentifiersToNumbers( parseGraphString( "A[x]; A--B--C--D; D[y]" ) )
+        g.remove_node( 1 )
+        ( h, mapping ) = sg.compactNodeIds( g )
+        self.assertEqual( mapping, { 2 : 1, 3 : 2 } )
+        self.assertEqual( sorted( h.nodes ), [ 0, 1, 2 ] )
+        self.assertEqual( h.graph['nextId'], 3 )
+        self.assertEqual( h.nodes[2]['tag'], 'y' )
+        self.assertIn( ( 1, 2 ), h.edges )
+        ( h2, mapping ) = sg.compactNodeIds( h )
+        self.assertIs( h2, h )
+        self.assertEqual( mapping, {} )
+
+    def test_degree_index( self ):
+        for ( g, rules ) in [
+                ( "A[x]; A--B--C--A; C--D; D[y]; D--D",
+                  [ ( "A[x]; A--B", "A[z]; A--B--N" ),
+                    ( "A--B; B--C", "A^C; B" ),
+                    ( "A[y]; A--A; A--B", "B[w]" ) ] ),
+                ( "A[x]; A->B->C->A; C->D; D[y]; D->D; E->B",
+                  [ ( "A[x]; A->B", "A[z]; A->B->N" ),
+                    ( "A->B; B->C", "A^C; B" ),
+                    ( "A[y]; A->A; B->A", "B[w]" ) ] ) ]:
+            g = sg.graphIdentifiersToNumbers( parseGraphString( g ) )
+            index = sg.degreeIndex( g )
+            self.assertIs( sg.degreeIndex( g ), index )
+            self.assertIsNot( sg.degreeIndex( g.copy() ), index )
+            log = sg.UndoLog()
+            for ( l, r ) in rules:
+                finder = sg.MatchFinder( g, already_labeled = True )
+                l = parseGraphString( l )
+                r = parseGraphString( r, joinAllowed=True )
+                if nx.is_directed( l ):
+                    r = r.to_directed()
+                finder.leftSide( l )
+                finder.rightSide( r )
+                m = finder.matches()[0]
+                sg.RuleApplication( finder, m ).result( copy = False, undo = log )
+                self.assertEqual( index.keys, sg.DegreeIndex( g ).keys )
+            log.rollback( g )
+            self.assertEqual( index.keys, sg.DegreeIndex( g ).keys )
+            self.assertEqual( { k : v for ( k, v ) in index.buckets.items() if v },
+                              sg.DegreeIndex( g ).buckets )
+
+    def test_degree_index_direct_edits( self ):
+        g = sg.graphIdentifiersToNumbers(
+            parseGraphString( "P[a]; P--Q; P--R; P--S; T[a]; T--U; T--V; T--W" ) )
+        ( p, t ) = sorted( n for n in g if g.nodes[n].get( 'tag', None ) == 'a' )
+        u = min( g.adj[t] )
+
+        def deletable():
+            finder = sg.MatchFinder( g, already_labeled = True )
+            finder.leftSide( parseGraphString( "A[a]; A--B; A--C; A--D" ) )
+            finder.rightSide( parseGraphString( "B; C; D", joinAllowed=True ) )
+            return set( m.node( 'A' ) for m in finder.matches() )
+
+        self.assertEqual( deletable(), set( [ p, t ] ) )
+        index = sg.degreeIndex( g )
+        # An edge added directly means P can no longer be deleted.
+        g.add_edge( p, u )
+        self.assertEqual( deletable(), set( [ t ] ) )
+        self.assertIsNot( sg.degreeIndex( g ), index )
+        # Once it is removed, they can again.
+        g.remove_edge( p, u )
+        self.assertEqual( deletable(), set( [ p, t ] ) )
+
+        # A rewrite after a direct edit does not bring back the stale index.
+        g.remove_edge( t, u )
+        finder = sg.MatchFinder( g, already_labeled = True )
+        finder.leftSide( parseGraphString( "A[a]; A--B; A--C; A--D" ) )
+        finder.rightSide( parseGraphString( "A[b]; A--B; A--C; A--D", joinAllowed=True ) )
+        sg.RuleApplication( finder, finder.matches()[0] ).result( copy = False )
+        self.assertEqual( sg.degreeIndex( g ).keys, sg.DegreeIndex( g ).keys )
+
     def test_deleted_nodes( self ):
         l = nx.Graph()
         l.add_node( 'A', tag='x' )
@@ -220,40 +294,65 @@ class TestGraphModification(unittest.TestCase):
         self.assertIn( ('C', 'A'), de )
         self.assertIn( ('A', 'D'), de )
                 
-class TestSurjectiveMappings(unittest.TestCase):
-    def test_simple( self ):
-        foo = list( sg.surjectiveMappings( 1, ['a'] ) )
-        self.assertIn( ('a',), foo )
-        self.assertEqual( len( foo ), 1 )
-
-    def test_empty( self ):        
-        mt = list( sg.surjectiveMappings( 1, ['a', 'b'] ) )
-        self.assertEqual( len( mt ), 0 )
-
-        mt2 = list( sg.surjectiveMappings( 3, ['a', 'b', 'c', 'd'] ) )
-        self.assertEqual( len( mt2 ), 0 )
-
-    def test_permutation( self ):
-        foo = list( sg.surjectiveMappings( 3, ['a', 'b', 'c'] ) )
-        self.assertIn( ('a', 'b', 'c'), foo )
-        self.assertIn( ('a', 'c', 'b'), foo )
-        self.assertIn( ('b', 'a', 'c'), foo )
-        self.assertIn( ('b', 'c', 'a'), foo )
-        self.assertIn( ('c', 'a', 'b'), foo )
-        self.assertIn( ('c', 'b', 'a'), foo )
-        self.assertEqual( len( foo ), 6 )
-
-    def test_permutation_plus_one( self ):
-        foo = list( sg.surjectiveMappings( 3, ['a', 'b'] ) )
-        self.assertIn( ('a', 'b', 'a'), foo )
-        self.assertIn( ('a', 'b', 'b'), foo )
-        self.assertIn( ('a', 'a', 'b'), foo )
-        self.assertIn( ('b', 'a', 'a'), foo )
-        self.assertIn( ('b', 'a', 'b'), foo )
-        self.assertIn( ('b', 'b', 'a'), foo )
-        self.assertEqual( len( foo ), 6 )
-        
 class TestMatchFinding(unittest.TestCase):
+    def test_tiny_shape( self ):
+        for ( text, shape ) in [ ( "A[x]", "node" ),
+                                 ( "A; B", None ),
+                                 ( "A--A", None ),
+                                 ( "A--B [e]", "edge" ),
+                                 ( "A->B; B->A", "edge" ),
+                                 ( "A--B; C", None ),
+                                 ( "A->B->C", "path" ),
+                                 ( "A--B--C--A", "triangle" ),
+                                 ( "A--B--C--D", None ) ]:
+            self.assertEqual( sg.tinyShape( parseGraphString( text ) ), shape )
+
+    def test_match_order( self ):
+        l = parseGraphString( "A->B->C->D; B->E; E->F; F[x]" )
+        # Fewest candidates first, then its neighbors, preferring the
+        # higher degree.
+        candidates = { 'A' : 10, 'B' : 10, 'C' : 10, 'D' : 10,
+                       'E' : 10, 'F' : 2 }
+        self.assertEqual( sg.matchOrder( l, candidates ),
+                          [ 'F', 'E', 'B', 'C', 'A', 'D' ] )
+        # A disconnected node waits until nothing else is adjacent.
+        l = parseGraphString( "A->B->C->D; B->E; E->F; F[x]; G" )
+        candidates['G'] = 1
+        candidates['C'] = 2
+        self.assertEqual( sg.matchOrder( l, candidates ),
+                          [ 'G', 'C', 'B', 'E', 'F', 'A', 'D' ] )
+
+        g = parseGraphString( "P->Q->R; Q->S->T; T[x]" )
+        finder = sg.MatchFinder( g )
+        self.assertEqual( finder.candidateCounts( l ),
+                          { 'A' : 4, 'B' : 4, 'C' : 4, 'D' : 4,
+                            'E' : 4, 'F' : 1, 'G' : 4 } )
+
+    def test_formulation( self ):
+        # Few of the edges go from an x to a y.
+        g = nx.DiGraph()
+        for i in range( 0, 120 ):
+            g.add_node( i, tag = [ "x", "y" ][i % 2] )
+            g.add_edge( i, ( i + 2 ) % 120 )
+        for i in range( 0, 120, 10 ):
+            g.add_edge( i, i + 1 )
+            g.add_edge( i + 2, i + 1 )
+        l = parseGraphString( "A[x]; B[y]; C[x]; A->B; C->B" )
+
+        finders = []
+        for formulation in [ "nodes", "edges", None ]:
+            finder = sg.MatchFinder( g, already_labeled = True )
+            finder.formulation = formulation
+            finder.leftSide( l )
+            finders.append( finder )
+        self.assertEqual( sg.chooseFormulation( l, g, *finders[0].edgeRequirements( l ),
+                                                 finders[0].tagCounts( l ) ),
+                          "edges" )
+        mList = finders[0].matches()
+        self.assertEqual( len( mList ), 24 )
+        for finder in finders[1:]:
+            self.assertEqual( set( finder.matches() ), set( mList ) )
+        
     def twoEdgesX(self):
         g = nx.Graph()
         g.add_edge( 'A', 'B', tag='x' )
@@ -366,6 +465,18 @@ class TestMatchFinding(unittest.TestCase):
         foundEdges = set( m.edge( ( 'X', 'Y' ) ) for m in mList )
         self.assertEqual( edges, foundEdges )
 
+    def test_lhs_match_mirrored_edge( self ):
+        # A--B in a directed graph is a pair of arcs; C->D is not.
+        g = parseGraphString( "A--B; A->C; C->A [x]; C->D; D->E; E->D [x]" )
+        lhs = parseGraphString( "X--Y; Y->Z" )
+
+        finder = sg.MatchFinder( g, verbose=testVerbose )
+        finder.leftSide( lhs )
+        self.assertFalse( finder.impossible )
+        mList = finder.matches()
+        found = set( ( m.node( 'X' ), m.node( 'Y' ), m.node( 'Z' ) ) for m in mList )
+        self.assertEqual( found, set( [ ( 'B', 'A', 'C' ) ] ) )
+
     def test_complicated_directed_single_path( self ):
         g = nx.DiGraph()
         g.add_edge( 'A', 'B', tag='1' )
@@ -474,7 +585,7 @@ class TestMatchFinding(unittest.TestCase):
             print( me.exception )
 
     def rightConditionTest( self, matchLen,
-                            l, r, g ):
+                            l, r, g, breakSymmetry = False ):
         l = parseGraphString( l )
         r = parseGraphString( r, joinAllowed=True )
         g = parseGraphString( g )
@@ -488,6 +599,7 @@ class TestMatchFinding(unittest.TestCase):
                 g = g.to_directed()
             
         finder = sg.MatchFinder( g, verbose=testVerbose )
+        finder.breakSymmetry = breakSymmetry
         finder.leftSide( l )
         finder.rightSide( r )
         mList = finder.matches()
@@ -497,6 +609,49 @@ class TestMatchFinding(unittest.TestCase):
                 print( m )
 
         self.assertEqual( len( mList ), matchLen )
+
+        # The same matches, filtered from the left side's.
+        leftFinder = sg.MatchFinder( g )
+        leftFinder.leftSide( l )
+        self.assertTrue( leftFinder.solveLeftSide() )
+        finder = sg.MatchFinder( g )
+        finder.breakSymmetry = breakSymmetry
+        finder.shareLeftSide( leftFinder )
+        finder.rightSide( r )
+        self.assertEqual( set( finder.matches() ), set( mList ) )
+        self.assertEqual( finder.matchExists(), matchLen > 0 )
+
+        # And the same matches from the solver alone, with or without
+        # the degree index.
+        for useDegreeIndex in [ True, False ]:
+            finder = sg.MatchFinder( g )
+            finder.breakSymmetry = breakSymmetry
+            finder.fastPaths = False
+            finder.useDegreeIndex = useDegreeIndex
+            finder.leftSide( l )
+            finder.rightSide( r )
+            self.assertEqual( set( finder.matches() ), set( mList ) )
+
+        # Without arc consistency before the search, or in the solver's
+        # own order.
+        for planOrder in [ True, False ]:
+            finder = sg.MatchFinder( g )
+            finder.breakSymmetry = breakSymmetry
+            finder.fastPaths = False
+            finder.solver.propagate = False
+            finder.planOrder = planOrder
+            finder.leftSide( l )
+            finder.rightSide( r )
+            self.assertEqual( set( finder.matches() ), set( mList ) )
+
+        # With edges as the variables.
+        finder = sg.MatchFinder( g )
+        finder.breakSymmetry = breakSymmetry
+        finder.fastPaths = False
+        finder.formulation = "edges"
+        finder.leftSide( l )
+        finder.rightSide( r )
+        self.assertEqual( set( finder.matches() ), set( mList ) )
         return mList
         
     def test_dangling_not_allowed( self ):
@@ -601,7 +756,53 @@ class TestMatchFinding(unittest.TestCase):
                                          r = "B^C^D",
                                          g = "y[target]; w[target]; w--x--y--z" )
 
-        
+
+    def test_break_symmetry( self ):
+        # B, C, and D are interchangeable, so all 6 matches are the same.
+        self.rightConditionTest( 1,
+                                 l = "A[target]; A--B; A--C; A--D",
+                                 r = "B^C^D",
+                                 g = "y[target]; x--y--z; w--y",
+                                 breakSymmetry = True )
+        mList = self.rightConditionTest( 1,
+                                         l = "A--B; A--C",
+                                         r = "B; C",
+                                         g = "w--x; w--y; w--z; z--s",
+                                         breakSymmetry = True )
+        self.assertEqual( mList[0].node( 'A' ), 'z' )
+
+        # The right side tells A and C apart.
+        self.rightConditionTest( 2,
+                                 l = "A--B--C",
+                                 r = "A; B--C",
+                                 g = "x--y--z",
+                                 breakSymmetry = True )
+        self.rightConditionTest( 1,
+                                 l = "A--B--C",
+                                 r = "A--B--C [new]",
+                                 g = "x--y--z",
+                                 breakSymmetry = True )
+        self.rightConditionTest( 2,
+                                 l = "A--B--C",
+                                 r = "A--B--C [new]; A[end]",
+                                 g = "x--y--z",
+                                 breakSymmetry = True )
+        self.rightConditionTest( 2,
+                                 l = "A->B; B->A",
+                                 r = "A->B; B->A; A[first]",
+                                 g = "x->y; y->x",
+                                 breakSymmetry = True )
+        self.rightConditionTest( 2,
+                                 l = "A->B; B->A",
+                                 r = "A->B; B->A [new]",
+                                 g = "x->y; y->x",
+                                 breakSymmetry = True )
+        self.rightConditionTest( 1,
+                                 l = "A->B; B->A",
+                                 r = "A->B [new]; B->A [new]",
+                                 g = "x->y; y->x",
+                                 breakSymmetry = True )
+
     def test_right_dangling_directed( self ):
         # Rule doesn't delete edge outgoing from B
         mList = self.rightConditionTest( 0,
@@ -0,0 +1,175 @@
+"""Test bulk loading of start graphs."""
+#
+#   test/test_graphfile.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import io
+import contextlib
+import networkx as nx
+import soffit.graphfile as gf
+from soffit.parse import parseGraphString, MismatchedTagError
+
+class TestEdgeList(unittest.TestCase):
+    def assertSameAsParsed( self, g, graphString ):
+        expected = parseGraphString( graphString )
+        self.assertEqual( nx.is_directed( g ), nx.is_directed( expected ) )
+        nm = nx.algorithms.isomorphism.categorical_node_match( 'tag', None )
+        em = nx.algorithms.isomorphism.categorical_edge_match( 'tag', None )
+        self.assertTrue( nx.is_isomorphic( g, expected,
+                                           node_match = nm,
+                                           edge_match = em ) )
+
+    def test_undirected( self ):
+        text = """# a comment
+A[x]
+A--B
+B -- C [y];
+
+C[z]
+D
+"""
+        g = gf.readEdgeList( io.StringIO( text ) )
+        self.assertEqual( sorted( g.nodes ), [0, 1, 2, 3] )
+        self.assertEqual( g.graph['nextId'], 4 )
+        self.assertSameAsParsed( g, "A[x]; A--B; B--C[y]; C[z]; D" )
+
+    def test_directed( self ):
+        text = "A->B[x]\nB<-C\nC--D[y]\n"
+        g = gf.readEdgeList( io.StringIO( text ) )
+        self.assertTrue( nx.is_directed( g ) )
+        self.assertSameAsParsed( g, "A->B[x]; B<-C; C--D[y]" )
+
+    def test_escaped_tag( self ):
+        g = gf.readEdgeList( io.StringIO( "A[color=red\\]]\n" ) )
+        self.assertEqual( g.nodes[0]['tag'], "color=red]" )
+
+    def test_mismatched_tag( self ):
+        with self.assertRaises( MismatchedTagError ) as cm:
+            gf.readEdgeList( io.StringIO( "A[x]\nA--B\nA[y]\n" ) )
+        self.assertEqual( cm.exception.lineNumber, 3 )
+
+        with self.assertRaises( MismatchedTagError ) as cm:
+            gf.readEdgeList( io.StringIO( "A--B[x]\nB--A[y]\n" ) )
+        out = io.StringIO()
+        with contextlib.redirect_stdout( out ):
+            cm.exception.prettyPrint()
+        self.assertIn( "on line number 2", out.getvalue() )
+
+    def test_bad_line( self ):
+        with self.assertRaises( gf.GraphFileError ) as cm:
+            gf.readEdgeList( io.StringIO( "A--B\nA--B--C\n" ) )
+        self.assertEqual( cm.exception.lineNumber, 2 )
+
+class TestNodeLink(unittest.TestCase):
+    def test_round_trip( self ):
+        h = nx.DiGraph()
+        h.add_node( "p", tag="x" )
+        h.add_edge( "p", "q", tag="e" )
+        h.add_edge( "q", "r" )
+        text = io.StringIO( '{ "directed" : true, '
+                            '"nodes" : [ { "id" : "p", "tag" : "x" }, '
+                            '            { "id" : "q" }, { "id" : "r" } ], '
+                            '"links" : [ { "source" : "p", "target" : "q", "tag" : "e" }, '
+                            '            { "source" : "q", "target" : "r" } ] }' )
+        g = gf.readNodeLink( text )
+        self.assertTrue( nx.is_directed( g ) )
+        self.assertEqual( g.graph['nextId'], 3 )
+        self.assertEqual( g.nodes[0]['tag'], "x" )
+        self.assertNotIn( 'tag', g.nodes[1] )
+        self.assertEqual( g.edges[0,1]['tag'], "e" )
+        self.assertIn( (1,2), g.edges )
+        self.assertNotIn( (1,0), g.edges )
+
+    def test_undirected_edges_key( self ):
+        text = io.StringIO( '{ "nodes" : [ { "id" : 7 } ], '
+                            '"edges" : [ { "source" : 7, "target" : 8 } ] }' )
+        g = gf.readNodeLink( text )
+        self.assertFalse( nx.is_directed( g ) )
+        self.assertEqual( list( g.edges ), [ (0,1) ] )
+
+    def test_streamed( self ):
+        g = nx.Graph()
+        g.add_nodes_from( ( n, { 'tag' : "x" * ( n % 5 ) } ) for n in range( 300 ) )
+        g.add_edges_from( ( n, ( n * 7 ) % 300, { 'tag' : n * 1000 } ) for n in range( 300 ) )
+        f = io.StringIO()
+        gf.writeNodeLink( g, f )
+        for chunkSize in [ 1, 7, 1 << 16 ]:
+            f.seek( 0 )
+            h = gf.readNodeLink( f, chunkSize )
+            self.assertEqual( list( h.nodes( data='tag' ) ), list( g.nodes( data='tag' ) ) )
+            self.assertEqual( sorted( h.edges( data='tag' ) ),
+                              sorted( ( min( a, b ), max( a, b ), t )
+                                      for ( a, b, t ) in g.edges( data='tag' ) ) )
+
+    def test_directed_last( self ):
+        text = io.StringIO( '{ "links" : [ { "source" : 1, "target" : 2 } ], '
+                            '"nodes" : [ { "id" : 1 } ], "directed" : true }' )
+        g = gf.readNodeLink( text, 5 )
+        self.assertTrue( nx.is_directed( g ) )
+        self.assertEqual( list( g.edges ), [ (0,1) ] )
+
+    def test_errors( self ):
+        text = '{ "directed" : false,\n  "nodes" : [\n    { "id" : "A", "tag" : "x" },\n' \
+               '    { "id" : "A", "tag" : "y" } ] }'
+        with self.assertRaises( MismatchedTagError ) as cm:
+            gf.readNodeLink( io.StringIO( text ), 3 )
+        self.assertEqual( cm.exception.lineNumber, 4 )
+
+        with self.assertRaises( gf.GraphFileError ) as cm:
+            gf.readNodeLink( io.StringIO( '{ "nodes" : [\n {},\n { "id" : 1 } ] }' ) )
+        self.assertEqual( cm.exception.lineNumber, 2 )
+        with self.assertRaises( gf.GraphFileError ):
+            gf.readNodeLink( io.StringIO( '{ "nodes" : [ { "id" : 1 }' ) )
+
+class TestWriters(unittest.TestCase):
+    def round_trip( self, g, format ):
+        f = io.StringIO()
+        gf.writers[format]( g, f )
+        f.seek( 0 )
+        return gf.formats[format]( f )
+
+    def assertSameGraph( self, g, h ):
+        self.assertEqual( nx.is_directed( g ), nx.is_directed( h ) )
+        self.assertEqual( list( g.nodes( data='tag' ) ),
+                          list( h.nodes( data='tag' ) ) )
+        self.assertEqual( sorted( g.edges( data='tag' ) ),
+                          sorted( h.edges( data='tag' ) ) )
+        
+    def test_round_trip( self ):
+        g = nx.Graph()
+        g.add_node( 0, tag="x" )
+        g.add_node( 1 )
+        g.add_node( 2, tag="a]b\\c" )
+        g.add_edge( 0, 1, tag="e" )
+        g.add_edge( 1, 2 )
+        g.add_node( 3 )
+        for format in [ "edgelist", "nodelink" ]:
+            self.assertSameGraph( g, self.round_trip( g, format ) )
+
+        d = g.to_directed()
+        d.remove_edge( 1, 0 )
+        for format in [ "edgelist", "nodelink" ]:
+            self.assertSameGraph( d, self.round_trip( d, format ) )
+
+    def test_empty( self ):
+        g = nx.Graph()
+        for format in [ "edgelist", "nodelink" ]:
+            self.assertEqual( len( self.round_trip( g, format ).nodes ), 0 )
+        
+if __name__ == '__main__':
+    unittest.main()
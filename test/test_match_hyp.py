@@ -19,6 +19,7 @@
 
 import unittest
 import soffit.graph as sg
+from soffit.parse import parseGraphString
 import networkx as nx
 from hypothesis import given, assume, note, reproduce_failure, settings
 import hypothesis.strategies as st
@@ -256,5 +257,42 @@ class TestMatchAndReplace(unittest.TestCase):
         m = finder.matches()
         self.assertEqual( len( m ), 0 )
 
+    @given( st.sampled_from( [ ( "A[x]", "A[y]" ), ( "A", "" ),
+                               ( "A--B", "A--B [y]" ),
+                               ( "A[x]; A--B [y]", "B" ),
+                               ( "A->B [x]", "B" ),
+                               ( "A--B; B->A [x]", "A" ),
+                               ( "A--B--C", "A; C" ),
+                               ( "A->B->C; C[x]", "A->C" ),
+                               ( "A->B; C->B", "A; C" ),
+                               ( "A--B--C--A [y]", "A--C" ),
+                               ( "A->B->C->A", "A->B->C->A [y]" ) ] ),
+            edgeStrategy0_to_10, edgeStrategy0_to_10,
+            st.lists( nodeIds ), st.booleans() )
+    @settings( deadline=1000 )
+    def test_tiny_shapes( self, rule, xEdges, yEdges, xNodes, directed ):
+        l = parseGraphString( rule[0] )
+        r = parseGraphString( rule[1], joinAllowed=True )
+        g = nx.DiGraph() if directed or nx.is_directed( l ) else nx.Graph()
+        g.add_nodes_from( xNodes, tag = "x" )
+        g.add_edges_from( xEdges, tag = "x" )
+        g.add_edges_from( yEdges )
+        g.add_edges_from( yEdges[:len( yEdges ) // 2], tag = "y" )
+        assume( len( g ) > 0 )
+        if nx.is_directed( g ):
+            l = l.to_directed()
+            r = r.to_directed()
+        g = sg.graphIdentifiersToNumbers( g )
+        self.assertIsNotNone( sg.tinyShape( l ) )
+
+        found = []
+        for fast in [ True, False ]:
+            finder = sg.MatchFinder( g, already_labeled = True )
+            finder.fastPaths = fast
+            finder.leftSide( l )
+            finder.rightSide( r )
+            found.append( set( finder.matches() ) )
+        self.assertEqual( found[0], found[1] )
+
 if __name__ == "__main__":
     unittest.main()
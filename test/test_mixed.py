@@ -0,0 +1,188 @@
+"""Test directed graphs that store undirected edges once."""
+#
+#   test/test_mixed.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import copy
+import pickle
+import random
+import networkx as nx
+import soffit.graph as sg
+from soffit.application import ApplicationState
+from soffit.mixed import MixedGraph
+from soffit.parse import parseGraphString, parseGraphGrammar
+from test.test_compact import tagged
+
+def numbered( text ):
+    return sg.graphIdentifiersToNumbers( parseGraphString( text ) )
+
+class TestMixedGraph(unittest.TestCase):
+    def assertNormalized( self, g ):
+        # No pair of opposite arcs with equal attributes is left unmerged.
+        for ( a, b, d ) in g.directedEdges( data=True ):
+            if a != b:
+                self.assertNotEqual( g._arcSucc[b].get( a, None ), d )
+
+    def test_same_graph( self ):
+        for ( text, undirected ) in [
+                ( "A[x]; B; A--B [e]; B--C--A; C--C [loop]", 3 ),
+                ( "A[x]; A->B [e]; B->A [e]; B->C; C->B [f]; C->C", 1 ) ]:
+            g = numbered( text )
+            d = g.to_directed()
+            m = MixedGraph.fromGraph( g )
+            self.assertEqual( tagged( m ), tagged( d ) )
+            self.assertEqual( m.number_of_edges(), d.number_of_edges() )
+            self.assertEqual( m.number_of_undirected_edges(), undirected )
+            for n in d:
+                self.assertEqual( set( m.pred[n] ), set( d.pred[n] ) )
+                self.assertEqual( set( m.succ[n] ), set( d.succ[n] ) )
+                self.assertEqual( m.degree( n ), d.degree( n ) )
+                self.assertEqual( sg.DegreeIndex.key( m, n ), sg.DegreeIndex.key( d, n ) )
+            self.assertEqual( sorted( m.to_directed().edges( data=True ), key = repr ),
+                              sorted( d.edges( data=True ), key = repr ) )
+            self.assertIs( type( m.to_directed() ), nx.DiGraph )
+            self.assertNormalized( m )
+
+    def test_split_and_merge( self ):
+        m = MixedGraph.fromGraph( numbered( "A--B [e]; B--C [e]" ) )
+        self.assertEqual( m.number_of_undirected_edges(), 2 )
+        shared = m.edges[0,1]
+        self.assertIs( m.edges[1,0], shared )
+
+        m.remove_edge( 0, 1 )
+        self.assertFalse( m.has_edge( 0, 1 ) )
+        self.assertEqual( m.edges[1,0], { 'tag' : "e" } )
+        self.assertEqual( m.number_of_undirected_edges(), 1 )
+        m.add_edge( 0, 1, tag = "e" )
+        self.assertEqual( m.number_of_undirected_edges(), 2 )
+
+        # One arc's attributes can be changed without the other's.
+        m.setEdgeData( 1, 2, { 'tag' : "f" } )
+        self.assertEqual( m.edges[1,2], { 'tag' : "f" } )
+        self.assertEqual( m.edges[2,1], { 'tag' : "e" } )
+        m.add_edge( 2, 1, tag = "f" )
+        self.assertEqual( m.number_of_undirected_edges(), 2 )
+        self.assertEqual( m.number_of_edges(), 4 )
+
+        m.add_edge( 2, 2, tag = "e" )
+        self.assertEqual( list( m.directedEdges() ), [ ( 2, 2 ) ] )
+        m.remove_node( 1 )
+        self.assertEqual( m.number_of_edges(), 1 )
+        self.assertEqual( sorted( m.nodes ), [ 0, 2 ] )
+        self.assertNormalized( m )
+
+    def test_copies( self ):
+        m = MixedGraph.fromGraph( numbered( "A--B [e]; B->C [f]" ) )
+        for c in [ m.copy(), copy.deepcopy( m ), pickle.loads( pickle.dumps( m ) ) ]:
+            self.assertIsInstance( c, MixedGraph )
+            self.assertEqual( tagged( c ), tagged( m ) )
+            self.assertIs( c.edges[0,1], c.edges[1,0] )
+            self.assertIsNot( c.edges[0,1], m.edges[0,1] )
+        d = m.to_directed()
+        self.assertIsNot( d.edges[0,1], d.edges[1,0] )
+
+    def rewrite( self, l, r, g ):
+        l = parseGraphString( l ).to_directed()
+        r = parseGraphString( r, joinAllowed=True ).to_directed()
+        g = numbered( g )
+        d = g.to_directed()
+        m = MixedGraph.fromGraph( g )
+
+        results = []
+        for host in [ d, m ]:
+            finder = sg.MatchFinder( host, already_labeled = True )
+            finder.leftSide( l )
+            finder.rightSide( r )
+            results.append( ( finder, finder.matches() ) )
+        ( ( df, dm ), ( mf, mm ) ) = results
+        self.assertEqual( sorted( dm, key = repr ), sorted( mm, key = repr ) )
+        self.assertGreater( len( dm ), 0 )
+
+        before = tagged( m )
+        undirected = m.number_of_undirected_edges()
+        log = sg.UndoLog()
+        for match in dm:
+            expected = sg.RuleApplication( df, match ).result()
+            actual = sg.RuleApplication( mf, match ).result( copy = False, undo = log )
+            self.assertIs( actual, m )
+            self.assertEqual( tagged( actual ), tagged( expected ) )
+            self.assertNormalized( actual )
+            log.rollback( m )
+            self.assertEqual( tagged( m ), before )
+            self.assertEqual( m.number_of_undirected_edges(), undirected )
+
+    def test_rewrite( self ):
+        # Delete one arc of an undirected edge.
+        self.rewrite( l = "A[x]; A--B",
+                      r = "A[y]; A->B",
+                      g = "P[x]; P--Q; Q--R; R[x]" )
+        # Match one arc, and replace it by its reverse.
+        self.rewrite( l = "A->B [e]",
+                      r = "A; B; B->A [e]",
+                      g = "P--Q [e]; Q->R [e]" )
+        # Retag both arcs, which merge again.
+        self.rewrite( l = "A[x]; B[x]; A--B",
+                      r = "A[x]; B[x]; A--B [done]",
+                      g = "P[x]; Q[x]; R[x]; P--Q--R; R->P" )
+        # Merge nodes with undirected edges in common.
+        self.rewrite( l = "A[x]; B[y]",
+                      r = "A^B[z]",
+                      g = "P[x]; Q[y]; P--R--Q; P--Q [e]; Q->S" )
+        # Delete a node along with its edges.
+        self.rewrite( l = "A[x]; A--B; A->C",
+                      r = "B; C",
+                      g = "P[x]; P--Q; P->R; Q--R" )
+
+    def test_mirrored_match( self ):
+        # A pair of arcs matches an undirected edge in either direction,
+        # but not a single arc.
+        m = MixedGraph.fromGraph( numbered( "A[x]; B[y]; C[y]; A--B [e]; A->C [e]" ) )
+        finder = sg.MatchFinder( m, already_labeled = True )
+        finder.leftSide( parseGraphString( "X[y]; Y[x]; X--Y [e]" ).to_directed() )
+        found = set( ( k.node( 'X' ), k.node( 'Y' ) ) for k in finder.matches() )
+        self.assertEqual( found, set( [ ( 1, 0 ) ] ) )
+
+    def test_application( self ):
+        grammar = parseGraphGrammar( """{
+  "A[x]" : "A[y]; B[x]; A--B",
+  "A[y]" : "A[y]; B[leaf]; A->B"
+}""" )
+        self.assertTrue( grammar.directed )
+        random.seed( 1 )
+        app = ApplicationState( initialGraph = parseGraphString( "A[x]" ),
+                                grammar = grammar )
+        app.verbose = False
+        app.run( 30 )
+        self.assertIsInstance( app.graph, MixedGraph )
+        self.assertGreater( app.graph.number_of_undirected_edges(), 0 )
+        self.assertNormalized( app.graph )
+
+    def test_already_numbered( self ):
+        g = numbered( "A[x]; A->B; B->A; B->C" )
+        app = ApplicationState( initialGraph = g, already_numbered = True )
+        self.assertIsInstance( app.graph, MixedGraph )
+        self.assertEqual( app.graph.number_of_undirected_edges(), 1 )
+        self.assertEqual( tagged( app.graph ), tagged( g ) )
+        self.assertEqual( app.graph.graph['nextId'], g.graph['nextId'] )
+
+        m = MixedGraph.fromGraph( g )
+        app = ApplicationState( initialGraph = m, already_numbered = True )
+        self.assertIs( app.graph, m )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,182 @@
+"""Test matching in worker processes."""
+#
+#   test/test_parallel.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import multiprocessing
+import random
+import time
+import soffit.generate as gen
+import soffit.graph as sg
+import soffit.parallel as sp
+from soffit.application import ApplicationState, loadGrammar
+from soffit.parallel import splitVariable, MatchPool
+from soffit.parse import parseGraphString, parseGraphGrammar
+
+class TestParallelMatching(unittest.TestCase):
+    def setUp( self ):
+        self.g = gen.squareGrid( 8, 8, nodeTags = "x" )
+        self.g.nodes[9]['tag'] = "y"
+        self.g.nodes[27]['tag'] = "y"
+        self.g.graph['node_tag_cache'] = {}
+        self.g.graph['edge_tag_cache'] = {}
+
+    def finder( self, jobs, left, right = None ):
+        finder = sg.MatchFinder( self.g, already_labeled = True )
+        finder.jobs = jobs
+        finder.breakSymmetry = True
+        # Small left sides are matched without the solver, serially.
+        finder.fastPaths = False
+        finder.leftSide( parseGraphString( left ) )
+        if right is not None:
+            finder.rightSide( parseGraphString( right, joinAllowed = True ) )
+        return finder
+
+    def test_same_matches( self ):
+        for ( l, r ) in [ ( "A[x]; B[x]; C[x]; D[x]; A--B--D--C--A", "A[x]; B[x]; C[x]; D[x]" ),
+                          ( "A[x]; B[x]; C[x]; A--B--C", "A[x]; B[x]; C[x]; A--C" ),
+                          ( "A[x]; B[y]; C[x]; A--B--C", "A[x]; C[x]" ),
+                          ( "A[y]; B[y]", "A^B[y]" ) ]:
+            serial = self.finder( 1, l, r ).matches()
+            parallel = self.finder( 2, l, r ).matches()
+            self.assertEqual( len( parallel ), len( serial ) )
+            self.assertEqual( set( parallel ), set( serial ) )
+
+    def test_split( self ):
+        finder = self.finder( 2, "A[x]; B[y]; C[x]; A--B--C" )
+        self.assertEqual( splitVariable( finder ), ( 'B', [ 9, 27 ] ) )
+        # B has degree 4 at 9 and 27, so the degree index leaves both.
+        finder = self.finder( 2, "A[x]; B[y]; C[x]; A--B--C", "A[x]; C[x]" )
+        self.assertEqual( finder.matches(), [] )
+
+    def test_limits( self ):
+        l = "A[x]; B[x]; A--B"
+        finder = self.finder( 3, l, "A[x]; B[x]; A--B [e]" )
+        finder.maxMatches = 10
+        self.assertEqual( len( finder.matches() ), 10 )
+        self.assertEqual( finder.endReason, "Maximum matches reached." )
+        self.assertGreater( finder.solver.stats['assignments'], 0 )
+
+        finder = self.finder( 3, l )
+        finder.maxMatches = 10
+        self.assertFalse( finder.solveLeftSide() )
+        finder = self.finder( 3, l )
+        self.assertTrue( finder.solveLeftSide() )
+        self.assertEqual( len( finder.leftSolutions ),
+                          len( self.finder( 1, l ).matches() ) )
+
+    def test_pool( self ):
+        l = "A[x]; B[x]; A--B"
+        serial = self.finder( 1, l ).matches()
+        pool = MatchPool( 2 )
+        try:
+            finder = self.finder( 2, l )
+            finder.pool = pool
+            self.assertEqual( set( finder.matches() ), set( serial ) )
+            executor = pool.executor
+            finder = self.finder( 2, l )
+            finder.pool = pool
+            finder.maxMatches = 5
+            self.assertEqual( len( finder.matches() ), 5 )
+            self.assertIs( pool.executor, executor )
+
+            # Forked workers must not match in the graph as it was.
+            self.g.remove_edge( 0, 1 )
+            self.g.graph['node_tag_cache'] = {}
+            self.g.graph['edge_tag_cache'] = {}
+            finder = self.finder( 2, l )
+            finder.pool = pool
+            matches = finder.matches()
+            self.assertEqual( set( matches ), set( self.finder( 1, l ).matches() ) )
+            self.assertLess( len( matches ), len( serial ) )
+        finally:
+            pool.close()
+        self.assertIsNone( pool.executor )
+
+    def test_stopped_chunk( self ):
+        # A chunk of an earlier search gives up at once.
+        generation = multiprocessing.Value( 'q', 1 )
+        left = parseGraphString( "A[x]; B[x]; A--B" )
+        task = ( None, 0, left, None, { 'maxMatches' : 100 }, True, 'A', [ 0, 1 ],
+                 100, time.time() + 60 )
+        try:
+            sp.initWorker( self.g, generation )
+            self.assertEqual( sp._solveChunk( task ), ( [], "Stopped.", {} ) )
+            generation.value = 0
+            ( solns, reason, stats ) = sp._solveChunk( task )
+            self.assertEqual( len( solns ), 4 )
+            self.assertEqual( reason, "No more matches." )
+        finally:
+            sp.initWorker( None )
+
+    def test_application_pool( self ):
+        app = ApplicationState( initialGraph = self.g, already_numbered = True )
+        self.assertIsNone( app._matchPool() )
+        app.match_jobs = 2
+        pool = app._matchPool()
+        self.assertIs( app._matchPool(), pool )
+        app.match_jobs = 3
+        self.assertIsNot( app._matchPool(), pool )
+        app.close()
+        self.assertIsNone( app.match_pool )
+
+# Most rules fail most of the time; some have several right sides.
+speculativeGrammar = """{
+    "version" : "0.1",
+    "start" : "A[x]; B[x]; C[y]; A--B--C",
+    "A[x]; B[y]; A--B" : [ "A[x]; B[y]; C[x]; A--B--C", "A[y]; B[y]; A--B" ],
+    "A[y]; B[y]; A--B" : "A[x]; B[y]; A--B",
+    "A[z]; B[z]; C[z]; A--B--C--A" : "A[z]",
+    "A[x]; B[x]; C[x]; A--B--C" : [ "A[x]; B[z]; C[x]; A--B--C", "A[x]; C[x]; A--C" ],
+    "A[w]" : "A[x]",
+    "A[v]; B[v]" : "A^B[v]"
+}"""
+
+class TestSpeculativeRules(unittest.TestCase):
+    def history( self, speculate, fast, grammar = None, iterations = 25, seed = 5 ):
+        random.seed( seed )
+        if grammar is None:
+            grammar = parseGraphGrammar( speculativeGrammar )
+        history = []
+        app = ApplicationState( initialGraph = grammar.start,
+                                grammar = grammar,
+                                callback = lambda i, g : history.append(
+                                    ( sorted( g.nodes( data='tag' ) ),
+                                      sorted( ( min( a, b ), max( a, b ), t )
+                                              for ( a, b, t ) in g.edges( data='tag' ) ) ) ) )
+        app.verbose = False
+        app.fast_mode = fast
+        app.speculate = speculate
+        app.run( maxIterations = iterations )
+        return history
+
+    def test_same_choices( self ):
+        for fast in [ False, True ]:
+            serial = self.history( 1, fast )
+            self.assertGreater( len( serial ), 10 )
+            self.assertEqual( self.history( 3, fast ), serial )
+
+    def test_many_iterations( self ):
+        # Stopping the workers early, every iteration, once hung the pool.
+        grammar = loadGrammar( "doc/examples/tree.json", verbose = False )
+        serial = self.history( 1, True, grammar, 400, seed = 2 )
+        self.assertGreaterEqual( len( serial ), 400 )
+        self.assertEqual( self.history( 3, True, grammar, 400, seed = 2 ), serial )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -18,9 +18,11 @@
 #
 
 import unittest
+import json
 from unittest import skip
 from soffit.parse import parseGraphString, nodeName, parseGraphGrammar
 from soffit.parse import ParseError
+import soffit.parse as sp
 import networkx as nx
 
 class TestGraphParsing(unittest.TestCase):
@@ -383,6 +385,113 @@ v01a = """{
 }
 """
 
+class TestParseCache(unittest.TestCase):
+    def setUp( self ):
+        sp.clearParseCache()
+        self.oldSize = sp.parseCache.maxSize
+
+    def tearDown( self ):
+        sp.parseCache.maxSize = self.oldSize
+        
+    def test_cache_hit( self ):
+        g1 = parseGraphString( "A--B[x]; B[y]" )
+        g2 = parseGraphString( "A--B[x]; B[y]" )
+        self.assertIs( g1, g2 )
+        info = sp.parseCacheInfo()
+        self.assertEqual( info.hits, 1 )
+        self.assertEqual( info.misses, 1 )
+        self.assertEqual( info.currsize, 1 )
+
+    def test_cache_key_includes_join( self ):
+        g1 = parseGraphString( "A--B", joinAllowed=False )
+        g2 = parseGraphString( "A--B", joinAllowed=True )
+        self.assertIsNot( g1, g2 )
+        self.assertEqual( sp.parseCacheInfo().misses, 2 )
+
+    def test_cached_graph_frozen( self ):
+        g = parseGraphString( "A--B" )
+        self.assertTrue( nx.is_frozen( g ) )
+        with self.assertRaises( nx.NetworkXError ):
+            g.add_edge( 'B', 'C' )
+        self.assertNotIn( 'C', parseGraphString( "A--B" ).nodes )
+
+        # Copies are unfrozen
+        h = g.copy()
+        h.add_edge( 'B', 'C' )
+        self.assertIn( 'C', h.nodes )
+
+    def test_cached_attributes_read_only( self ):
+        g = parseGraphString( "A[x]; B[y]; A--B [e]" )
+        with self.assertRaises( TypeError ):
+            g.nodes['A']['tag'] = 'zzz'
+        with self.assertRaises( TypeError ):
+            g.edges['A', 'B']['tag'] = 'zzz'
+        with self.assertRaises( TypeError ):
+            del g.nodes['B']['tag']
+        self.assertEqual( parseGraphString( "A[x]; B[y]; A--B [e]" ).nodes['A']['tag'], 'x' )
+
+        r = parseGraphString( "A^B[x]; C", joinAllowed=True )
+        with self.assertRaises( TypeError ):
+            r.graph['rename']['A'] = 'Q'
+        with self.assertRaises( TypeError ):
+            r.graph['join'] = {}
+        self.assertEqual( parseGraphString( "A^B[x]; C", joinAllowed=True ).graph['rename']['A'],
+                          r.graph['rename']['B'] )
+
+        # Copies, including directed ones, can be modified.
+        for h in [ g.copy(), g.to_directed() ]:
+            h.nodes['A']['tag'] = 'zzz'
+            h.edges['A', 'B']['tag'] = 'f'
+            h.graph['new'] = 1
+        self.assertEqual( g.nodes['A']['tag'], 'x' )
+        self.assertEqual( g.edges['B', 'A']['tag'], 'e' )
+
+    def test_cache_eviction( self ):
+        sp.parseCache.maxSize = 2
+        g1 = parseGraphString( "A" )
+        parseGraphString( "B" )
+        parseGraphString( "A" )
+        parseGraphString( "C" )
+        # B was least recently used
+        self.assertEqual( sp.parseCacheInfo().currsize, 2 )
+        self.assertIs( parseGraphString( "A" ), g1 )
+        self.assertIn( ( "C", False ), sp.parseCache.entries )
+        self.assertNotIn( ( "B", False ), sp.parseCache.entries )
+
+    def test_cache_disabled( self ):
+        sp.parseCache.maxSize = 0
+        g1 = parseGraphString( "A--B" )
+        g2 = parseGraphString( "A--B" )
+        self.assertIsNot( g1, g2 )
+        self.assertFalse( nx.is_frozen( g1 ) )
+
+    def test_grammar_shares_graphs( self ):
+        g = parseGraphGrammar( """{
+  "A[x]" : [ "A[y]", "A[z]" ],
+  "A[w]" : [ "A[y]", "A[x]" ]
+}""" )
+        rights = [ r for (_, r) in g.rulesIter() ]
+        self.assertEqual( len( rights ), 4 )
+        self.assertEqual( len( set( id( r ) for r in rights ) ), 3 )
+        
+    def test_grammar_directed_once( self ):
+        g = parseGraphGrammar( """{
+  "A[x]; A--B" : "A[y]; A--B",
+  "A[y]; A->B" : "A[x]; B->A"
+}""" )
+        self.assertTrue( g.directed )
+        for ( l, r ) in g.rulesIter():
+            self.assertTrue( nx.is_directed( l ) )
+            self.assertTrue( nx.is_directed( r ) )
+        self.assertEqual( [ r.left for r in g.directedGrammar().rules ],
+                          [ r.left for r in g.rules ] )
+
+        u = parseGraphGrammar( '{ "A[x]; A--B" : "A[y]; A--B" }' )
+        self.assertFalse( u.directed )
+        d = u.directedGrammar()
+        self.assertIs( u.directedGrammar(), d )
+        self.assertEqual( len( next( d.rulesIter() )[0].edges ), 2 )
+
 class TestGrammarParsing(unittest.TestCase):
     showErrors = False
     
@@ -452,6 +561,52 @@ class TestGrammarParsing(unittest.TestCase):
         if self.showErrors:
             x.prettyPrint()
         self.assertEqual( x.right, "A<->B" )
+
+    def assertSameGraph( self, g1, g2 ):
+        self.assertEqual( nx.is_directed( g1 ), nx.is_directed( g2 ) )
+        self.assertEqual( list( g1.nodes( data=True ) ),
+                          list( g2.nodes( data=True ) ) )
+        self.assertEqual( list( g1.edges( data=True ) ),
+                          list( g2.edges( data=True ) ) )
+        self.assertEqual( g1.graph, g2.graph )
+        
+    def test_parallel_grammar(self):
+        serial = parseGraphGrammar( v01a )
+        # Otherwise every graph would come from the cache, not a worker.
+        sp.clearParseCache()
+        parallel = parseGraphGrammar( v01a, jobs=2 )
+        info = sp.parseCacheInfo()
+        self.assertEqual( info.misses, 0 )
+        self.assertEqual( info.currsize, len( set( sp._grammarGraphStrings( json.loads( v01a ) ) ) ) )
+        self.assertSameGraph( serial.start, parallel.start )
+        self.assertEqual( len( serial.rules ), len( parallel.rules ) )
+        for ( a, b ) in zip( serial.rulesIter(), parallel.rulesIter() ):
+            self.assertSameGraph( a[0], b[0] )
+            self.assertSameGraph( a[1], b[1] )
+
+    def test_parallel_merge(self):
+        g = parseGraphGrammar( '{ "A; B" : "A^B[x]; A->C" }', jobs=2 )
+        (l, r) = next( g.rulesIter() )
+        self.assertTrue( nx.is_directed( r ) )
+        self.assertEqual( r.graph['join'], { 'B' : 'A' } )
+        self.assertEqual( r.graph['rename']['B'], 'A' )
+        
+    def test_parallel_failed_choice(self):
+        badGrammar5 = """{
+  "start" : "X--Y",
+  "A--B" : [ "A--C--B", "A<->B" ],
+  "C--D" : "C<=>D"
+}
+"""
+        with self.assertRaises( ParseError ) as cm:
+            g = parseGraphGrammar( badGrammar5, jobs=2 )
+
+        x = cm.exception
+        if self.showErrors:
+            x.prettyPrint()
+        # The first error in the file is reported, as in the serial parser.
+        self.assertEqual( x.right, "A<->B" )
+        self.assertEqual( x.lineNumber, 3 )
         
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,167 @@
+"""Test persistent maps and graph history."""
+#
+#   test/test_persistent.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import random
+import networkx as nx
+from soffit.persistent import PersistentMap, GraphHistory
+from soffit.application import ApplicationState
+from soffit.parse import parseGraphGrammar
+from soffit.canonical import graphHash
+
+class CollidingKey(object):
+    def __init__( self, v ):
+        self.v = v
+
+    def __hash__( self ):
+        return 17
+
+    def __eq__( self, other ):
+        return isinstance( other, CollidingKey ) and self.v == other.v
+
+class TestPersistentMap(unittest.TestCase):
+    def test_against_dict( self ):
+        rng = random.Random( 1 )
+        m = PersistentMap()
+        d = {}
+        versions = []
+        for i in range( 5000 ):
+            k = rng.randrange( 1000 )
+            if rng.random() < 0.3:
+                m = m.delete( k )
+                d.pop( k, None )
+            else:
+                m = m.set( k, i )
+                d[k] = i
+            if i % 500 == 0:
+                versions.append( ( m, dict( d ) ) )
+
+        self.assertEqual( len( m ), len( d ) )
+        self.assertEqual( dict( m.items() ), d )
+        # Old versions are unaffected by later changes.
+        for ( old, expected ) in versions:
+            self.assertEqual( dict( old ), expected )
+
+    def test_collisions( self ):
+        keys = [ CollidingKey( i ) for i in range( 5 ) ]
+        m = PersistentMap( ( k, k.v ) for k in keys )
+        self.assertEqual( len( m ), 5 )
+        for k in keys:
+            self.assertEqual( m[k], k.v )
+        for k in keys[:4]:
+            m = m.delete( k )
+        self.assertEqual( len( m ), 1 )
+        self.assertNotIn( keys[0], m )
+        self.assertEqual( m[keys[4]], 4 )
+
+    def test_missing( self ):
+        m = PersistentMap( [ ( 1, "a" ) ] )
+        with self.assertRaises( KeyError ):
+            m[2]
+        self.assertIs( m.delete( 2 ), m )
+        self.assertEqual( len( m.delete( 1 ) ), 0 )
+
+growGrammar = """{
+    "version" : "0.1",
+    "start" : "A[x]; B[y]; A--B",
+    "X[x]; Y[y]; X--Y" : [ "X[y]; Y[x]; X--Y--Z; Z[z]",
+                           "X^Y[x]; X--Z; Z[y]; X--X[loop]" ],
+    "X[z]" : "X[x]; X--Y; Y[y]",
+    "X[z]; X--Y" : "Y"
+}"""
+
+class TestGraphHistory(unittest.TestCase):
+    def assertSameGraph( self, g, h ):
+        self.assertEqual( nx.is_directed( g ), nx.is_directed( h ) )
+        self.assertEqual( sorted( ( n, dict( d ) ) for ( n, d ) in g.nodes( data=True ) ),
+                          sorted( ( n, dict( d ) ) for ( n, d ) in h.nodes( data=True ) ) )
+        self.assertEqual( sorted( ( min( a, b ), max( a, b ), dict( d ) )
+                                  for ( a, b, d ) in g.edges( data=True ) ),
+                          sorted( ( min( a, b ), max( a, b ), dict( d ) )
+                                  for ( a, b, d ) in h.edges( data=True ) ) )
+
+    def test_snapshots_match_copies( self ):
+        random.seed( 3 )
+        grammar = parseGraphGrammar( growGrammar )
+        copies = []
+        app = ApplicationState( initialGraph = grammar.start,
+                                grammar = grammar,
+                                callback = lambda i, g : copies.append( g.copy() ) )
+        app.verbose = False
+        app.recordHistory()
+        app.run( maxIterations = 30 )
+
+        self.assertGreater( len( copies ), 10 )
+        # The callback runs once before the first iteration, as does
+        # recordHistory.
+        self.assertEqual( len( app.history.snapshots ), len( copies ) )
+        for ( s, c ) in zip( app.history.snapshots, copies ):
+            self.assertSameGraph( s, c )
+            self.assertEqual( s.graph['nextId'], c.graph['nextId'] )
+
+    def test_renumbered( self ):
+        # Every rewrite deletes a node and adds another.
+        grammar = parseGraphGrammar( """{
+            "version" : "0.1",
+            "start" : "A[a]; B; C[a]; A--B--C",
+            "X[a]; X--Y" : "Z[a]; Z--Y"
+        }""" )
+        random.seed( 4 )
+        copies = []
+        renumbered = []
+        def callback( i, g ):
+            copies.append( g.copy() )
+            if app.renumbered is not None:
+                renumbered.append( app.renumbered )
+            self.assertEqual( app.graphHash(), graphHash( g ) )
+
+        app = ApplicationState( initialGraph = grammar.start,
+                                grammar = grammar,
+                                callback = callback )
+        app.verbose = False
+        app.recordHistory()
+        app.trackHash()
+        app.run( maxIterations = 200 )
+
+        self.assertGreater( len( renumbered ), 1 )
+        self.assertLess( app.graph.graph['nextId'], 100 )
+        self.assertEqual( len( app.history.snapshots ), len( copies ) )
+        for ( s, c ) in zip( app.history.snapshots, copies ):
+            self.assertSameGraph( s, c )
+
+    def test_read_only( self ):
+        g = nx.path_graph( 3 )
+        g.nodes[0]['tag'] = 'x'
+        h = GraphHistory( g )
+        s = h.snapshot( g )
+        with self.assertRaises( nx.NetworkXError ):
+            s.add_node( 5 )
+        with self.assertRaises( TypeError ):
+            s.nodes[0]['tag'] = 'y'
+        self.assertTrue( nx.is_isomorphic( s, g ) )
+        self.assertEqual( s.copy().nodes[0], { 'tag' : 'x' } )
+
+    def test_directed( self ):
+        g = nx.DiGraph( [ (0,1), (1,2) ] )
+        s = GraphHistory( g ).snapshot( g )
+        self.assertEqual( list( s.predecessors( 1 ) ), [ 0 ] )
+        self.assertEqual( list( s.successors( 1 ) ), [ 2 ] )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -222,5 +222,109 @@ class TestGraphRewrite(unittest.TestCase):
         ( n_s, n_d ) = self.find_any_tags( g2, 'src', 'dst' )
         self.assertEqual( g2.edges[n_s,n_d]['tag'], 'new' )
 
+    def test_script_cached(self):
+        self.perform_rewrite( l = "A[1]; B[2]",
+                              r = "A^B [3]",
+                              g = "X[1]; Y[2]; Z[4]; X--Y--Z" )
+        script = sg.RewriteScript.forRule( self.finder.left,
+                                           self.finder.right.right )
+        self.assertIs( self.rule.script, script )
+        self.assertEqual( script.merges, [ ('A', 'B', False) ] )
+        self.assertEqual( script.retagNodes, [ ('A', '3') ] )
+        self.assertEqual( script.addNodes, [] )
+
+    def test_merge_in_place(self):
+        mList = self.setup_rewrite( l = "A[1]; B[2]",
+                                    r = "A^B [3]",
+                                    g = "X[1]; Y[2]; Z[4]; X--Y--Z" )
+        g = self.before
+        g2 = sg.RuleApplication( self.finder, mList[0] ).result( copy=False )
+        self.assertIs( g2, g )
+        self.assertEqual( len( g2.nodes ), 2 )
+        for n in g2.nodes:
+            self.assertNotIn( 'contraction', g2.nodes[n] )
+
+    def bad_match( self, l, r, g ):
+        """Set up a rule that deletes node B, and a match onto the host
+        graph's node Y, which has an edge not accounted for by the rule."""
+        self.setup_rewrite( l, r, g )
+        ( x, y, z ) = self.find_any_tags( self.before, 'x', 'y', 'z' )
+        m = sg.Match()
+        m.addMap( 'A', x )
+        m.addMap( 'B', y )
+        return sg.RuleApplication( self.finder, m )
+
+    def test_verify_levels(self):
+        for ( l, r, g ) in [ ( "A--B", "A", "X[x]; Y[y]; Z[z]; X--Y--Z" ),
+                             ( "A->B", "A", "X[x]; Y[y]; Z[z]; X->Y<-Z" ),
+                             ( "A->B", "A", "X[x]; Y[y]; Z[z]; X->Y->Z" ) ]:
+            rule = self.bad_match( l, r, g )
+            with self.assertRaises( sg.MatchError ):
+                rule.verify( sg.VERIFY_LOCAL )
+            with self.assertRaises( sg.MatchError ):
+                rule.verify( sg.VERIFY_FULL )
+            rule.verify( sg.VERIFY_OFF )
+            with self.assertRaises( ValueError ):
+                rule.verify( "sometimes" )
+
+        rule = self.bad_match( "A->B", "A", "X[x]; Y[y]; Z[z]; X->Y; Z" )
+        rule.verify( sg.VERIFY_LOCAL )
+        rule.verify( sg.VERIFY_FULL )
+
+    def edge_list( self, g ):
+        if nx.is_directed( g ):
+            return sorted( g.edges( data=True ) )
+        else:
+            return sorted( ( min( a, b ), max( a, b ), d )
+                           for ( a, b, d ) in g.edges( data=True ) )
+
+    def assertUndone( self, l, r, g ):
+        mList = self.setup_rewrite( l, r, g )
+        g = self.before
+        nodes = sorted( g.nodes( data=True ) )
+        edges = self.edge_list( g )
+        nextId = g.graph['nextId']
+        for m in mList:
+            log = sg.UndoLog()
+            sg.RuleApplication( self.finder, m ).result( copy=False, undo=log )
+            log.rollback( g )
+            self.assertEqual( len( log ), 0 )
+            self.assertEqual( sorted( g.nodes( data=True ) ), nodes )
+            self.assertEqual( self.edge_list( g ), edges )
+            self.assertEqual( g.graph['nextId'], nextId )
+
+    def test_undo(self):
+        self.assertUndone( l = "A[left]; B[right]; A--B",
+                           r = "A; B[left]; C[right]; A--B--C",
+                           g = "X[left]; Y[right]; Z[head]; Z--X--Y" )
+        self.assertUndone( l = "A[target]; A--B; A--C; A--D",
+                           r = "B^C^D [star]; B--D",
+                           g = "X[target]; L--X--R; X--S; L--R [old]" )
+        self.assertUndone( l = "A[1]; B[2]",
+                           r = "A^B [3]; A--C [new]",
+                           g = "X[1]; Y[2]; Z[4]; X--Y; X--Z [p]; Y--Z [q]" )
+        self.assertUndone( l = "A->B [target];",
+                           r = "A[src]; B[dst]; B->A [new]",
+                           g = "X->Y [target]; Y->X [not];" )
+        self.assertUndone( l = "A->B; B[x]",
+                           r = "A^B",
+                           g = "X->Y; Y->Y; Y[x]; Y->X [back]" )
+
+    def test_undo_mark(self):
+        mList = self.setup_rewrite( l = "A[a]",
+                                    r = "A[a]; A--B[a]",
+                                    g = "X[a]" )
+        g = self.before
+        log = sg.UndoLog()
+        sg.RuleApplication( self.finder, mList[0] ).result( copy=False, undo=log )
+        mark = log.mark()
+        self.finder.rightSide( self.finder.right.right )
+        sg.RuleApplication( self.finder, mList[0] ).result( copy=False, undo=log )
+        self.assertEqual( len( g.nodes ), 3 )
+        log.rollback( g, mark )
+        self.assertEqual( len( g.nodes ), 2 )
+        log.rollback( g )
+        self.assertEqual( len( g.nodes ), 1 )
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,92 @@
+"""Test backtracking derivation search."""
+#
+#   test/test_search.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import random
+import networkx as nx
+from soffit.parse import parseGraphGrammar
+from soffit.graph import graphIdentifiersToNumbers
+from soffit.search import DerivationSearch
+
+chainGrammar = """{
+    "version" : "0.1",
+    "start" : "A[end]",
+    "X[end]" : [ "X[dead]",
+                 "X--Y; Y[end]",
+                 "X[done]" ]
+}"""
+
+def hasTag( g, tag ):
+    return any( t == tag for ( n, t ) in g.nodes( data='tag' ) )
+
+class TestDerivationSearch(unittest.TestCase):
+    def setUp( self ):
+        self.grammar = parseGraphGrammar( chainGrammar )
+        self.start = graphIdentifiersToNumbers( self.grammar.start )
+
+    def snapshot( self, g ):
+        return ( sorted( g.nodes( data=True ) ),
+                 sorted( ( min( a, b ), max( a, b ), d )
+                         for ( a, b, d ) in g.edges( data=True ) ),
+                 g.graph['nextId'] )
+
+    def test_backtracking( self ):
+        goal = lambda g : len( g ) == 3 and hasTag( g, 'done' )
+        s = DerivationSearch( self.grammar, goal, maxDepth = 5 )
+        path = s.search( self.start )
+        self.assertIsNotNone( path )
+        self.assertEqual( len( path ), 3 )
+        self.assertTrue( goal( s.graph ) )
+        self.assertIs( s.graph, self.start )
+        self.assertTrue( nx.is_tree( s.graph ) )
+        # The dead ends were tried first.
+        self.assertGreater( s.branches, len( path ) )
+
+    def test_failure_restores( self ):
+        before = self.snapshot( self.start )
+        s = DerivationSearch( self.grammar, lambda g : hasTag( g, 'never' ),
+                              maxDepth = 4 )
+        self.assertIsNone( s.search( self.start ) )
+        self.assertEqual( self.snapshot( self.start ), before )
+        # 3 choices at each of 4 levels, but only one continues.
+        self.assertEqual( s.branches, 12 )
+
+    def test_prune( self ):
+        goal = lambda g : len( g ) == 3
+        s = DerivationSearch( self.grammar, goal,
+                              prune = lambda g, depth : len( g ) >= 2 )
+        self.assertIsNone( s.search( self.start ) )
+
+    def test_max_branches( self ):
+        before = self.snapshot( self.start )
+        s = DerivationSearch( self.grammar, lambda g : len( g ) == 10,
+                              maxBranches = 5 )
+        self.assertIsNone( s.search( self.start ) )
+        self.assertEqual( s.branches, 5 )
+        self.assertEqual( self.snapshot( self.start ), before )
+
+    def test_random_order( self ):
+        goal = lambda g : len( g ) == 4 and hasTag( g, 'done' )
+        s = DerivationSearch( self.grammar, goal, rng = random.Random( 7 ) )
+        path = s.search( self.start )
+        self.assertEqual( len( path ), 4 )
+        self.assertTrue( goal( s.graph ) )
+
+if __name__ == '__main__':
+    unittest.main()
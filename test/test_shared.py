@@ -0,0 +1,186 @@
+"""Test graph snapshots in shared memory."""
+#
+#   test/test_shared.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import pickle
+import networkx as nx
+import soffit.generate as gen
+import soffit.graph as sg
+import soffit.parallel as parallel
+from soffit.shared import SharedSnapshot, SharedGraph, SnapshotPublisher, StaleSnapshot
+from soffit.parse import parseGraphString
+from test.test_compact import tagged
+
+def matches( g, left, right = None ):
+    g.graph['node_tag_cache'] = {}
+    g.graph['edge_tag_cache'] = {}
+    finder = sg.MatchFinder( g, already_labeled = True )
+    finder.leftSide( parseGraphString( left ) )
+    if right is not None:
+        finder.rightSide( parseGraphString( right, joinAllowed = True ) )
+    return set( finder.matches() )
+
+class TestSharedGraph(unittest.TestCase):
+    def setUp( self ):
+        self.snapshots = []
+
+    def tearDown( self ):
+        for s in self.snapshots:
+            s.close()
+
+    def share( self, g ):
+        s = SharedSnapshot( g )
+        self.snapshots.append( s )
+        view = s.handle().attach()
+        self.addCleanup( view.close )
+        return view
+
+    def test_same_graph( self ):
+        for text in [ "A[x]; B; A--B [e]; B--C--A; C--C [loop]",
+                      "A[x]; A->B [e]; B->A; B->C; C[y]; C->C" ]:
+            g = sg.graphIdentifiersToNumbers( parseGraphString( text ) )
+            g.remove_node( 1 )
+            view = self.share( g )
+            self.assertEqual( tagged( view ), tagged( g ) )
+            self.assertEqual( len( view ), len( g ) )
+            self.assertEqual( view.number_of_edges(), g.number_of_edges() )
+            self.assertEqual( view.is_directed(), g.is_directed() )
+            self.assertFalse( view.has_node( 1 ) )
+            self.assertEqual( view.graph['nextId'], g.graph['nextId'] )
+            for n in g:
+                self.assertEqual( view.degree( n ), g.degree( n ) )
+                self.assertEqual( sg.DegreeIndex.key( view, n ),
+                                  sg.DegreeIndex.key( g, n ) )
+            self.assertEqual( tagged( view.copy() ), tagged( g ) )
+
+    def test_same_matches( self ):
+        g = gen.squareGrid( 6, 6, nodeTags = "x" )
+        g.nodes[9]['tag'] = "y"
+        g.nodes[27]['tag'] = "y"
+        view = self.share( g )
+        for ( l, r ) in [ ( "A[x]; B[x]; C[x]; D[x]; A--B--D--C--A", "A[x]; B[x]; C[x]; D[x]" ),
+                          ( "A[x]; B[y]; C[x]; A--B--C", None ),
+                          ( "A[x]; B[y]; C[x]; A--B--C", "A[x]; C[x]" ),
+                          ( "A[y]; B[y]", "A^B[y]" ) ]:
+            self.assertEqual( matches( view, l, r ), matches( g, l, r ) )
+
+        g = gen.squareGrid( 5, 5, nodeTags = "x" ).to_directed()
+        view = self.share( g )
+        l = "A[x]; B[x]; C[x]; A->B->C->A"
+        self.assertEqual( matches( view, l ), matches( g, l ) )
+
+    def test_read_only( self ):
+        view = self.share( gen.squareGrid( 3, 3, nodeTags = "x" ) )
+        with self.assertRaises( nx.NetworkXError ):
+            view.add_edge( 0, 4 )
+        with self.assertRaises( nx.NetworkXError ):
+            view.remove_node( 0 )
+        with self.assertRaises( TypeError ):
+            view.nodes[0]['tag'] = "y"
+        c = view.copy()
+        c.nodes[0]['tag'] = "y"
+        c.add_edge( 0, 4 )
+        self.assertEqual( view.nodes[0]['tag'], "x" )
+        self.assertFalse( view.has_edge( 0, 4 ) )
+        # Pickling refers to the same snapshot.
+        again = pickle.loads( pickle.dumps( view ) )
+        self.addCleanup( again.close )
+        self.assertEqual( tagged( again ), tagged( view ) )
+
+    def test_version( self ):
+        g = sg.graphIdentifiersToNumbers( parseGraphString( "X[a]" ) )
+        self.assertEqual( sg.graphVersion( g ), 0 )
+        finder = sg.MatchFinder( g )
+        finder.leftSide( parseGraphString( "A[a]" ) )
+        finder.rightSide( parseGraphString( "A[a]; A--B[a]" ) )
+        log = sg.UndoLog()
+        sg.RuleApplication( finder, finder.matches()[0] ).result( copy=False, undo=log )
+        self.assertEqual( sg.graphVersion( g ), 1 )
+        log.rollback( g )
+        self.assertEqual( sg.graphVersion( g ), 2 )
+
+    def test_stale( self ):
+        g = gen.squareGrid( 3, 3, nodeTags = "x" )
+        publisher = SnapshotPublisher()
+        self.addCleanup( publisher.close )
+        s = publisher.publish( g )
+        self.assertIs( publisher.publish( g ), s )
+        view = s.handle().attach()
+        self.addCleanup( view.close )
+        view.check()
+
+        finder = sg.MatchFinder( g )
+        finder.leftSide( parseGraphString( "A[x]" ) )
+        finder.rightSide( parseGraphString( "A[y]" ) )
+        sg.RuleApplication( finder, finder.matches()[0] ).result( copy=False )
+
+        s2 = publisher.publish( g )
+        self.assertIsNot( s2, s )
+        self.assertEqual( s2.version, s.version + 1 )
+        # The old snapshot is still mapped, but marked out of date.
+        self.assertTrue( view.stale() )
+        self.assertEqual( len( view ), 9 )
+        with self.assertRaises( StaleSnapshot ):
+            view.check()
+        with self.assertRaises( FileNotFoundError ):
+            SharedGraph( s.handle().name )
+
+        view2 = s2.handle().attach()
+        self.addCleanup( view2.close )
+        self.assertFalse( view2.stale() )
+        self.assertEqual( sorted( view2.nodes( data='tag' ) ),
+                          sorted( g.nodes( data='tag' ) ) )
+        self.assertIsNot( publisher.publish( g.copy() ), s2 )
+
+class TestSpawnedWorkers(unittest.TestCase):
+    def setUp( self ):
+        saved = parallel.startMethod
+        parallel.startMethod = "spawn"
+        self.addCleanup( setattr, parallel, 'startMethod', saved )
+
+    def matches( self, g, jobs, left ):
+        g.graph['node_tag_cache'] = {}
+        g.graph['edge_tag_cache'] = {}
+        finder = sg.MatchFinder( g, already_labeled = True )
+        finder.jobs = jobs
+        finder.fastPaths = False
+        finder.leftSide( parseGraphString( left ) )
+        return set( finder.matches() )
+
+    def test_same_matches( self ):
+        g = gen.squareGrid( 6, 6, nodeTags = "x" )
+        l = "A[x]; B[x]; C[x]; D[x]; A--B--D--C--A"
+        self.assertEqual( self.matches( g, 2, l ), self.matches( g, 1, l ) )
+        self.assertIsNotNone( parallel._publisher.snapshot )
+
+    def test_direct_edits( self ):
+        g = gen.squareGrid( 5, 5, nodeTags = "x" )
+        l = "A[x]; B[x]; C[x]; D[x]; A--B--D--C--A"
+        self.assertEqual( len( self.matches( g, 2, l ) ), 128 )
+        g.remove_edge( 0, 1 )
+        self.assertEqual( len( self.matches( g, 1, l ) ), 120 )
+        self.assertEqual( len( self.matches( g, 2, l ) ), 120 )
+
+        # A retag keeps the counts, so it must be announced.
+        g.nodes[6]['tag'] = "y"
+        sg.graphChanged( g )
+        self.assertEqual( self.matches( g, 2, l ), self.matches( g, 1, l ) )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""Guard the command-line startup path against heavy imports."""
+#
+#   test/test_startup.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import subprocess
+import sys
+import os
+
+# Modules which should only be loaded when a graph is actually rendered.
+# (networkx always loads its nx_agraph wrapper, but that only imports
+# pygraphviz when called.)
+renderingModules = [ "soffit.display", "matplotlib", "pygraphviz" ]
+
+# Modules which should only be loaded when worker processes are used.
+workerModules = [ "soffit.parallel", "soffit.shared", "multiprocessing",
+                  "concurrent.futures" ]
+
+checkImports = """
+import sys
+import soffit.application
+import soffit.graphfile
+print( " ".join( m for m in sys.modules ) )
+"""
+
+class TestStartup(unittest.TestCase):
+    def test_no_rendering_imports( self ):
+        root = os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) )
+        out = subprocess.check_output( [ sys.executable, "-c", checkImports ],
+                                       cwd = root )
+        loaded = set( out.decode( "utf-8" ).split() )
+        for m in renderingModules + workerModules:
+            self.assertNotIn( m, loaded )
+        
+if __name__ == '__main__':
+    unittest.main()
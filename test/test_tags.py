@@ -0,0 +1,89 @@
+"""Test tag interning."""
+#
+#   test/test_tags.py
+#
+#   Copyright 2019 Mark Gritter
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use this file except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+#
+
+import unittest
+import io
+import random
+from soffit.tags import TagTable, internTags, externTags
+from soffit.application import ApplicationState
+from soffit.parse import parseGraphString, parseGraphGrammar
+import soffit.graphfile as graphfile
+
+grammar = """{
+    "version" : "0.1",
+    "start" : "A[x]; A--B [e]",
+    "X[x]; X--Y [e]" : [ "X; X--Y [e]; X--Z; Z[x]; Z--W [e]",
+                         "X[y]; X--Y [f]" ],
+    "X[y]; X--Y [f]" : "X[x]; X--Y [e]; X--Z; Z[z]"
+}"""
+
+class TestTags(unittest.TestCase):
+    def test_roundtrip( self ):
+        g = parseGraphString( "A[x]; B[y]; C[x]; A->B [e]; B->C" )
+        table = TagTable()
+        h = internTags( g, table )
+        self.assertEqual( h.nodes['A']['tag'], h.nodes['C']['tag'] )
+        self.assertEqual( table.name( h.edges['A','B']['tag'] ), "e" )
+        self.assertNotIn( 'tag', h.edges['B','C'] )
+        self.assertIs( h.to_directed().graph['tags'], table )
+
+        back = externTags( h )
+        self.assertNotIn( 'tags', back.graph )
+        self.assertEqual( dict( back.nodes( data='tag' ) ), dict( g.nodes( data='tag' ) ) )
+        self.assertEqual( list( back.edges( data='tag' ) ), list( g.edges( data='tag' ) ) )
+        self.assertIs( externTags( g ), g )
+
+    def test_grammar_table( self ):
+        gg = parseGraphGrammar( grammar )
+        self.assertEqual( set( gg.tags.names[1:] ), set( "xyzef" ) )
+        interned = gg.internTags()
+        for ( left, right ) in interned.rulesIter():
+            for ( n, tag ) in left.nodes( data='tag' ):
+                self.assertTrue( tag is None or isinstance( tag, int ) )
+        self.assertEqual( len( gg.tags ), 6 )
+
+    def run_grammar( self, intern ):
+        random.seed( 7 )
+        gg = parseGraphGrammar( grammar )
+        app = ApplicationState( initialGraph = gg.start, grammar = gg )
+        app.verbose = False
+        if intern:
+            app.internTags()
+        app.run( maxIterations = 40 )
+        return app.graph
+
+    def test_application( self ):
+        plain = self.run_grammar( False )
+        interned = self.run_grammar( True )
+        self.assertGreater( len( plain ), 10 )
+        tags = set( t for ( n, t ) in interned.nodes( data='tag' ) )
+        self.assertTrue( all( isinstance( t, int ) for t in tags - set( [ None ] ) ) )
+        self.assertEqual( dict( externTags( interned ).nodes( data='tag' ) ),
+                          dict( plain.nodes( data='tag' ) ) )
+
+        f = io.StringIO()
+        graphfile.writers["edgelist"]( plain, f )
+        plainText = f.getvalue()
+        self.assertIn( "[z]", plainText )
+        f = io.StringIO()
+        graphfile.writers["edgelist"]( externTags( interned ), f )
+        self.assertEqual( f.getvalue(), plainText )
+
+if __name__ == '__main__':
+    unittest.main()